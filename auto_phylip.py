@@ -1,17 +1,147 @@
 '''
 auto_phylip contains functions to handle Phylip programs.
 '''
+import contextlib
 import csv
+import functools
+import operator
 import os
+import shutil
 import subprocess as sub
 import re
+import signal
+import sys
+import tempfile
+import threading
+import time
 
 phy_exec_default = ['phylip', 'dnapars']
 boot_exec_default = ['phylip', 'seqboot']
 cons_exec = ['phylip', 'consense']
+nbr_exec_default = ['phylip', 'neighbor']
 
 n_bootstrap_default = 1000
 
+# bump when the layout of the result cache, or what goes into its keys,
+# changes
+cache_version = 1
+cache_size_default = 10 * 2**30
+# how many stores to a cache may go by between scans of its size, as
+# others may store to it too
+cache_scan_interval = 100
+# the first line of a map of duplicates, before the checksum of its
+# *.phy file
+dup_checksum_tag = '# sha256 '
+
+# the models of DNA substitution `distance_matrix` can correct for
+lst_dist_model = ['p', 'jc', 'k2p']
+
+# the model of the runtime of each phylogeny program, in seconds, for
+# `estimate_cost`: `coef` * taxa**`taxa_exponent` * `taxa_base`**taxa *
+# length**`length_exponent`, for each replicate and jumble
+# The coefficients are rough; refit them to a log of actual runtimes with
+# `fit_cost_model`.
+dict_cost_model = {
+        'dnapars': dict(coef=2e-7, taxa_exponent=2, taxa_base=1,
+            length_exponent=1),
+        'dnacomp': dict(coef=2e-7, taxa_exponent=2, taxa_base=1,
+            length_exponent=1),
+        'dnaml': dict(coef=2e-5, taxa_exponent=2, taxa_base=1,
+            length_exponent=1),
+        # branch and bound takes time exponential in the number of taxa
+        'dnapenny': dict(coef=7e-7, taxa_exponent=0, taxa_base=3,
+            length_exponent=1),
+        'neighbor': dict(coef=2e-9, taxa_exponent=3, taxa_base=1,
+            length_exponent=0),
+        }
+# the number of taxa beyond which dnapenny is rarely practical
+penny_max_taxa = 11
+# cheaper programs, searching for trees by the same criterion, to
+# reroute a job to if it would take too long
+dict_reroute = {'dnapenny': 'dnapars'}
+
+# the characters PHYLIP reads as the weights 0 to 35 in a weights file
+weight_digits = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+# the functions which jobs in a queue may run, or be given as
+# arguments, by name; see `submit_jobs`
+lst_queue_func = ['run_phylip', 'run_seqboot', 'run_consense',
+        '_run_costed', '_print_progress']
+# how long, in seconds, a worker may hold a job from a queue without
+# renewing its lease, before the job is given to another worker
+lease_default = 300
+
+# how often, in seconds, to check a running PHYLIP program against its
+# time and memory limits
+poll_interval = 0.2
+
+# lines in the console output of PHYLIP programs that report how many
+# datasets, or replicates, have been done so far
+_reg_progress = re.compile(
+        r'(?:Data set #|completed replicate number|Replicate)\s*(\d+)')
+
+# where to record the time and resources used by each stage, if anywhere;
+# set with `start_trace`
+trace_file = None
+trace_format = 'jsonl'
+_trace_local = threading.local()
+
+# the size of each cache at its last scan, plus what has been stored to
+# it from here since, and the number of those stores
+_cache_usage = dict()
+_cache_lock = threading.Lock()
+
+class PhylipError(RuntimeError):
+    """
+    Raised when a PHYLIP program fails, exiting with a non-zero status,
+    or leaving output which cannot be right, such as an empty tree file.
+
+    Attributes
+    ----------
+    lst_exec : list
+        The command line args of the program.
+    returncode : int
+        Its exit status.
+    stderr : str
+        Its standard error.
+    """
+    def __init__(self, lst_exec, returncode, stderr='', reason=None):
+        self.lst_exec = lst_exec
+        self.returncode = returncode
+        self.stderr = stderr
+        if reason is None:
+            reason = 'exited with status {:d}.'.format(returncode)
+        msg = '{args} {reason}'.format(args=' '.join(lst_exec),
+                reason=reason)
+        # the last few lines are where PHYLIP says what went wrong
+        lst_line = [line for line in stderr.splitlines() if line.strip()]
+        if lst_line:
+            msg += ' Its error output ended:\n' + '\n'.join(lst_line[-5:])
+        RuntimeError.__init__(self, msg)
+
+class PhylipLimitError(PhylipError):
+    """
+    Raised when a PHYLIP program is killed for running over its time or
+    memory limit.
+
+    Attributes
+    ----------
+    limit : str
+        Which limit was exceeded, 'time' or 'memory'.
+    """
+    def __init__(self, lst_exec, limit, value):
+        self.lst_exec = lst_exec
+        self.returncode = None
+        self.stderr = ''
+        self.limit = limit
+        self.value = value
+        if limit == 'time':
+            msg = '{args} ran for more than {value:g} s.'
+        else:
+            msg = '{args} used more than {value:d} bytes of memory.'
+        RuntimeError.__init__(self, msg.format(
+            args=' '.join(lst_exec), value=value))
+
 def set_header_rev(header_rev):
     ## Switch some global variables based on header rev
     global id_col
@@ -32,6 +162,236 @@ def set_header_rev(header_rev):
         raise ValueError(
             'You have selected an invalid header_rev: {:s}'.format(header_rev))
 
+def start_trace(fname, fmt='jsonl', append=False):
+    """
+    Record the wall time, CPU time and I/O of each stage of every
+    following run to `fname`, one event per line.
+
+    Parameters
+    ----------
+    fname : str
+        The trace file, or None to stop tracing.
+    fmt : str, optional
+        'jsonl' for one JSON object per stage, or 'chrome' for the trace
+        event format read by chrome://tracing and Perfetto
+        (default: 'jsonl').
+    append : bool, optional
+        Add to an existing trace, e.g. from a worker process, rather
+        than starting a new one (default: False).
+
+    Notes
+    -----
+    Each event carries the stage name, its start time, `wall` and `cpu`
+    seconds, the `cpu_children` seconds of any PHYLIP programs it waited
+    for, `bytes_read` and `bytes_written`, and where known the `taxa`,
+    `length` and `bootstrap` count of its alignment and the `peak_rss`
+    of its PHYLIP program.
+    Events are appended a line at a time, so several processes can share
+    one trace file.
+    In the chrome format the closing bracket is left off, which the
+    format allows.
+    """
+    global trace_file
+    global trace_format
+    # imported here, rather than while timing the first stage
+    import json
+    if fmt not in ('jsonl', 'chrome'):
+        raise ValueError(
+            'You have selected an invalid trace format: {:s}'.format(fmt))
+    trace_file = fname
+    trace_format = fmt
+    if fname is None:
+        return None
+    with open(fname, 'a' if append else 'w') as f:
+        if fmt == 'chrome' and not os.path.getsize(fname):
+            f.write('[\n')
+    return fname
+
+def _trace_stack():
+    """
+    Get the stack of the stages running in this thread, each as a dict
+    of the info for its event and the I/O counted by the stages within.
+    """
+    if not hasattr(_trace_local, 'stack'):
+        _trace_local.stack = list()
+    return _trace_local.stack
+
+def _trace_note(**info):
+    """
+    Add `info`, e.g. the number of taxa, to the event of the innermost
+    stage running in this thread, if tracing.
+    """
+    if trace_file is not None and _trace_stack():
+        _trace_stack()[-1]['info'].update(
+                (key, value) for (key, value) in info.items()
+                if value is not None)
+
+@contextlib.contextmanager
+def _traced(stage, **info):
+    """
+    Record the body of the with statement as the stage `stage` in the
+    trace, if tracing, and yield the dict of info for its event.
+
+    The bytes read and written by a stage are those of this thread
+    outside of any stages within it, plus what those stages report; a
+    stage may report its own by setting them in the info dict, as is
+    done for PHYLIP programs.
+    """
+    frame = _trace_begin(stage, info)
+    try:
+        yield frame['info']
+    except BaseException as err:
+        _trace_end(frame, err)
+        raise
+    _trace_end(frame)
+
+def _trace_begin(stage, info, nested=True):
+    """
+    Start the event of the stage `stage`, with the info `info`, and
+    return its frame, for `_trace_end`.
+
+    A stage which is not `nested` is kept off the stack of the stages
+    running in this thread, so that it may be ended in another thread,
+    and its bytes read and written are only those it reports.
+    """
+    info = dict((key, value) for (key, value) in info.items()
+            if value is not None)
+    frame = dict(stage=stage, info=info, nested=nested,
+            io_inner=[0, 0], io_reported=[0, 0])
+    if trace_file is None:
+        return frame
+    if nested:
+        _trace_stack().append(frame)
+    frame['time_start'] = time.time()
+    frame['times_start'] = os.times()
+    frame['io_start'] = _thread_io()
+    frame['rss_start'] = _children_maxrss()
+    return frame
+
+def _trace_end(frame, err=None):
+    """
+    End the event of the stage started by `_trace_begin` as `frame`,
+    which failed with `err` if given, and write it to the trace.
+    """
+    info = frame['info']
+    if 'time_start' not in frame:
+        # not tracing when the stage began
+        return None
+    if err is not None:
+        info['error'] = type(err).__name__
+    if frame['nested']:
+        _trace_stack().pop()
+    wall = time.time() - frame['time_start']
+    times_start = frame['times_start']
+    times_end = os.times()
+    rss_end = _children_maxrss()
+    # a new high water mark for the children can only be from this
+    # stage, though a lower peak does not show up here at all
+    if rss_end > frame['rss_start']:
+        info['peak_rss'] = max(info.get('peak_rss', 0), rss_end)
+    if frame['nested']:
+        io_delta = [end - start
+                for (start, end) in zip(frame['io_start'], _thread_io())]
+    else:
+        io_delta = [0, 0]
+    for (iI, key) in enumerate(['bytes_read', 'bytes_written']):
+        info.setdefault(key, io_delta[iI] - frame['io_inner'][iI]
+                + frame['io_reported'][iI])
+    if frame['nested'] and _trace_stack():
+        outer = _trace_stack()[-1]
+        for (iI, key) in enumerate(['bytes_read', 'bytes_written']):
+            outer['io_inner'][iI] += io_delta[iI]
+            outer['io_reported'][iI] += info[key]
+    info['cpu'] = max(0.0, round(times_end[0] + times_end[1]
+            - times_start[0] - times_start[1], 6))
+    info['cpu_children'] = max(0.0, round(times_end[2] + times_end[3]
+            - times_start[2] - times_start[3], 6))
+    _write_trace_event(frame['stage'], frame['time_start'], wall, info)
+
+def _traced_call(stage):
+    """
+    Decorate a function so that each call is a stage `stage` in the
+    trace.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwarg):
+            with _traced(stage):
+                return func(*args, **kwarg)
+        return wrapper
+    return decorator
+
+def _write_trace_event(stage, time_start, wall, info):
+    """
+    Append a single event to the trace file, in the trace format.
+    """
+    import json
+    if trace_format == 'chrome':
+        event = dict(name=stage, cat='auto_phylip', ph='X',
+                ts=int(time_start * 1e6), dur=int(wall * 1e6),
+                pid=os.getpid(), tid=threading.current_thread().ident,
+                args=info)
+        line = json.dumps(event, sort_keys=True) + ',\n'
+    else:
+        event = dict(info, stage=stage, start=time_start,
+                wall=round(wall, 6), pid=os.getpid())
+        line = json.dumps(event, sort_keys=True) + '\n'
+    _append_line(trace_file, line)
+
+def _append_line(fname, line):
+    """
+    Append `line` to the file `fname` with a single write, which lands
+    whole, even with other processes appending to the same file.
+    """
+    fd = os.open(fname, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        os.write(fd, line.encode('utf-8'))
+    finally:
+        os.close(fd)
+
+def _thread_io():
+    """
+    Get the bytes read and written so far by this thread, from /proc, or
+    (0, 0) where that is not available.
+    """
+    dict_io = dict()
+    try:
+        with open('/proc/thread-self/io', 'r') as f:
+            for line in f:
+                (key, sep, value) = line.partition(':')
+                dict_io[key] = int(value)
+    except (IOError, OSError, ValueError):
+        pass
+    return (dict_io.get('rchar', 0), dict_io.get('wchar', 0))
+
+def _children_maxrss():
+    """
+    Get the largest peak resident memory, in bytes, of any child process
+    waited for so far, or 0 where that is not available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux reports this in KiB, and OS X in bytes
+    if sys.platform != 'darwin':
+        maxrss *= 1024
+    return maxrss
+
+def _phy_shape(fname):
+    """
+    Get the number of taxa and the alignment length of the *.phy file
+    `fname` from its first line, as a dict for `_trace_note`.
+    """
+    try:
+        with open(fname, 'r') as f:
+            (n_seq, len_seq) = f.readline().split()[:2]
+        return dict(taxa=int(n_seq), length=int(len_seq))
+    except (IOError, OSError, ValueError):
+        return dict()
+
+@_traced_call('tab2phy')
 def tab2phy(lst_tabfile, germline=None, outfile=None, **kwarg):
     """
     Generate a PHYLIP formatted *.phy file from a list of tabfiles.
@@ -51,8 +411,35 @@ def tab2phy(lst_tabfile, germline=None, outfile=None, **kwarg):
     flags : int
         This is a sum of flags to be passed to the regex compiler.
         (default: 0; default regex settings)
+    names : bool, optional
+        Also write a map from the names used in the *.phy file to the
+        full sequence IDs, to `basename`.names, for use with
+        `relabel_newick` (default: False).
+    collapse : bool, optional
+        Write only the first of each set of identical sequences, and a
+        map from each sequence kept to those it stands for to
+        `basename`.dups, for use with `expand_duplicates`
+        (default: False).
+    interleaved : bool, optional
+        Write the *.phy file in interleaved format (default: False).
+
+    Notes
+    -----
+    If a tabfile has an up to date index (see `index_tabfile`) of a
+    column for which `match` asks for an exact value, e.g. '^123$', only
+    the indexed rows are read.
     """
-    iter_dict_all_entries = _gather_entries_iter(lst_tabfile)
+    names = kwarg.pop('names', False)
+    collapse = kwarg.pop('collapse', False)
+    interleaved = kwarg.pop('interleaved', False)
+    # only regex matching without flags can be looked up in an index
+    if kwarg.get('flags', 0):
+        match_index = None
+    else:
+        match_index = kwarg.get('match')
+    iter_dict_all_entries = _gather_entries_iter(lst_tabfile,
+            columns=_entry_columns(kwarg.get('match')),
+            match=match_index)
     lst_dict_entries = _filter_entries(iter_dict_all_entries, **kwarg)
     if outfile == None and len(lst_tabfile) == 1:
         outfile = lst_tabfile[0].rpartition('.')[0] + '.phy'
@@ -60,9 +447,30 @@ def tab2phy(lst_tabfile, germline=None, outfile=None, **kwarg):
         outfile = 'file.phy'
     # print('''Used ({str_match}) for matching...'''.format(
     #     str_match=match))
-    lst_entries2phy(lst_dict_entries, outfile)
+    if names:
+        namefile = outfile.rpartition('.')[0] + '.names'
+    else:
+        namefile = None
+    if collapse:
+        dupfile = outfile.rpartition('.')[0] + '.dups'
+    else:
+        dupfile = None
+        # a map left by an earlier run with collapse is not for this file
+        _clear_files(outfile.rpartition('.')[0] + '.dups')
+    lst_entries2phy(lst_dict_entries, outfile, namefile=namefile,
+            dupfile=dupfile, interleaved=interleaved)
     return None
 
+def _entry_columns(match, *lst_col):
+    """
+    Get the tabfile columns needed to build *.phy files, and to filter
+    rows with `match`, along with any others in `lst_col`.
+    """
+    lst_col = [id_col, seq_col] + list(lst_col)
+    if match:
+        lst_col.extend(col for (col, str_match) in match)
+    return lst_col
+
 # id_col =
 # seq_col =
 def _entry2seqpair(entry):
@@ -77,76 +485,719 @@ def lst_entries2phy(lst_dict_entries, outfile, **kwarg):
     Write a list of tabfile entries `lst_dict_entries` to a PHYLIP formatted
     `outfile`.
 
+    The entries are written as they arrive, so only the names of the
+    sequences are held in memory, and a sequence of the wrong length
+    stops the writing straight away.
+
     Parameters
     ----------
-    lst_dict_entries : list
-        A list of dictionaries which each represent a row of data from a
-        tabfile.
+    lst_dict_entries : iterable
+        Dictionaries which each represent a row of data from a tabfile,
+        e.g. a lazy iterator of them.
     outfile : str
         A filename to which to output the PHYLIP formatted data.
         This is mandatory at this level, since there is no other way to
         handle coming up with an output filename given the args.
-    germline : str, optional, no-op
+    germline : str, optional
+        If provided, a germline sequence to write first, as 'Germline'.
+    namefile : str, optional
+        If provided, a file to which to write a map from the names used
+        in `outfile` to the full sequence IDs.
+    dupfile : str, optional
+        If provided, write only the first of each set of identical
+        sequences, and write a map from each sequence kept to the
+        sequences it stands for to this file.
+    interleaved : bool, optional
+        Write the file in PHYLIP interleaved format, for very long
+        sequences (default: False, one line per sequence).
 
     Returns
     -------
     None
     """
     germline = kwarg.pop('germline', None)
-    # lst_seqpairs is a list of tuples (sequence id <9-char>, sequence)
-    lst_seqpair = [_entry2seqpair(entry) for entry in lst_dict_entries]
-    if germline:
-        lst_seqpair = [('Germline', germline)] + lst_seqpair
-    # else:
-    #     dict_germline_seq = dict(
-    #         [(entry[clone_col], entry.get(dmask_col))
-    #         for entry in lst_dict_entries]
-    #         )
-    n_seq = len(lst_seqpair)
-    if n_seq == 0:
-        raise ValueError('''No matches found.''')
-    else:
-        print('Found {:d} matches.'.format(n_seq))
-    len_seq = len(lst_seqpair[0][1])
-    for seqpair in lst_seqpair:
-        if len(seqpair[1]) != len_seq:
-            raise ValueError('''Not all sequences are of the same length.''')
-    with open(outfile, 'wb') as f:
-        # write header info
-        f.write(_phyrow(n_seq, len_seq))
-        # write sequences from tabfile
-        for seqpair in lst_seqpair:
-            f.write(_phyrow(*seqpair))
+    namefile = kwarg.pop('namefile', None)
+    dupfile = kwarg.pop('dupfile', None)
+    interleaved = kwarg.pop('interleaved', False)
+    # lst_namepair is a list of tuples (sequence id <9-char>, sequence id)
+    lst_namepair = list()
+    lst_duppair = list()
+
+    def iter_seqpair():
+        if germline:
+            yield ('Germline', germline)
+        for entry in lst_dict_entries:
+            seqpair = _entry2seqpair(entry)
+            lst_namepair.append((seqpair[0], entry[id_col]))
+            yield seqpair
+
+    iter_out = iter_seqpair()
+    if dupfile:
+        iter_out = _iter_unique_seqpairs(iter_out, lst_duppair)
+    # the entries are usually read, parsed and filtered lazily, as they
+    # are written here
+    with _traced('write_phy'), \
+            PhyWriter(outfile, interleaved=interleaved) as writer:
+        writer.write_all(iter_out)
+        if writer.n_seq == 0:
+            raise ValueError('''No matches found.''')
+        _trace_note(taxa=writer.n_seq, length=writer.len_seq)
+    _trace_note(taxa=writer.n_seq, length=writer.len_seq)
+    print('Found {:d} matches.'.format(writer.n_seq))
+    if namefile:
+        write_name_map(lst_namepair, namefile)
+    if dupfile:
+        write_dup_map(lst_duppair, dupfile, outfile)
     return None
 
-def _gather_entries(lst_file):
+@_traced_call('tab2phy_clones')
+def tab2phy_clones(lst_tabfile, germline=False, outfile=None, **kwarg):
+    """
+    Generate one PHYLIP formatted *.phy file per clone from a list of
+    tabfiles, in a single pass over the tabfiles.
+
+    The rows are grouped by the clone column.
+    To keep memory and the number of open files bounded no matter how
+    many clones there are, the rows are first spread over a fixed
+    number of temporary bucket files by clone, and each bucket is then
+    read back and written out clone by clone.
+    Within each clone, rows keep the order in which they were read.
+
+    Parameters
+    ----------
+    lst_tabfile : list
+        A list of tabfiles from which to draw entries.
+    germline : bool, optional
+        Write the germline of each clone, taken from the germline column
+        of its first row, as the first sequence of its *.phy file
+        (default: False).
+    outfile : str, optional
+        The clone *.phy files are named after this, e.g. X_12.phy for
+        clone 12 with X.phy (default: named after the tabfile when there
+        is only one, and file.phy otherwise).
+    match : list of 2-tuple of str, optional
+        Filter the rows before grouping them, as with `tab2phy`.
+    flags : int, optional
+        The flags for the regex matching, as with `tab2phy`.
+    names : bool, optional
+        Also write a name map for each *.phy file, as with `tab2phy`
+        (default: False).
+    collapse : bool, optional
+        Collapse identical sequences within each clone, as with
+        `tab2phy` (default: False).
+    interleaved : bool, optional
+        Write the *.phy files in interleaved format (default: False).
+    n_buckets : int, optional
+        The number of temporary bucket files (default: 64).
+
+    Returns
+    -------
+    lst_phyfile : list of str
+        The *.phy files written, in the order their clones were first
+        seen within each bucket.
+    """
+    lst_phyfile = list(iter_tab2phy_clones(lst_tabfile, germline=germline,
+        outfile=outfile, **kwarg))
+    if len(lst_phyfile) == 0:
+        raise ValueError('''No matches found.''')
+    print('Wrote {:d} clone PHY files.'.format(len(lst_phyfile)))
+    return lst_phyfile
+
+def iter_tab2phy_clones(lst_tabfile, germline=False, outfile=None, **kwarg):
+    """
+    Generate the *.phy file of each clone as for `tab2phy_clones`, one
+    at a time.
+
+    The tabfiles are read through up front, but each *.phy file is only
+    written once the one before has been taken, so a consumer can keep
+    as few of them on disk at a time as it likes.
+
+    Yields
+    ------
+    phyfile : str
+        The *.phy file of the next clone, just written.
+    """
+    names = kwarg.pop('names', False)
+    collapse = kwarg.pop('collapse', False)
+    interleaved = kwarg.pop('interleaved', False)
+    n_buckets = kwarg.pop('n_buckets', 64)
+    if outfile == None and len(lst_tabfile) == 1:
+        outfile = lst_tabfile[0].rpartition('.')[0] + '.phy'
+    elif outfile == None:
+        outfile = 'file.phy'
+    prefix = outfile.rpartition('.')[0]
+    lst_col = [clone_col, dmask_col] if germline else [clone_col]
+    iter_dict_all_entries = _gather_entries_iter(lst_tabfile,
+            columns=_entry_columns(kwarg.get('match'), *lst_col))
+    iter_entries = _filter_entries(iter_dict_all_entries, **kwarg)
+    spool = tempfile.mkdtemp(prefix='.auto_phylip.',
+            dir=os.path.dirname(os.path.abspath(outfile)))
+    try:
+        lst_bucketname = [os.path.join(spool, '{:d}.tab'.format(iI))
+                for iI in range(n_buckets)]
+        lst_f = [open(bucketname, 'w') for bucketname in lst_bucketname]
+        try:
+            writer = [csv.writer(f, delimiter='\t') for f in lst_f]
+            for entry in iter_entries:
+                clone = entry[clone_col]
+                row = [clone, entry[id_col], entry[seq_col]]
+                if germline:
+                    row.append(entry[dmask_col])
+                # clones with the same filename share a bucket, so that
+                # which of them is renamed does not depend on the bucket
+                writer[_bucket_index(_clean_fname(clone), n_buckets)
+                        ].writerow(row)
+        finally:
+            for f in lst_f:
+                f.close()
+        for bucketname in lst_bucketname:
+            for phyfile in _bucket2phy(bucketname, prefix,
+                    germline=germline, names=names, collapse=collapse,
+                    interleaved=interleaved):
+                yield phyfile
+            _clear_files(bucketname)
+    finally:
+        shutil.rmtree(spool, ignore_errors=True)
+
+def _bucket_index(name, n_buckets):
+    """
+    Get the bucket of `tab2phy_clones` for the clone name `name`, from a
+    checksum, rather than `hash`, which changes from one process to the
+    next, so the clones come out in the same order on every run.
+    """
+    import zlib
+    if not isinstance(name, bytes):
+        name = name.encode('utf-8')
+    # crc32 is signed under python 2
+    return (zlib.crc32(name) & 0xffffffff) % n_buckets
+
+def _bucket2phy(bucketname, prefix, germline=False, names=False,
+        collapse=False, interleaved=False):
+    """
+    Write a *.phy file for each clone in a bucket file written by
+    `tab2phy_clones`, yielding each as it is written.
+
+    A clone whose ID comes out the same as one before it once made fit
+    for a filename, e.g. A:1 after A/1, gets a short hash of its ID
+    added to its filenames, with a warning, rather than overwriting the
+    files of the other.
+    """
+    import hashlib
+    set_name = set()
+    dict_clone = dict()
+    lst_clone = list()
+    with open(bucketname, 'r') as f:
+        for row in csv.reader(f, delimiter='\t'):
+            if row[0] not in dict_clone:
+                dict_clone[row[0]] = list()
+                lst_clone.append(row[0])
+            dict_clone[row[0]].append(row)
+    for clone in lst_clone:
+        lst_row = dict_clone.pop(clone)
+        lst_dict_entries = [{id_col: row[1], seq_col: row[2]}
+                for row in lst_row]
+        name = _clean_fname(clone)
+        if name in set_name:
+            if not isinstance(clone, bytes):
+                digest = hashlib.sha1(clone.encode('utf-8')).hexdigest()
+            else:
+                digest = hashlib.sha1(clone).hexdigest()
+            name_clean = name
+            name = '{name}_{digest}'.format(name=name, digest=digest[:8])
+            print('Warning: another clone is already written as '
+                    '{name_clean}, so clone {clone} is written as '
+                    '{name}.'.format(name_clean=name_clean, clone=clone,
+                        name=name))
+        set_name.add(name)
+        phyfile = '{prefix}_{clone}.phy'.format(prefix=prefix, clone=name)
+        if names:
+            namefile = phyfile.rpartition('.')[0] + '.names'
+        else:
+            namefile = None
+        if collapse:
+            dupfile = phyfile.rpartition('.')[0] + '.dups'
+        else:
+            dupfile = None
+            _clear_files(phyfile.rpartition('.')[0] + '.dups')
+        lst_entries2phy(lst_dict_entries, phyfile,
+                germline=lst_row[0][3] if germline else None,
+                namefile=namefile,
+                dupfile=dupfile,
+                interleaved=interleaved)
+        yield phyfile
+
+def _clean_fname(name):
+    """
+    Replace any characters of `name` which do not belong in a filename.
+    """
+    return re.sub(r'[^\w\-]', '_', name)
+
+def _collapse_seqpairs(iter_seqpair):
+    """
+    Keep only the first of each set of identical sequences.
+
+    Sequences are compared by their SHA-1 digests, so only a digest per
+    distinct sequence needs to be held in memory on top of the output.
+
+    Returns
+    -------
+    lst_seqpair : list of 2-tuple
+        The (name, sequence) pairs kept, in their original order.
+    lst_duppair : list of 2-tuple
+        Pairs of the name of a sequence kept, and the name of a sequence
+        it stands for.
+    """
+    lst_duppair = list()
+    lst_seqpair = list(_iter_unique_seqpairs(iter_seqpair, lst_duppair))
+    return (lst_seqpair, lst_duppair)
+
+def _iter_unique_seqpairs(iter_seqpair, lst_duppair):
+    """
+    Yield the first of each set of identical sequences as they come,
+    and append the pairs of the name of the sequence kept and the name
+    of each duplicate to `lst_duppair`.
+    """
+    import hashlib
+    dict_rep = dict()
+    for (name, sequence) in iter_seqpair:
+        digest = hashlib.sha1(str(sequence).encode('ascii')).digest()
+        if digest in dict_rep:
+            lst_duppair.append((dict_rep[digest], name))
+        else:
+            dict_rep[digest] = name
+            yield (name, sequence)
+
+@_traced_call('collapse_duplicates')
+def collapse_duplicates(phy_in, phy_out=None, dupfile=None):
+    """
+    Write a copy of a *.phy file with only the first of each set of
+    identical sequences, and a map from each sequence kept to the
+    sequences it stands for.
+    The copy is interleaved if the original is.
+
+    Parameters
+    ----------
+    phy_in : str
+        The *.phy file to collapse.
+    phy_out : str, optional
+        The collapsed *.phy file (default: `basename`.uniq.phy).
+    dupfile : str, optional
+        The map of duplicates (default: named after `phy_out`, with the
+        extension .dups).
+
+    Returns
+    -------
+    phy_out : str
+    """
+    basename = phy_in.rpartition('.')[0]
+    if phy_out is None:
+        phy_out = basename + '.uniq.phy'
+    if dupfile is None:
+        dupfile = phy_out.rpartition('.')[0] + '.dups'
+    lst_duppair = list()
+    with PhyWriter(phy_out, interleaved=_phy_interleaved(phy_in)) as writer:
+        writer.write_all(_iter_unique_seqpairs(_iter_phy_seqpairs(phy_in),
+            lst_duppair))
+    write_dup_map(lst_duppair, dupfile, phy_out)
+    print('Collapsed {n:d} sequences into {n_uniq:d}.'.format(
+        n=writer.n_seq + len(lst_duppair), n_uniq=writer.n_seq))
+    return phy_out
+
+def _iter_phy_seqpairs(fname):
+    """
+    Iterate over the (name, sequence) pairs of a *.phy file, such as
+    those written by `lst_entries2phy`.
+
+    A file with one line per sequence is streamed; an interleaved one is
+    read whole, with `Alignment.from_phy`.
+    """
+    if _phy_interleaved(fname):
+        for seqpair in Alignment.from_phy(fname).seqpairs():
+            yield seqpair
+        return
+    with open(fname, 'r') as f:
+        n_seq = int(f.readline().split()[0])
+        for iI in range(n_seq):
+            line = f.readline().rstrip('\r\n')
+            yield (line[:10].strip(), line[10:].replace(' ', ''))
+
+def write_dup_map(lst_duppair, fname, phyfile):
+    """
+    Write a map of duplicates, as two tab separated columns as for
+    `write_name_map`, after a line with the checksum of the *.phy file
+    `phyfile` it goes with, which `_find_dup_map` checks.
+    """
+    with open(fname, 'w') as f:
+        f.write('{tag}{digest}\n'.format(tag=dup_checksum_tag,
+            digest=_file_hash(phyfile)))
+        for (name, dup_name) in lst_duppair:
+            f.write('{name}\t{dup}\n'.format(name=name, dup=dup_name))
+    return fname
+
+def read_dup_map(fname):
+    """
+    Read a map of duplicates written by `collapse_duplicates` or
+    `lst_entries2phy` into a dict from each sequence kept to the list of
+    sequences it stands for.
+    """
+    dict_dup = dict()
+    with open(fname, 'r') as f:
+        for line in f:
+            if line.startswith(dup_checksum_tag):
+                continue
+            (name, sep, dup_name) = line.rstrip('\r\n').partition('\t')
+            dict_dup.setdefault(name, list()).append(dup_name)
+    return dict_dup
+
+def _find_dup_map(phyfile):
+    """
+    Get the map of duplicates of the *.phy file `phyfile`,
+    `basename`.dups, or None if there is none written for this file.
+
+    A map which records the checksum of another file, e.g. one left
+    from an earlier version of `phyfile`, is ignored with a warning.
+    """
+    dupfile = phyfile.rpartition('.')[0] + '.dups'
+    if not os.path.exists(dupfile):
+        return None
+    with open(dupfile, 'r') as f:
+        line = f.readline()
+    # maps written before the checksum was recorded are taken on trust
+    if (line.startswith(dup_checksum_tag)
+            and line[len(dup_checksum_tag):].strip() != _file_hash(phyfile)):
+        print('Ignoring {dupfile}, which was written for another version '
+                'of {phyfile}'.format(dupfile=dupfile, phyfile=phyfile))
+        return None
+    return dupfile
+
+@_traced_call('expand_duplicates')
+def expand_duplicates(fname_tree, dupfile, fname_out=None):
+    """
+    Graft the sequences collapsed by `collapse_duplicates` back onto the
+    trees in a tree file.
+
+    Each leaf which stands for other sequences is replaced by a node, on
+    the leaf's branch, with the leaf and its duplicates as children on
+    branches of length zero.
+    The trees are read and written one at a time.
+
+    Parameters
+    ----------
+    fname_tree : str
+        The tree file to expand.
+    dupfile : str
+        The map of duplicates.
+    fname_out : str, optional
+        The file to write (default: overwrite `fname_tree`).
+
+    Returns
+    -------
+    fname_out : str
+    """
+    if fname_out is None:
+        fname_out = fname_tree
+    dict_dup = read_dup_map(dupfile)
+    # unquoted underscores in tree labels are read as blanks
+    for name in list(dict_dup):
+        dict_dup.setdefault(name.replace('_', ' '), dict_dup[name])
+    (fd, fname_tmp) = tempfile.mkstemp(prefix='.auto_phylip.',
+            dir=os.path.dirname(os.path.abspath(fname_out)))
+    os.close(fd)
+    try:
+        write_newick((_graft_duplicates(tree, dict_dup)
+            for tree in iter_newick(fname_tree)), fname_tmp)
+        shutil.copymode(fname_tree, fname_tmp)
+        os.rename(fname_tmp, fname_out)
+    except:
+        _clear_files(fname_tmp)
+        raise
+    return fname_out
+
+def _graft_duplicates(tree, dict_dup):
+    """
+    Graft duplicates onto the leaves of a single tree, as for
+    `expand_duplicates`.
+    """
+    for node in list(tree.leaves()):
+        if node.name not in dict_dup:
+            continue
+        # the leaf becomes the grafting point, which keeps its branch
+        length = None if node.length is None else 0.
+        node.children = [TreeNode(name=node.name, length=length)]
+        node.children.extend(TreeNode(name=dup_name, length=length)
+                for dup_name in dict_dup[node.name])
+        node.name = None
+    return tree
+
+def _gather_entries(lst_file, columns=None):
     """
     Gather tabfile entries from a list of tabfiles.
     """
     lst_entries = list()
     for tabfile in lst_file:
-        lst_entries.extend(_get_entries(tabfile))
+        lst_entries.extend(_get_entries(tabfile, columns=columns))
     return lst_entries
 
-def _gather_entries_iter(lst_file):
+def _gather_entries_iter(lst_file, columns=None, match=None):
     for tabfile in lst_file:
-        for entry in _get_entries_iter(tabfile):
+        for entry in _get_entries_iter(tabfile, columns=columns,
+                match=match):
             yield entry
 
-def _get_entries(tabfile):
+def _get_entries(tabfile, columns=None):
     """
     Get tabfile entries from a tabfile
     """
-    with open(tabfile, 'rU') as f:
-        reader = csv.DictReader(f, delimiter='\t')
-        lst_entries = [row for row in reader]
-    return lst_entries
+    return list(_get_entries_iter(tabfile, columns=columns))
+
+def _get_entries_iter(tabfile, columns=None, chunk_size=1 << 20,
+        match=None):
+    """
+    Iterate over the entries of a tabfile.
+
+    The header is parsed once, and each row is split only as far as the
+    last column needed, and kept only for the columns needed, which is
+    much faster than building a full dict per row for tabfiles with many
+    columns.
+
+    Parameters
+    ----------
+    tabfile : str
+        The tabfile to read.
+    columns : list of str, optional
+        The columns to keep (default: all of them).
+        Columns not in the tabfile read as None with `get`, as with
+        `csv.DictReader`.
+    chunk_size : int, optional
+        Roughly how many bytes of lines to read at a time.
+    match : list of 2-tuple of str, optional
+        The match criteria which will be applied to the entries.
+        If one of them looks up an exact value in a column covered by an
+        up to date index (see `index_tabfile`), only the rows the index
+        lists for that value are read, rather than the whole tabfile.
+        The entries still have to be filtered by `_filter_entries`.
+
+    Yields
+    ------
+    entry : _TabRow
+        Each row, which can be indexed by column name like a dict.
+    """
+    lst_offset = _index_lookup(tabfile, match) if match else None
+    if lst_offset is not None:
+        for entry in _get_entries_at(tabfile, lst_offset, columns=columns):
+            yield entry
+        return
+    with open(tabfile, 'r') as f:
+        header = f.readline().rstrip('\r\n').split('\t')
+        parse_row = _tab_row_parser(header, columns)
+        while True:
+            lst_line = f.readlines(chunk_size)
+            if not lst_line:
+                break
+            for line in lst_line:
+                entry = parse_row(line)
+                if entry is not None:
+                    yield entry
+
+def _get_entries_at(tabfile, lst_offset, columns=None):
+    """
+    Read the entries of a tabfile which start at the byte offsets
+    `lst_offset`, in the order they appear in the file.
+    """
+    with open(tabfile, 'rb') as f:
+        header = _decode_line(f.readline()).rstrip('\r\n').split('\t')
+        parse_row = _tab_row_parser(header, columns)
+        for offset in sorted(lst_offset):
+            f.seek(offset)
+            entry = parse_row(_decode_line(f.readline()))
+            if entry is not None:
+                yield entry
+
+def _decode_line(line):
+    """
+    Get a line read in binary mode as a native str.
+    """
+    if isinstance(line, str):
+        return line
+    return line.decode('utf-8')
 
-def _get_entries_iter(tabfile):
-    with open(tabfile, 'rU') as f:
-        reader = csv.DictReader(f, delimiter='\t')
-        for row in reader:
-            yield row
+def _tab_row_parser(header, columns=None):
+    """
+    Make a function which turns a line of a tabfile with the given
+    `header` into a `_TabRow` of `columns`, or None for a blank line.
+    """
+    if columns is None:
+        columns = header
+    dict_pos = dict((col, iI) for (iI, col) in
+            reversed(list(enumerate(header))))
+    lst_col = [col for col in columns if col in dict_pos]
+    lst_pos = [dict_pos[col] for col in lst_col]
+    dict_index = dict((col, iI) for (iI, col) in enumerate(lst_col))
+    if len(lst_pos) == 0:
+        get_values = lambda fields: ()
+    elif len(lst_pos) == 1:
+        get_values = lambda fields: (fields[lst_pos[0]],)
+    else:
+        get_values = operator.itemgetter(*lst_pos)
+    n_split = max(lst_pos) + 1 if lst_pos else 0
+    def parse_row(line):
+        line = line.rstrip('\r\n')
+        if not line:
+            return None
+        if '"' in line:
+            # quoted fields are rare enough to leave to csv
+            fields = next(csv.reader([line], delimiter='\t'))
+        else:
+            fields = line.split('\t', n_split)
+        if len(fields) < n_split:
+            # short rows are padded out, as csv.DictReader does
+            fields = fields + [None] * (n_split - len(fields))
+        return _TabRow(dict_index, get_values(fields))
+    return parse_row
+
+def index_tabfile(tabfile, columns):
+    """
+    Build a sidecar index, `tabfile`.idx, from each value of the given
+    columns to the byte offsets of the rows holding it.
+
+    The index is a SQLite database, and records the size and modification
+    time of the tabfile, so it is ignored once the tabfile changes.
+
+    Parameters
+    ----------
+    tabfile : str
+        The tabfile to index.
+    columns : list of str
+        The columns to index, e.g. [clone_col].
+
+    Returns
+    -------
+    idxfile : str
+        The name of the index.
+    """
+    import json
+    import sqlite3
+    idxfile = tabfile + '.idx'
+    stat = os.stat(tabfile)
+    (fd, fname_tmp) = tempfile.mkstemp(prefix='.auto_phylip.',
+            dir=os.path.dirname(os.path.abspath(idxfile)))
+    os.close(fd)
+    try:
+        db = sqlite3.connect(fname_tmp)
+        try:
+            db.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            db.execute(
+                    'CREATE TABLE row (col TEXT, value TEXT, offset INTEGER)')
+            with open(tabfile, 'rb') as f:
+                line = f.readline()
+                offset = len(line)
+                header = _decode_line(line).rstrip('\r\n').split('\t')
+                lst_col = [col for col in columns if col in header]
+                parse_row = _tab_row_parser(header, lst_col)
+                lst_batch = list()
+                for line in f:
+                    entry = parse_row(_decode_line(line))
+                    if entry is not None:
+                        lst_batch.extend((col, entry[col], offset)
+                                for col in lst_col)
+                    offset += len(line)
+                    if len(lst_batch) >= 100000:
+                        db.executemany('INSERT INTO row VALUES (?, ?, ?)',
+                                lst_batch)
+                        lst_batch = list()
+                db.executemany('INSERT INTO row VALUES (?, ?, ?)', lst_batch)
+            db.execute('CREATE INDEX row_value ON row (col, value)')
+            db.executemany('INSERT INTO meta VALUES (?, ?)', [
+                ('size', str(stat.st_size)),
+                ('mtime', repr(stat.st_mtime)),
+                ('columns', json.dumps(lst_col)),
+                ])
+            db.commit()
+        finally:
+            db.close()
+        shutil.copymode(tabfile, fname_tmp)
+        os.rename(fname_tmp, idxfile)
+    except:
+        _clear_files(fname_tmp)
+        raise
+    print('Indexed {cols} of {fname}'.format(cols=lst_col, fname=tabfile))
+    return idxfile
+
+def _index_lookup(tabfile, match):
+    """
+    Look up the rows of a tabfile for the first of the match criteria
+    `match` which asks for an exact value in an indexed column.
+
+    Returns
+    -------
+    lst_offset : list of int or None
+        The byte offsets of the rows holding that value, or None if there
+        is no up to date index for any of the criteria.
+    """
+    import json
+    import sqlite3
+    idxfile = tabfile + '.idx'
+    if not os.path.exists(idxfile):
+        return None
+    stat = os.stat(tabfile)
+    db = sqlite3.connect(idxfile)
+    try:
+        dict_meta = dict(db.execute('SELECT key, value FROM meta'))
+        if (dict_meta.get('size') != str(stat.st_size) or
+                dict_meta.get('mtime') != repr(stat.st_mtime)):
+            print('Index {:s} is out of date, and will not be used.'.format(
+                idxfile))
+            return None
+        set_col = set(json.loads(dict_meta['columns']))
+        for (col, str_match) in match:
+            value = _exact_value(str_match)
+            if col in set_col and value is not None:
+                return [offset for (offset,) in db.execute(
+                    'SELECT offset FROM row WHERE col = ? AND value = ?',
+                    (col, value))]
+    finally:
+        db.close()
+    return None
+
+def _exact_value(str_match):
+    """
+    Get the value that a regex such as '^123$' matches exactly, or None
+    if it could match anything else.
+    """
+    reg_exact = re.compile(
+            r'^\^?((?:[^.^$*+?{}\[\]\\|()]|\\[^A-Za-z0-9])*)\$$')
+    found = reg_exact.match(str_match)
+    if found is None:
+        return None
+    return re.sub(r'\\(.)', r'\1', found.group(1))
+
+class _TabRow(object):
+    """
+    A lightweight row of a tabfile, holding only some of its columns,
+    which can be read like the dict rows of `csv.DictReader`.
+    """
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        # index maps column names to positions in values, and is shared
+        # by all rows of a tabfile
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, col):
+        return self._values[self._index[col]]
+
+    def __contains__(self, col):
+        return col in self._index
+
+    def get(self, col, default=None):
+        iI = self._index.get(col)
+        if iI is None:
+            return default
+        return self._values[iI]
+
+    def keys(self):
+        return list(self._index)
 
 def _filter_entries(lst_entries, **kwarg):
     """
@@ -203,218 +1254,3099 @@ def _phyrow(name, sequence):
     """
     return str(name).ljust(10, ' ') + str(sequence) + '\n'
 
-def run_phylip(
-    phy_in,
-    **kwarg):
+def _phy_interleaved(fname):
     """
-    Run a phylip program with a given phylogeny generating executable,
-    and given options.
+    Tell whether PHYLIP should read the *.phy file `fname` as
+    interleaved, i.e. its first sequence does not fit on its first line.
+    """
+    with open(fname, 'r') as f:
+        len_seq = int(f.readline().split()[1])
+        line = f.readline()
+        while line and not line.strip():
+            line = f.readline()
+    return len(''.join(line[10:].split())) < len_seq
 
-    The given phylogeny program is run on the given input file, with the given
-    options, and the output files 'outfile' and 'outtree' are renamed to
-    `basename`.out, and `basename`.tree respectively.
-    `basename` is derived from the input file name.
+class PhyWriter(object):
+    """
+    Write a *.phy file one sequence at a time, without knowing up front
+    how many sequences there will be.
 
-    Parameters
+    Room is left at the start of the file for the header, which is
+    filled in once all sequences have been written.
+    Every sequence must be as long as the first, and a `ValueError` is
+    raised as soon as one is not.
+    Used as a context manager, the file is finished on leaving the with
+    block, or removed if an exception was raised in it.
+
+    In interleaved format, the sequences are spooled to a temporary file
+    as they come, and written out in blocks of `width` columns at the
+    end, so memory use does not depend on the size of the alignment.
+
+    Attributes
     ----------
-    phy_in : str
-        Filename of phylip formatted file to use as input.
-    phy_exec : list, optional
-        List of strings which are the command line args needed to call
-        the desired phylip command, default is ['phylip', 'dnapars']
-    lst_phy_opts : list, optional
-        List of strings which are the interactive input options for the
-        desired phylip program.
-        These need to be carefully considered prior to running,
-        and must be in the proper order to be meaningful.
-        Default is: ['S','Y','I','4','5','.'].
-    bootstrap : int, optional
-        The number of bootstrap iterations for seqboot.
-        If not specified, seqboot is skipped.
+    n_seq : int
+        The number of sequences written so far.
+    len_seq : int
+        The length of the sequences, or None before the first.
     """
-    # if phy_exec is provided, or None, use default
+    # wide enough for any two numbers the PHYLIP programs can handle
+    header_width = 32
+
+    def __init__(self, fname, interleaved=False, width=60):
+        self.fname = fname
+        self.interleaved = interleaved
+        self.width = width
+        self.n_seq = 0
+        self.len_seq = None
+        self._f = open(fname, 'w')
+        self._f.write(' ' * (self.header_width - 1) + '\n')
+        if interleaved:
+            self._names = list()
+            self._spool = tempfile.TemporaryFile(mode='w+',
+                    dir=os.path.dirname(os.path.abspath(fname)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def write(self, name, sequence):
+        """
+        Add a sequence.
+        """
+        sequence = str(sequence)
+        if self.len_seq is None:
+            self.len_seq = len(sequence)
+        elif len(sequence) != self.len_seq:
+            raise ValueError('''Not all sequences are of the same length.''')
+        if self.interleaved:
+            self._names.append(str(name))
+            self._spool.write(sequence)
+        else:
+            self._f.write(_phyrow(name, sequence))
+        self.n_seq += 1
+
+    def write_all(self, iter_seqpair):
+        """
+        Add each (name, sequence) pair from `iter_seqpair`.
+
+        This does the same as calling `write` on each pair, in a tighter
+        loop.
+        """
+        if self.interleaved:
+            for (name, sequence) in iter_seqpair:
+                self.write(name, sequence)
+            return None
+        f_write = self._f.write
+        len_seq = self.len_seq
+        n_seq = self.n_seq
+        try:
+            for (name, sequence) in iter_seqpair:
+                if len(sequence) != len_seq:
+                    if len_seq is not None:
+                        raise ValueError(
+                            '''Not all sequences are of the same length.''')
+                    len_seq = self.len_seq = len(sequence)
+                f_write(str(name).ljust(10, ' ') + str(sequence) + '\n')
+                n_seq += 1
+        finally:
+            self.n_seq = n_seq
+        return None
+
+    def close(self):
+        """
+        Write any interleaved blocks, fill in the header, and close the
+        file.
+        """
+        len_seq = self.len_seq or 0
+        if self.interleaved:
+            for i_col in range(0, max(len_seq, 1), self.width):
+                if i_col:
+                    self._f.write('\n')
+                for (iI, name) in enumerate(self._names):
+                    self._spool.seek(iI * len_seq + i_col)
+                    chunk = self._spool.read(min(self.width, len_seq - i_col))
+                    if i_col:
+                        self._f.write(chunk + '\n')
+                    else:
+                        self._f.write(_phyrow(name, chunk))
+            self._spool.close()
+        header = _phyrow(self.n_seq, len_seq)
+        if len(header) > self.header_width:
+            raise ValueError('The header of {:s} does not fit.'.format(
+                self.fname))
+        self._f.seek(0)
+        self._f.write(header[:-1].ljust(self.header_width - 1))
+        self._f.close()
+        return self.fname
+
+    def abort(self):
+        """
+        Close and remove the unfinished file.
+        """
+        self._f.close()
+        if self.interleaved:
+            self._spool.close()
+        _clear_files(self.fname)
+
+class Alignment(object):
+    """
+    A multiple sequence alignment held as one contiguous matrix.
+
+    Attributes
+    ----------
+    names : numpy.ndarray
+        The sequence names, as an array of str.
+    seqs : numpy.ndarray
+        A 2D uint8 array of the sequences as ASCII codes, one row per
+        sequence.
+    """
+
+    def __init__(self, names, seqs):
+        import numpy as np
+        self.names = np.asarray(names, dtype=str)
+        self.seqs = np.ascontiguousarray(seqs, dtype=np.uint8)
+        if self.seqs.ndim != 2 or len(self.names) != self.seqs.shape[0]:
+            raise ValueError(
+                    'Expected one row of sequence for each name.')
+
+    @classmethod
+    def from_seqpairs(cls, iter_seqpair):
+        """
+        Build an alignment from (name, sequence) pairs, such as those
+        from `_entry2seqpair`.
+        """
+        import numpy as np
+        lst_seqpair = list(iter_seqpair)
+        if len(lst_seqpair) == 0:
+            raise ValueError('''No sequences found.''')
+        lst_len = np.array([len(seq) for (name, seq) in lst_seqpair])
+        if np.any(lst_len != lst_len[0]):
+            raise ValueError('''Not all sequences are of the same length.''')
+        seqs = np.frombuffer(
+                ''.join(str(seq) for (name, seq) in lst_seqpair).encode(
+                    'ascii'),
+                dtype=np.uint8).reshape(len(lst_seqpair), lst_len[0])
+        return cls([name for (name, seq) in lst_seqpair], seqs)
+
+    @classmethod
+    def from_phy(cls, fname, interleaved=None):
+        """
+        Read a sequential or interleaved *.phy file.
+
+        The file is memory mapped, and in the usual case of one line per
+        sequence, as written by `lst_entries2phy` or seqboot, the
+        sequences are gathered into the matrix with a single fancy
+        indexing operation, with no per line copies.
+
+        Parameters
+        ----------
+        fname : str
+            The *.phy file to read.
+        interleaved : bool, optional
+            Whether the file is interleaved.
+            If not provided, a file with each sequence on one line is
+            read as such, and otherwise it is assumed to be interleaved,
+            as PHYLIP does.
+        """
+        import mmap
+        import numpy as np
+        with open(fname, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                buf = np.frombuffer(mm, dtype=np.uint8)
+                try:
+                    return cls._from_buffer(buf, fname, interleaved)
+                finally:
+                    # release the view, so the map can be closed
+                    del buf
+            finally:
+                mm.close()
+
+    @classmethod
+    def _from_buffer(cls, buf, fname, interleaved):
+        """
+        Parse the contents of a *.phy file for `from_phy`.
+        """
+        import numpy as np
+        arr_nl = np.flatnonzero(buf == ord('\n'))
+        if len(arr_nl) == 0 or arr_nl[-1] != len(buf) - 1:
+            # treat the end of the file as the end of the last line
+            arr_nl = np.append(arr_nl, len(buf))
+        arr_start = np.concatenate(([0], arr_nl[:-1] + 1))
+        arr_end = arr_nl.copy()
+        # drop carriage returns
+        has_cr = (arr_end > arr_start) & (
+                buf[np.maximum(arr_end - 1, 0)] == ord('\r'))
+        arr_end[has_cr] -= 1
+        header = buf[arr_start[0]:arr_end[0]].tobytes().split()
+        (n_seq, len_seq) = (int(header[0]), int(header[1]))
+        # skip blank lines
+        is_blank = arr_end == arr_start
+        arr_line = np.flatnonzero(~is_blank)[1:]
+        if len(arr_line) < n_seq:
+            raise ValueError('Expected {n:d} sequences in {fname}.'.format(
+                n=n_seq, fname=fname))
+        # fast path: each sequence on one line, with no blanks within
+        first = arr_line[:n_seq]
+        arr_len = arr_end[first] - arr_start[first] - 10
+        if np.all(arr_len == len_seq):
+            arr_step = np.diff(arr_start[first])
+            if n_seq > 1 and np.all(arr_step == arr_step[0]):
+                # evenly spaced lines, so the sequences are a view of the
+                # buffer, past the name column of each line
+                seqs = np.ascontiguousarray(np.lib.stride_tricks.as_strided(
+                    buf[arr_start[first[0]] + 10:],
+                    shape=(n_seq, len_seq),
+                    strides=(int(arr_step[0]) * buf.strides[0],
+                        buf.strides[0])))
+            else:
+                seqs = np.empty((n_seq, len_seq), dtype=np.uint8)
+                for (iI, start) in enumerate(arr_start[first]):
+                    seqs[iI] = buf[start + 10:start + 10 + len_seq]
+            if not np.any(seqs == ord(' ')):
+                names = [buf[start:start + 10].tobytes().decode(
+                    'ascii').strip() for start in arr_start[first]]
+                return cls(names, seqs)
+        lst_line = [buf[arr_start[iI]:arr_end[iI]].tobytes().decode('ascii')
+                for iI in arr_line]
+        lst_seq = [list() for iI in range(n_seq)]
+        if interleaved is False:
+            # each sequence runs on over as many lines as it needs
+            names = list()
+            iter_line = iter(lst_line)
+            for iI in range(n_seq):
+                line = next(iter_line, '')
+                names.append(line[:10].strip())
+                lst_seq[iI].append(line[10:].replace(' ', ''))
+                n_char = len(lst_seq[iI][-1])
+                while n_char < len_seq:
+                    line = next(iter_line, None)
+                    if line is None:
+                        break
+                    lst_seq[iI].append(line.replace(' ', ''))
+                    n_char += len(lst_seq[iI][-1])
+        else:
+            # the first block has the names, the rest only sequence
+            names = [line[:10].strip() for line in lst_line[:n_seq]]
+            for (iI, line) in enumerate(lst_line):
+                if iI < n_seq:
+                    line = line[10:]
+                lst_seq[iI % n_seq].append(line.replace(' ', ''))
+        lst_seq = [''.join(seq) for seq in lst_seq]
+        for (iI, seq) in enumerate(lst_seq):
+            if len(seq) != len_seq:
+                raise ValueError(
+                        'Sequence {i:d} of {fname} is not of length '
+                        '{len_seq:d}.'.format(
+                            i=iI + 1, fname=fname, len_seq=len_seq))
+        return cls.from_seqpairs(zip(names, lst_seq))
+
+    @property
+    def shape(self):
+        """
+        The number of sequences and the sequence length.
+        """
+        return self.seqs.shape
+
+    def __len__(self):
+        return self.seqs.shape[0]
+
+    def seqpairs(self):
+        """
+        Iterate over (name, sequence) pairs, as used by `_phyrow`.
+        """
+        for (name, row) in zip(self.names, self.seqs):
+            yield (str(name), str(row.tobytes().decode('ascii')))
+
+    def take_columns(self, idx):
+        """
+        Get a new alignment of the columns selected by `idx`, which may be
+        a slice, an index array (with repeats, as for bootstrapping), or
+        a boolean mask.
+        """
+        return Alignment(self.names, self.seqs[:, idx])
+
+    def take_rows(self, idx):
+        """
+        Get a new alignment of the sequences selected by `idx`.
+        """
+        return Alignment(self.names[idx], self.seqs[idx])
+
+    def upper(self):
+        """
+        Get the sequences with lower case letters made upper case.
+        """
+        import numpy as np
+        seqs = self.seqs
+        is_lower = (seqs >= ord('a')) & (seqs <= ord('z'))
+        return np.where(is_lower, seqs - 32, seqs).astype(np.uint8)
+
+    def site_counts(self, alphabet='ACGT-'):
+        """
+        Count the states in each column.
+
+        Returns
+        -------
+        numpy.ndarray
+            An int array of shape (len(alphabet) + 1, length), with the
+            count of each character of `alphabet` in each column, case
+            insensitively, and in the last row the count of anything
+            else (e.g. N or ?).
+        """
+        import numpy as np
+        seqs = self.upper()
+        lookup = np.full(256, len(alphabet), dtype=np.intp)
+        for (iI, char) in enumerate(alphabet):
+            lookup[ord(char.upper())] = iI
+        codes = lookup[seqs]
+        counts = np.zeros((len(alphabet) + 1, seqs.shape[1]), dtype=int)
+        for iI in range(len(alphabet) + 1):
+            counts[iI] = np.count_nonzero(codes == iI, axis=0)
+        return counts
+
+    def is_constant(self):
+        """
+        Whether each column holds a single state (case insensitively).
+        """
+        seqs = self.upper()
+        return (seqs == seqs[:1]).all(axis=0)
+
+    def is_informative(self, alphabet='ACGT'):
+        """
+        Whether each column is parsimony informative, i.e. has at least
+        two of the states in `alphabet` each found at least twice.
+        """
+        counts = self.site_counts(alphabet)[:-1]
+        return (counts >= 2).sum(axis=0) >= 2
+
+    def site_patterns(self, informative=False):
+        """
+        Collapse identical columns (case insensitively) into unique site
+        patterns.
+
+        Parameters
+        ----------
+        informative : bool, optional
+            Drop the parsimony uninformative columns first
+            (default: False).
+
+        Returns
+        -------
+        (patterns, counts) : tuple
+            An alignment of one column of each pattern, in the order in
+            which they first appear, and an int array of the number of
+            columns of this alignment each stands for.
+        """
+        import numpy as np
+        if informative:
+            idx_keep = np.flatnonzero(self.is_informative())
+        else:
+            idx_keep = np.arange(self.seqs.shape[1])
+        # view each column as a single opaque value, so np.unique
+        # compares whole columns at once
+        cols = np.ascontiguousarray(self.upper()[:, idx_keep].T)
+        keys = cols.view(np.dtype((np.void, cols.shape[1]))).ravel()
+        (keys, idx_first, inverse) = np.unique(keys,
+                return_index=True, return_inverse=True)
+        counts = np.bincount(inverse.ravel(), minlength=len(keys))
+        order = np.argsort(idx_first)
+        return (self.take_columns(idx_keep[idx_first[order]]), counts[order])
+
+    def gap_fraction(self):
+        """
+        The fraction of each column which is a gap ('-').
+        """
+        return (self.seqs == ord('-')).mean(axis=0)
+
+    def write_phy(self, fname):
+        """
+        Write the alignment to a sequential *.phy file, in the same
+        layout as `lst_entries2phy`.
+        """
+        with open(fname, 'wb') as f:
+            self._write_phy(f)
+        return fname
+
+    def _write_phy(self, f):
+        """
+        Write the alignment to an open binary file, one line per
+        sequence, with the whole block of sequence lines made at once.
+        """
+        import numpy as np
+        (n_seq, len_seq) = self.seqs.shape
+        arr_row = _phy_block(self.names, len_seq)
+        arr_row[:, 10:-1] = self.seqs
+        f.write(_phyrow(n_seq, len_seq).encode('ascii'))
+        f.write(arr_row.tobytes())
+
+def _phy_block(names, len_seq):
+    """
+    Make a uint8 array laid out as the sequence lines of a *.phy file,
+    with the names padded to 10 characters and the newlines filled in,
+    but the sequences left to be filled in as arr[:, 10:-1].
+    """
+    import numpy as np
+    n_seq = len(names)
+    arr_row = np.empty((n_seq, 10 + len_seq + 1), dtype=np.uint8)
+    arr_row[:, :10] = np.array(
+            [bytearray(str(name)[:10].ljust(10, ' '), 'ascii')
+                for name in names],
+            dtype=np.uint8).reshape(n_seq, 10)
+    arr_row[:, -1] = ord('\n')
+    return arr_row
+
+@_traced_call('compress_sites')
+def compress_sites(phy_in, phy_out=None, weightfile=None, informative=False):
+    """
+    Collapse the identical columns of the alignment in `phy_in` into
+    unique site patterns, and write one column of each to `phy_out`, with
+    the number of columns it stands for in the PHYLIP weights file
+    `weightfile`.
+
+    Parsimony programs given the weights (the 'W' option) find the same
+    trees with the same scores as on the full alignment, from far fewer
+    sites.
+    A pattern standing for more than 35 columns, the largest weight
+    PHYLIP reads, is written as several columns sharing its weight.
+
+    Parameters
+    ----------
+    phy_in : str
+        Filename of the *.phy file to compress.
+    phy_out : str, optional
+        Filename of the compressed *.phy file
+        (default: `basename`.sites.phy).
+    weightfile : str, optional
+        Filename of the weights file (default: as `phy_out`, with the
+        extension .weights).
+    informative : bool, optional
+        Also drop the parsimony uninformative columns, which leaves the
+        topologies found by parsimony alone, but not the scores or
+        branch lengths (default: False).
+
+    Returns
+    -------
+    phy_out : str
+        The filename of the compressed *.phy file.
+    """
+    import numpy as np
+    if phy_out is None:
+        phy_out = phy_in.rpartition('.')[0] + '.sites.phy'
+    if weightfile is None:
+        weightfile = _weights_name(phy_out)
+    alignment = Alignment.from_phy(phy_in)
+    (patterns, counts) = alignment.site_patterns(informative=informative)
+    if len(counts) == 0:
+        raise ValueError('No informative sites in {:s}.'.format(phy_in))
+    (idx, arr_weight) = _weight_columns(counts[np.newaxis])
+    patterns.take_columns(idx).write_phy(phy_out)
+    write_weights(arr_weight, weightfile)
+    print('Compressed {n:d} sites to {n_pattern:d} site patterns.'.format(
+        n=alignment.shape[1], n_pattern=len(counts)))
+    return phy_out
+
+def _weights_name(fname):
+    """
+    The name of the weights file that goes with the *.phy file `fname`.
+    """
+    return fname.rpartition('.')[0] + '.weights'
+
+def _weight_columns(arr_weight):
+    """
+    Spread the weights of each column over as many copies of the column
+    as it takes for none to be over 35, the largest weight PHYLIP reads.
+
+    Parameters
+    ----------
+    arr_weight : numpy.ndarray
+        An int array of shape (n_set, n_column), of the weight of each
+        column in each set of weights.
+
+    Returns
+    -------
+    (idx, arr_split) : tuple
+        The index of the column to take for each column of the output,
+        with repeats, and the weights of those columns in each set, which
+        add up to those of `arr_weight`.
+    """
+    import numpy as np
+    w_max = len(weight_digits) - 1
+    n_copy = np.maximum(1, -(-arr_weight.max(axis=0) // w_max))
+    idx = np.repeat(np.arange(arr_weight.shape[1]), n_copy)
+    # which copy of its column each output column is
+    i_copy = np.arange(len(idx)) - np.repeat(np.cumsum(n_copy) - n_copy,
+            n_copy)
+    arr_split = np.clip(arr_weight[:, idx] - w_max * i_copy, 0, w_max)
+    return (idx, arr_split)
+
+def write_weights(arr_weight, fname):
+    """
+    Write sets of character weights, each of 0 to 35, to the PHYLIP
+    weights file `fname`, one set per line.
+
+    Parameters
+    ----------
+    arr_weight : numpy.ndarray
+        An int array of shape (n_set, n_column).
+    """
+    import numpy as np
+    arr_weight = np.asarray(arr_weight)
+    if arr_weight.size and (arr_weight.min() < 0
+            or arr_weight.max() >= len(weight_digits)):
+        raise ValueError('''PHYLIP weights must be from 0 to {:d}.'''.format(
+            len(weight_digits) - 1))
+    lookup = np.frombuffer(weight_digits.encode('ascii'), dtype=np.uint8)
+    arr_row = np.empty((arr_weight.shape[0], arr_weight.shape[1] + 1),
+            dtype=np.uint8)
+    arr_row[:, :-1] = lookup[arr_weight]
+    arr_row[:, -1] = ord('\n')
+    with open(fname, 'wb') as f:
+        f.write(arr_row.tobytes())
+    return fname
+
+@_traced_call('run_phylip')
+def run_phylip(
+    phy_in,
+    **kwarg):
+    """
+    Run a phylip program with a given phylogeny generating executable,
+    and given options.
+
+    The given phylogeny program is run on the given input file, with the given
+    options, and the output files 'outfile' and 'outtree' are renamed to
+    `basename`.out, and `basename`.tree respectively.
+    `basename` is derived from the input file name.
+
+    Parameters
+    ----------
+    phy_in : str
+        Filename of phylip formatted file to use as input.
+    phy_exec : list, optional
+        List of strings which are the command line args needed to call
+        the desired phylip command, default is ['phylip', 'dnapars']
+    lst_phy_opts : list, optional
+        List of strings which are the interactive input options for the
+        desired phylip program.
+        These need to be carefully considered prior to running,
+        and must be in the proper order to be meaningful.
+        Default is: ['S','Y','I','4','5','.'].
+    bootstrap : int, optional
+        The number of bootstrap iterations for seqboot.
+        If not specified, seqboot is skipped.
+    shards : int, optional
+        If bootstrapping, split the bootstrapped datasets into this many
+        blocks, and run the phylogeny program on each block in parallel.
+        (default: 1, a single run over all datasets)
+    native_seqboot : bool, optional
+        If bootstrapping, resample in this process rather than with
+        seqboot (default: False).
+    native_consense : bool, optional
+        If bootstrapping, build the consensus tree in this process rather
+        than with consense (default: False).
+    native_cleanup : bool, optional
+        If bootstrapping, put branch lengths on the consensus tree in
+        this process rather than with the phylogeny program, keeping the
+        support values as node labels (default: False).
+    jumble : int, optional
+        The number of times to jumble the input order of the sequences
+        (default: 1).
+    parallel_jumble : int, optional
+        Without bootstrapping, run each jumble as its own single jumble
+        run, this many at a time (0 for one per CPU), and keep the tree[s]
+        of the best score (default: None, jumble within a single run).
+    collapse : bool, optional
+        Infer the tree[s] from the distinct sequences only, written to
+        `basename`.uniq.phy, and graft the duplicates back onto the final
+        tree (default: False).
+        The final tree is also expanded whenever the input comes with a
+        map of duplicates, e.g. from `tab2phy` with `collapse`.
+    compress : bool, optional
+        Infer the tree[s] from the unique site patterns only, each
+        weighted by the number of columns it stands for, written to
+        `basename`.sites.phy and `basename`.sites.weights, or if
+        bootstrapping, resample the patterns as sets of weights
+        (default: False).
+        See `compress_sites` and `run_seqboot`.
+    informative : bool, optional
+        As `compress`, but also drop the parsimony uninformative columns
+        (default: False).
+        The topologies found by parsimony are the same, but without
+        bootstrapping, the scores and branch lengths of the tree[s] are
+        those of the informative columns only.
+    distance : str, optional
+        Build the tree[s] with PHYLIP neighbor, from the distances under
+        this model, one of 'p', 'jc' or 'k2p', computed in this process,
+        rather than with `phy_exec` (default: None).
+        See `run_neighbor`.
+        When bootstrapping, the distances of each replicate are computed
+        directly, without seqboot, and the consensus tree still gets
+        its branch lengths as usual.
+    upgma : bool, optional
+        With `distance`, build UPGMA rather than neighbor joining trees
+        (default: False).
+    cache : str, optional
+        A directory in which to cache the output of each PHYLIP program,
+        keyed by the program, its options and its input, so that runs
+        repeated with the same settings do not start PHYLIP again
+        (default: None, no cache).
+    cache_size : int, optional
+        The size in bytes beyond which the least recently used cached
+        outputs are evicted (default: 10 GiB).
+    timeout : float, optional
+        The wall clock time in seconds after which any one PHYLIP program
+        is killed (default: None, no limit).
+    max_memory : int, optional
+        The resident memory in bytes beyond which any one PHYLIP program
+        is killed (default: None, no limit).
+    fallback : list of list, optional
+        Phylogeny programs to try in turn, e.g. [['phylip', 'dnapars']]
+        behind dnapenny, when the one before fails, or is killed for
+        going over a limit (default: None).
+    progress : callable, optional
+        Called as `progress(lst_exec, n)` as each PHYLIP program reports
+        that it has finished its `n`th dataset or replicate.
+    resume : bool, optional
+        Record each stage as it finishes, with the hashes of its output
+        files, in the journal `basename`.journal, and skip the stages
+        recorded there whose outputs are still in place, so that a run
+        stopped partway through carries on where it left off when
+        started again with the same arguments (default: False).
+        With `shards`, each block of bootstrap replicates is a stage of
+        its own.
+    archive : str, optional
+        Run in a private directory under the system temporary directory,
+        then store the files of the run, the input included, in this
+        SQLite archive under the clone ID, the name of `phy_in` up to
+        its extension, and remove them, rather than leaving them next to
+        `phy_in` (default: None).
+        See `archive_store`. Cannot be combined with `resume`, and fails
+        if the archive already holds the clone ID.
+    keep_intermediate : bool, optional
+        With `archive`, also store the bootstrap replicate alignments,
+        `basename`.boot.phy and its weights, which are otherwise left out
+        (default: False).
+
+    Returns
+    -------
+    treename : str
+        The name of the final tree file, which with `archive` is its
+        name in the archive.
+    """
+    archive = kwarg.pop('archive', None)
+    keep_intermediate = kwarg.pop('keep_intermediate', False)
+    if archive is not None:
+        return _run_phylip_archived(phy_in, archive,
+                keep_intermediate=keep_intermediate, **kwarg)
+    # if phy_exec is provided, or None, use default
     phy_exec = kwarg.pop('phy_exec', None)
     if phy_exec == None:
         phy_exec = phy_exec_default
     # if bootstrap is provided use, otherwise None
     bootstrap = kwarg.pop('bootstrap', None)
-    if bootstrap:
-        # save the original input *.phy name
-        phy_in_orig = phy_in
+    shards = kwarg.pop('shards', 1)
+    native_seqboot = kwarg.pop('native_seqboot', False)
+    native_consense = kwarg.pop('native_consense', False)
+    native_cleanup = kwarg.pop('native_cleanup', False)
+    informative = kwarg.pop('informative', False)
+    compress = kwarg.pop('compress', False) or informative
+    distance = kwarg.pop('distance', None)
+    upgma = kwarg.pop('upgma', False)
+    if kwarg.pop('resume', False):
+        kwarg.setdefault('journal', phy_in.rpartition('.')[0] + '.journal')
+    _trace_note(bootstrap=bootstrap, **_phy_shape(phy_in))
+    if kwarg.pop('collapse', False):
+        # infer trees on the distinct sequences only; the duplicates are
+        # grafted back on at the end, from the map next to the new file
+        phy_uniq = collapse_duplicates(phy_in)
+        return run_phylip(phy_uniq,
+                phy_exec=phy_exec,
+                bootstrap=bootstrap,
+                shards=shards,
+                native_seqboot=native_seqboot,
+                native_consense=native_consense,
+                native_cleanup=native_cleanup,
+                compress=compress,
+                informative=informative,
+                distance=distance,
+                upgma=upgma,
+                **kwarg)
+    parallel_jumble = kwarg.pop('parallel_jumble', None)
+    dupfile = _find_dup_map(phy_in)
+    weightfile = None
+    # save the original input *.phy name
+    phy_in_orig = phy_in
+    # the distances are computed straight from the site patterns, and
+    # bootstrapped along the way, so need neither of these
+    if bootstrap and distance is None:
         # for most of following operations, use bootstrapped *.phy file
-        phy_in = run_seqboot(phy_in, bootstrap, **kwarg)
-    basename = phy_in.rpartition('.')[0]
-    # remove old files
-    _clear_files('infile', 'outfile', 'outtree')
+        phy_in = run_seqboot(phy_in, bootstrap,
+                native_seqboot=native_seqboot, compress=compress,
+                informative=informative, **kwarg)
+    elif compress and distance is None:
+        phy_in = compress_sites(phy_in, informative=informative)
+    if compress and distance is None:
+        weightfile = _weights_name(phy_in)
+    if distance is not None:
+        treename = run_neighbor(phy_in, model=distance, bootstrap=bootstrap,
+                upgma=upgma, seed=kwarg.get('seed', 9),
+                **_stage_kwarg(kwarg, pop=False))
+    elif bootstrap and shards != 1:
+        treename = _infer_trees_sharded(phy_in, bootstrap, shards,
+                phy_exec=phy_exec, weights=weightfile, **kwarg)
+    elif (parallel_jumble is not None and not bootstrap
+            and kwarg.get('jumble', 1) > 1):
+        treename = _infer_trees_jumbled(phy_in, kwarg.pop('jumble'),
+                parallel_jumble, phy_exec=phy_exec, weights=weightfile,
+                **kwarg)
+    else:
+        if parallel_jumble is not None and bootstrap:
+            print('Jumbling within each run, since the datasets are '
+                    'bootstrapped')
+        treename = _infer_trees(phy_in,
+                phy_exec=phy_exec, bootstrap=bootstrap, weights=weightfile,
+                **kwarg)
+    print('Inferred tree[s] on {:s}'.format(treename))
+    if bootstrap:
+        # run consense only if bootstrapping was performed
+        constreename = run_consense(treename,
+                native_consense=native_consense, **kwarg)
+        print('Consensus tree is: {name}'.format(name=constreename))
+        print('Using original phy file: {name}'.format(name=phy_in_orig))
+        cleanconstreename = cleanup_consense(constreename, phy_in_orig,
+                native_cleanup=native_cleanup,
+                **_stage_kwarg(kwarg, pop=False))
+        print('Cleaned consense tree is: {:s}'.format(cleanconstreename))
+        treename = cleanconstreename
+    if dupfile is not None:
+        expand_duplicates(treename, dupfile)
+        print('Grafted duplicate sequences onto {:s}'.format(treename))
+    return treename
+
+def _run_phylip_archived(phy_in, archive, **kwarg):
+    """
+    Run `run_phylip` on a copy of `phy_in`, and its map of duplicates if
+    any, in a temporary directory, and move the files it leaves there
+    into the archive `archive`, all but the bootstrap replicate
+    alignments unless `keep_intermediate`.
+    """
+    keep_intermediate = kwarg.pop('keep_intermediate', False)
+    if kwarg.get('resume'):
+        raise ValueError('A run cannot be resumed from an archive.')
+    clone = os.path.basename(phy_in).rpartition('.')[0]
+    # checked again when storing, but best found before the run
+    if clone in _archive_clones(archive, [clone]):
+        raise ValueError('{archive:s} already holds clone {clone:s}.'.format(
+            archive=archive, clone=clone))
+    lst_skip = list()
+    if not keep_intermediate:
+        lst_skip = [clone + '.boot.phy', clone + '.boot.weights']
+    workdir = tempfile.mkdtemp(prefix='auto_phylip.')
+    try:
+        for fname in [phy_in, phy_in.rpartition('.')[0] + '.dups']:
+            if os.path.exists(fname):
+                shutil.copyfile(fname,
+                        os.path.join(workdir, os.path.basename(fname)))
+        treename = run_phylip(os.path.join(workdir,
+            os.path.basename(phy_in)), **kwarg)
+        archive_store(archive, clone, [os.path.join(workdir, fname)
+            for fname in sorted(os.listdir(workdir))
+            if not fname.startswith('.') and fname not in lst_skip])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print('Archived the run on {fname:s} in {archive:s}'.format(
+        fname=phy_in, archive=archive))
+    return os.path.basename(treename)
+
+def _infer_trees(phy_in, phy_exec, **kwarg):
+    """
+    Run the phylogeny program `phy_exec` on `phy_in`, and rename the
+    output files 'outfile' and 'outtree' to `basename`.out and
+    `basename`.tree respectively.
+
+    The outputs are named after `basename_out` instead, if given.
+    The PHYLIP weights file `weights`, if given, is read with the 'W'
+    option, as multiple weights if bootstrapping.
+    The keyword arguments taken by `_run_stage` are passed on to it, and
+    any remaining ones to `_get_phy_opts`.
+
+    Returns
+    -------
+    treename : str
+        The name of the file containing the inferred tree[s].
+    """
+    kwarg_stage = _stage_kwarg(kwarg)
+    basename = kwarg.pop('basename_out', None) or phy_in.rpartition('.')[0]
+    if not kwarg.get('bootstrap'):
+        kwarg.setdefault('interleaved', _phy_interleaved(phy_in))
+    weightfile = kwarg.pop('weights', None)
+    outname = basename + '.out'
+    treename = basename + '.tree'
     # write a command file with the specified options
-    lst_phy_opts = _get_phy_opts(phy_in, bootstrap=bootstrap, **kwarg)
-    cmdfname = write_cmdfile(lst_phy_opts, trailing_nl=False)
-    # open phylip process
-    # p = sub.Popen(phy_exec, stdin=sub.PIPE)
-    p = sub.Popen(phy_exec, stdin=sub.PIPE, stdout=sub.PIPE,
-            stderr=sub.PIPE)
-    # send command file contents as input, wait for output
-    # p.communicate(open(cmdfname, 'r').read())
-    (out, err) = p.communicate(open(cmdfname, 'r').read())
-    # rename output files
+    lst_phy_opts = _get_phy_opts(os.path.basename(phy_in),
+            weights=weightfile is not None, **kwarg)
+    lst_input = [phy_in]
+    if weightfile is not None:
+        lst_input.append((weightfile, 'weights'))
+    _run_stage(phy_exec, lst_phy_opts, lst_input,
+            [('outfile', outname), ('outtree', treename)],
+            trailing_nl=False,
+            trace_info=dict(bootstrap=kwarg.get('bootstrap') or None),
+            **kwarg_stage)
+    return treename
+
+def _infer_trees_sharded(phy_in, n_bootstrap, n_shards, phy_exec, **kwarg):
+    """
+    Run the phylogeny program on a bootstrapped *.phy file `phy_in` as
+    `n_shards` parallel runs over contiguous blocks of its datasets.
+
+    Each block is given its own seed, and the per-block output files are
+    joined in order, so `basename`.tree ends up with one tree per
+    dataset in the same order as a single run would produce them.
+
+    Parameters
+    ----------
+    phy_in : str
+        Filename of a bootstrapped (multiple dataset) *.phy file.
+    n_bootstrap : int
+        The number of datasets in `phy_in`.
+    n_shards : int
+        The number of blocks to split the datasets into.
+        If less than 1, use one per CPU.
+    phy_exec : list
+        The command line args needed to call the phylogeny program.
+    weights : str, optional
+        A weights file with one set of weights per replicate on the
+        single dataset in `phy_in`, as from `run_seqboot` with
+        `compress`, in which case the sets of weights are split into
+        blocks instead.
+
+    Returns
+    -------
+    treename : str
+        The name of the file containing all of the inferred trees.
+    """
+    seed = kwarg.pop('seed', 9)
+    weightfile = kwarg.pop('weights', None)
+    if n_shards < 1:
+        import multiprocessing
+        n_shards = multiprocessing.cpu_count()
+    basename = phy_in.rpartition('.')[0]
+    journal = kwarg.get('journal')
+    lst_dest = [basename + '.out', basename + '.tree']
+    if journal:
+        key_journal = _cache_key(phy_exec,
+                ['shards', str(n_bootstrap), str(n_shards), str(seed)]
+                + _journal_opts(kwarg),
+                [phy_in] + ([weightfile] if weightfile else []))
+        if journal_done(journal, key_journal, lst_dest):
+            print('Resuming: all blocks already done for {:s}'.format(
+                ', '.join(lst_dest)))
+            return basename + '.tree'
+    if weightfile is None:
+        lst_shard = _split_datasets(phy_in, n_bootstrap, n_shards)
+    else:
+        lst_shard = _split_weights(weightfile, n_bootstrap, n_shards)
+    lst_job = list()
+    for (iI, (fname, n_dataset)) in enumerate(lst_shard):
+        kwarg_shard = dict(kwarg,
+                phy_exec=phy_exec,
+                bootstrap=n_dataset,
+                seed=_shard_seed(seed, iI),
+                )
+        if weightfile is None:
+            lst_job.append((_infer_trees, fname, kwarg_shard))
+        else:
+            kwarg_shard.update(weights=fname,
+                    basename_out=fname.rpartition('.')[0])
+            lst_job.append((_infer_trees, phy_in, kwarg_shard))
+    lst_basename = [fname.rpartition('.')[0] for (fname, n) in lst_shard]
+    done = False
+    try:
+        # The heavy lifting happens in the PHYLIP subprocesses, so
+        # threads are enough here, and unlike a process pool, they can
+        # also be used from inside a `_map_jobs` worker.
+        _run_jobs(lst_job, len(lst_job), threads=True)
+        _concat_files([name + '.out' for name in lst_basename],
+                basename + '.out')
+        _concat_files([name + '.tree' for name in lst_basename],
+                basename + '.tree')
+        done = True
+    finally:
+        # with a journal, the blocks finished so far are kept, for a
+        # rerun to carry on from
+        if done or not journal:
+            for name in lst_basename:
+                _clear_files(name + '.phy', name + '.weights',
+                        name + '.out', name + '.tree')
+    if journal:
+        journal_record(journal, 'shards', key_journal, lst_dest)
+    return basename + '.tree'
+
+def _infer_trees_jumbled(phy_in, n_jumble, n_workers, phy_exec, **kwarg):
+    """
+    Search for the best tree[s] on `phy_in` with `n_jumble` independent
+    single jumble runs of the phylogeny program, `n_workers` at a time,
+    each with its own seed.
+
+    The score of each run is read from its output file, and the trees of
+    every run with the best score are kept, each distinct tree once, in
+    `basename`.tree.
+    As the phylogeny programs do for tied trees, each of several trees
+    is given an equal weight in a comment, which `consensus_tree` honors.
+    `basename`.out is the output file of the first of the best runs.
+
+    Parameters
+    ----------
+    n_workers : int
+        The number of runs at a time; if less than 1, use one per CPU.
+
+    Returns
+    -------
+    treename : str
+        The name of the file containing the best tree[s].
+    """
+    seed = kwarg.pop('seed', 9)
+    basename = phy_in.rpartition('.')[0]
+    journal = kwarg.get('journal')
+    lst_dest = [basename + '.out', basename + '.tree']
+    if journal:
+        key_journal = _cache_key(phy_exec,
+                ['jumbles', str(n_jumble), str(seed)] + _journal_opts(kwarg),
+                [phy_in] + ([kwarg['weights']] if kwarg.get('weights')
+                    else []))
+        if journal_done(journal, key_journal, lst_dest):
+            print('Resuming: all jumbles already done for {:s}'.format(
+                ', '.join(lst_dest)))
+            return basename + '.tree'
+    lst_runname = ['{base}.jumble{i:d}'.format(base=basename, i=iI)
+            for iI in range(n_jumble)]
+    lst_job = list()
+    for (iI, runname) in enumerate(lst_runname):
+        kwarg_run = dict(kwarg,
+                phy_exec=phy_exec,
+                seed=_shard_seed(seed, iI),
+                jumble=1,
+                randomize=True,
+                basename_out=runname,
+                )
+        lst_job.append((_infer_trees, phy_in, kwarg_run))
+    done = False
+    try:
+        # as with shards, the work is done by the PHYLIP subprocesses
+        _run_jobs(lst_job, n_workers, threads=True)
+        lst_score = [_tree_score(runname + '.out')
+                for runname in lst_runname]
+        score_best = min(lst_score)
+        lst_best = [runname for (runname, score)
+                in zip(lst_runname, lst_score) if score == score_best]
+        lst_tree = list()
+        set_key = set()
+        dict_taxa = None
+        for runname in lst_best:
+            for tree in iter_newick(runname + '.tree'):
+                if dict_taxa is None:
+                    dict_taxa = dict((leaf.name, iI) for (iI, leaf)
+                            in enumerate(tree.leaves()))
+                key = frozenset(_tree_splits(tree, dict_taxa))
+                if key not in set_key:
+                    set_key.add(key)
+                    lst_tree.append(tree)
+        for tree in lst_tree:
+            if len(lst_tree) > 1:
+                tree.comment = '{:.4f}'.format(1. / len(lst_tree))
+            else:
+                tree.comment = None
+        write_newick(lst_tree, basename + '.tree')
+        shutil.copyfile(lst_best[0] + '.out', basename + '.out')
+        done = True
+    finally:
+        # as for shards, keep the runs finished so far for a rerun
+        if done or not journal:
+            for runname in lst_runname:
+                _clear_files(runname + '.out', runname + '.tree')
+    if journal:
+        journal_record(journal, 'jumbles', key_journal, lst_dest)
+    print('Best score {score:g} found by {n_best:d} of {n:d} jumbles, '
+            'with {n_tree:d} distinct tree[s]'.format(score=score_best,
+                n_best=len(lst_best), n=n_jumble, n_tree=len(lst_tree)))
+    return basename + '.tree'
+
+def _tree_score(fname):
+    """
+    Get the score of the best tree in the output file of a phylogeny
+    program, such that lower is better: the number of steps for the
+    parsimony programs, the negative number of compatible sites for
+    dnacomp, or the negative log likelihood for dnaml.
+    """
+    with open(fname, 'r') as f:
+        text = f.read()
+    lst_steps = re.findall(r'requires a total of\s+([-+.0-9eE]+)', text)
+    if lst_steps:
+        return min(float(steps) for steps in lst_steps)
+    lst_compat = re.findall(
+            r'total number of compatible sites is\s+([-+.0-9eE]+)', text)
+    if lst_compat:
+        return -max(float(compat) for compat in lst_compat)
+    lst_lnl = re.findall(r'Ln Likelihood\s*=\s*([-+.0-9eE]+)', text)
+    if lst_lnl:
+        return -max(float(lnl) for lnl in lst_lnl)
+    raise ValueError('No tree score found in {:s}.'.format(fname))
+
+def _shard_seed(seed, i_shard):
+    """
+    Derive the seed for block `i_shard` of a sharded run, or for the
+    `i_shard`th of several jumble runs, from `seed`.
+
+    PHYLIP wants seeds of the form 4n+1, and adding a multiple of 4
+    keeps them that way.
+    Block 0 keeps the original seed.
+    """
+    return seed + 4 * i_shard
+
+def _split_datasets(fname, n_dataset, n_shards):
+    """
+    Split a multiple dataset *.phy file, such as the output of seqboot,
+    into `n_shards` files of contiguous datasets.
+
+    The file is streamed, so only one line is held in memory at a time.
+    Each dataset is recognized by its header line, which holds only the
+    number of sequences and the sequence length.
+
+    Returns
+    -------
+    lst_shard : list of 2-tuple
+        Pairs of the filename of each block, and the number of datasets
+        in it, in order.
+    """
+    n_shards = max(1, min(n_shards, n_dataset))
+    basename = fname.rpartition('.')[0]
+    reg_header = re.compile(r'^\s*\d+\s+\d+\s*$')
+    lst_shard = list()
+    f_out = None
+    i_dataset = -1
+    try:
+        with open(fname, 'r') as f_in:
+            for line in f_in:
+                if reg_header.match(line):
+                    i_dataset += 1
+                    i_shard = i_dataset * n_shards // n_dataset
+                    if i_shard == len(lst_shard):
+                        # start the next block
+                        if f_out is not None:
+                            f_out.close()
+                        shardname = '{base}.shard{i:d}.phy'.format(
+                                base=basename, i=i_shard)
+                        f_out = open(shardname, 'w')
+                        lst_shard.append([shardname, 0])
+                    lst_shard[-1][1] += 1
+                if f_out is not None:
+                    f_out.write(line)
+    finally:
+        if f_out is not None:
+            f_out.close()
+    if i_dataset + 1 != n_dataset:
+        for (shardname, n) in lst_shard:
+            _clear_files(shardname)
+        raise ValueError(
+                'Expected {exp:d} datasets in {fname}, found {n:d}.'.format(
+                    exp=n_dataset, fname=fname, n=i_dataset + 1))
+    return [tuple(shard) for shard in lst_shard]
+
+def _split_weights(fname, n_set, n_shards):
+    """
+    Split a weights file of `n_set` sets of weights, one per line, as
+    written by `write_weights`, into `n_shards` files of contiguous sets.
+
+    Returns
+    -------
+    lst_shard : list of 2-tuple
+        Pairs of the filename of each block, and the number of sets in
+        it, in order.
+    """
+    n_shards = max(1, min(n_shards, n_set))
+    basename = fname.rpartition('.')[0]
+    with open(fname, 'r') as f_in:
+        lst_line = [line for line in f_in if line.strip()]
+    if len(lst_line) != n_set:
+        raise ValueError(
+                'Expected {exp:d} sets of weights in {fname}, '
+                'found {n:d}.'.format(exp=n_set, fname=fname,
+                    n=len(lst_line)))
+    lst_shard = list()
+    for i_shard in range(n_shards):
+        lst_block = lst_line[i_shard * n_set // n_shards:
+                (i_shard + 1) * n_set // n_shards]
+        shardname = '{base}.shard{i:d}.weights'.format(base=basename,
+                i=i_shard)
+        with open(shardname, 'w') as f_out:
+            f_out.writelines(lst_block)
+        lst_shard.append((shardname, len(lst_block)))
+    return lst_shard
+
+def _concat_files(lst_fname, fname_out):
+    """
+    Join the files in `lst_fname` end to end, in order, into `fname_out`.
+    """
+    with open(fname_out, 'wb') as f_out:
+        for fname in lst_fname:
+            with open(fname, 'rb') as f_in:
+                shutil.copyfileobj(f_in, f_out)
+    return fname_out
+
+@_traced_call('run_seqboot')
+def run_seqboot(fname, n_bootstrap, **kwarg):
+    """
+    Run seqboot on a given file for a given number of bootstraps.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the sequential *.phy file to bootstrap.
+    n_bootstrap : int
+        The number of bootstrap replicates to generate.
+    boot_exec : list, optional
+        The command line args needed to call seqboot
+        (default: ['phylip', 'seqboot']).
+    native_seqboot : bool, optional
+        Resample the columns in this process with NumPy instead of
+        running seqboot (default: False).
+        The replicates drawn for a given seed differ from those seqboot
+        would draw.
+    seed : int, optional
+        The random seed (default: 9).
+    weights : str, optional
+        A PHYLIP weights file for seqboot to read, with its 'W' option
+        (default: None).
+        seqboot leaves the characters of weight 0 out of the resampling.
+    compress : bool, optional
+        Resample the site patterns of the alignment, as from
+        `compress_sites`, in this process, and write the replicates as
+        sets of weights, one per line, to `basename`.boot.weights, on the
+        patterns written to `basename`.boot.phy (default: False).
+        The phylogeny programs read these as multiple weights, so each
+        replicate costs as many sites as there are patterns, rather than
+        as the alignment is long.
+    informative : bool, optional
+        With `compress`, drop the parsimony uninformative columns, which
+        are still counted when resampling (default: False).
+    """
+    boot_exec = kwarg.pop('boot_exec', boot_exec_default)
+    native_seqboot = kwarg.pop('native_seqboot', False)
+    weightfile = kwarg.pop('weights', None)
+    compress = kwarg.pop('compress', False)
+    informative = kwarg.pop('informative', False)
+    basename = fname.rpartition('.')[0]
+    bootname = basename + '.boot.phy'
+    _trace_note(bootstrap=n_bootstrap, native=native_seqboot,
+            **_phy_shape(fname))
+    if compress or native_seqboot:
+        if weightfile is not None:
+            raise ValueError(
+                    "Weights are only read by seqboot, not native_seqboot.")
+        seed = kwarg.pop('seed', 9)
+        journal = kwarg.pop('journal', None)
+        lst_dest = [bootname]
+        if compress:
+            lst_dest.append(_weights_name(bootname))
+        if journal:
+            key = _cache_key(['seqboot_native'],
+                    [str(n_bootstrap), str(seed), str(compress),
+                        str(informative)], [fname])
+            if journal_done(journal, key, lst_dest):
+                print('Resuming: seqboot already done for {:s}'.format(
+                    ', '.join(lst_dest)))
+                return bootname
+        if compress:
+            _seqboot_patterns(fname, bootname, n_bootstrap, seed=seed,
+                    informative=informative)
+        else:
+            _seqboot_native(fname, bootname, n_bootstrap, seed=seed)
+        if journal:
+            journal_record(journal, 'seqboot_native', key, lst_dest)
+        return bootname
+    kwarg_stage = _stage_kwarg(kwarg)
+    # seqboot is the only program for this stage
+    kwarg_stage.pop('fallback', None)
+    seqboot_opts = _get_seqboot_opts(os.path.basename(fname),
+            n_bootstrap, weights=weightfile is not None, **kwarg)
+    lst_input = [fname]
+    if weightfile is not None:
+        # PHYLIP reads the weights from a file named 'weights'
+        lst_input.append((weightfile, 'weights'))
+    _run_stage(boot_exec, seqboot_opts, lst_input, [('outfile', bootname)],
+            trace_info=dict(bootstrap=n_bootstrap), **kwarg_stage)
+    return bootname
+
+def _seqboot_native(fname, bootname, n_bootstrap, seed=9):
+    """
+    Write `n_bootstrap` bootstrap replicates of the alignment in `fname`
+    to `bootname`, in the same multiple dataset format as seqboot.
+
+    The column indices for all replicates are drawn in a single batch
+    from a generator seeded with `seed`, and each replicate is built with
+    one fancy-indexing operation and written as soon as it is made.
+    Each sequence is written on a single line following its name, which
+    reads the same whether PHYLIP treats the data as interleaved or
+    sequential.
+    """
+    import numpy as np
+    alignment = Alignment.from_phy(fname)
+    arr_seq = alignment.seqs
+    (n_seq, len_seq) = arr_seq.shape
+    rng = np.random.RandomState(seed)
+    arr_idx = rng.randint(0, len_seq, size=(n_bootstrap, len_seq))
+    # Every replicate has the same layout: a 10 character name, the
+    # resampled sequence, and a newline, so only the middle changes.
+    arr_row = _phy_block(alignment.names, len_seq)
+    header = '{:5d} {:5d}\n'.format(n_seq, len_seq).encode('ascii')
+    with open(bootname, 'wb') as f:
+        for idx in arr_idx:
+            arr_row[:, 10:-1] = arr_seq[:, idx]
+            f.write(header)
+            f.write(arr_row.tobytes())
+    return bootname
+
+def _seqboot_patterns(fname, bootname, n_bootstrap, seed=9,
+        informative=False):
+    """
+    Bootstrap the alignment in `fname` as sets of weights on its site
+    patterns, written to `bootname` and the weights file beside it.
+
+    Drawing as many columns as the alignment has, with replacement, draws
+    each pattern a multinomially distributed number of times, in
+    proportion to the columns it stands for, so the counts of all
+    replicates are drawn in a single batch.
+    With `informative`, the dropped columns are drawn too, as one more
+    category, and then left out.
+    """
+    import numpy as np
+    alignment = Alignment.from_phy(fname)
+    n_site = alignment.shape[1]
+    (patterns, counts) = alignment.site_patterns(informative=informative)
+    if len(counts) == 0:
+        raise ValueError('No informative sites in {:s}.'.format(fname))
+    arr_weight = _resample_patterns(counts, n_site, n_bootstrap, seed)
+    (idx, arr_split) = _weight_columns(arr_weight)
+    patterns.take_columns(idx).write_phy(bootname)
+    write_weights(arr_split, _weights_name(bootname))
+    print('Bootstrapped {n:d} sites as weights on {n_pattern:d} site '
+            'patterns.'.format(n=n_site, n_pattern=len(counts)))
+    return bootname
+
+def _resample_patterns(counts, n_site, n_bootstrap, seed=9):
+    """
+    Draw the number of times each site pattern, standing for `counts`
+    of the `n_site` columns, is drawn in each of `n_bootstrap` bootstrap
+    replicates, as an int array of shape (n_bootstrap, len(counts)).
+
+    Any columns not accounted for in `counts` are drawn as one more
+    pattern, which is left out.
+    """
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    prob = np.append(counts, n_site - counts.sum()) / float(n_site)
+    return rng.multinomial(n_site, prob, size=n_bootstrap)[:, :-1]
+
+@_traced_call('run_neighbor')
+def run_neighbor(phy_in, **kwarg):
+    """
+    Build a tree from the pairwise distances between the sequences in
+    `phy_in`, computed in this process, with PHYLIP neighbor.
+
+    The distances are written to `basename`.dist, and the output files
+    'outfile' and 'outtree' of neighbor are renamed to `basename`.out and
+    `basename`.tree, where `basename` is derived from the input file
+    name, with .boot added if bootstrapping.
+
+    Parameters
+    ----------
+    phy_in : str
+        Filename of the *.phy file.
+    model : str, optional
+        The distance, one of 'p' (the fraction of sites that differ),
+        'jc' (Jukes-Cantor) or 'k2p' (Kimura 2-parameter)
+        (default: 'k2p').
+    bootstrap : int, optional
+        The number of bootstrap replicates to compute distances for, and
+        build trees from (default: None, no bootstrapping).
+    seed : int, optional
+        The random seed, for bootstrapping and for neighbor
+        (default: 9).
+    upgma : bool, optional
+        Build UPGMA trees rather than neighbor joining trees
+        (default: False).
+    nbr_exec : list, optional
+        The command line args needed to call neighbor
+        (default: ['phylip', 'neighbor']).
+    block_size : int, optional
+        As for `distance_matrix`.
+
+    Returns
+    -------
+    treename : str
+        The name of the file containing the tree[s].
+    """
+    nbr_exec = kwarg.pop('nbr_exec', nbr_exec_default)
+    model = kwarg.pop('model', 'k2p')
+    bootstrap = kwarg.pop('bootstrap', None)
+    seed = kwarg.pop('seed', 9)
+    upgma = kwarg.pop('upgma', False)
+    block_size = kwarg.pop('block_size', 256)
+    kwarg_stage = _stage_kwarg(kwarg)
+    # neighbor is the only program for this stage
+    kwarg_stage.pop('fallback', None)
+    basename = phy_in.rpartition('.')[0]
+    if bootstrap:
+        basename += '.boot'
+    distname = compute_distances(phy_in, basename + '.dist', model=model,
+            bootstrap=bootstrap, seed=seed, block_size=block_size,
+            lower=True)
+    nbr_opts = _get_neighbor_opts(os.path.basename(distname),
+            bootstrap=bootstrap, seed=seed, upgma=upgma, lower=True)
+    _run_stage(nbr_exec, nbr_opts, [distname],
+            [('outfile', basename + '.out'), ('outtree', basename + '.tree')],
+            trace_info=dict(bootstrap=bootstrap or None), **kwarg_stage)
+    return basename + '.tree'
+
+@_traced_call('compute_distances')
+def compute_distances(phy_in, distname=None, model='k2p', bootstrap=None,
+        seed=9, block_size=256, lower=False):
+    """
+    Compute the pairwise distances between the sequences in `phy_in`, and
+    write them to the PHYLIP distance matrix file `distname`, by default
+    `basename`.dist.
+
+    The distances are computed on the unique site patterns, each counted
+    as often as it appears.
+    With `bootstrap`, the file instead holds one matrix for each of that
+    many bootstrap replicates, which are never written out as
+    alignments: the pattern counts of each are drawn as by `run_seqboot`
+    with `compress`, and its distances computed with those as weights.
+    With `lower`, only the lower triangle of each matrix is written,
+    which is half as much to write and for neighbor to read.
+
+    Returns
+    -------
+    distname : str
+        The filename of the distance matrix file.
+    """
+    import numpy as np
+    if distname is None:
+        distname = phy_in.rpartition('.')[0] + '.dist'
+    alignment = Alignment.from_phy(phy_in)
+    (patterns, counts) = alignment.site_patterns()
+    if bootstrap:
+        arr_weight = _resample_patterns(counts, alignment.shape[1],
+                bootstrap, seed)
+    else:
+        arr_weight = counts[np.newaxis]
+    iter_matrix = _iter_distance_matrices(patterns, model, arr_weight,
+            block_size)
+    write_distances(iter_matrix, alignment.names, distname, lower=lower)
+    return distname
+
+def distance_matrix(alignment, model='k2p', weights=None, block_size=256):
+    """
+    Compute the distances between every pair of sequences of an
+    alignment.
+
+    Only the sites at which both sequences have one of A, C, G or T
+    (case insensitively) are counted.
+    The counts for `block_size` sequences at a time against all of the
+    others are made as matrix products of per base indicator matrices,
+    so the work is done by BLAS, and the memory used beyond the result
+    stays in proportion to `block_size`.
+
+    Parameters
+    ----------
+    alignment : Alignment
+        The aligned sequences.
+    model : str, optional
+        One of 'p' (the fraction of sites that differ), 'jc'
+        (Jukes-Cantor) or 'k2p' (Kimura 2-parameter) (default: 'k2p').
+    weights : array_like, optional
+        The number of times to count each column (default: None, once
+        each).
+    block_size : int, optional
+        The number of sequences in each block (default: 256).
+
+    Returns
+    -------
+    numpy.ndarray
+        A float array of shape (n_seq, n_seq).
+        Distances which cannot be corrected, because the sequences are
+        too far apart or share no sites, are set to twice the largest
+        of the others.
+    """
+    return next(_iter_distance_matrices(alignment, model, [weights],
+        block_size))
+
+def _iter_distance_matrices(alignment, model, iter_weight, block_size=256):
+    """
+    Yield the distance matrix of `alignment` for each set of column
+    weights in `iter_weight`, as `distance_matrix` does, with the
+    indicator matrices made only once.
+    """
+    import numpy as np
+    if model not in lst_dist_model:
+        raise ValueError('Invalid distance model {model}'.format(
+            model=model))
+    seqs = alignment.upper()
+    (n_seq, len_seq) = seqs.shape
+    lst_base = [(seqs == ord(base)).astype(np.float32) for base in 'ACGT']
+    purine = lst_base[0] + lst_base[2]
+    pyrimidine = lst_base[1] + lst_base[3]
+    valid = purine + pyrimidine
+    for weight in iter_weight:
+        if weight is None:
+            weight = np.ones(len_seq, dtype=np.float32)
+        weight = np.asarray(weight, dtype=np.float32)
+        # weighting one side of each product counts each site by its
+        # weight
+        valid_w = valid * weight
+        lst_base_w = [base * weight for base in lst_base]
+        if model == 'k2p':
+            purine_w = purine * weight
+            pyrimidine_w = pyrimidine * weight
+        arr_dist = np.empty((n_seq, n_seq))
+        for i_start in range(0, n_seq, block_size):
+            blk = slice(i_start, i_start + block_size)
+            n_valid = valid[blk].dot(valid_w.T).astype(float)
+            n_match = sum(base[blk].dot(base_w.T) for (base, base_w)
+                    in zip(lst_base, lst_base_w)).astype(float)
+            n_same = None
+            if model == 'k2p':
+                # pairs of sites both purines or both pyrimidines, which
+                # differ only by transitions
+                n_same = (purine[blk].dot(purine_w.T)
+                        + pyrimidine[blk].dot(pyrimidine_w.T)).astype(float)
+            arr_dist[blk] = _pair_distances(n_valid, n_match, n_same, model)
+        np.fill_diagonal(arr_dist, 0.)
+        is_bad = ~np.isfinite(arr_dist)
+        if is_bad.any():
+            dist_max = arr_dist[~is_bad].max() if (~is_bad).any() else 0.
+            arr_dist[is_bad] = 2 * dist_max if dist_max > 0 else 1.
+            print('{:d} distances could not be corrected.'.format(
+                int(is_bad.sum()) // 2))
+        yield arr_dist
+
+def _pair_distances(n_valid, n_match, n_same, model):
+    """
+    Compute distances under `model` from the number of sites compared,
+    the number that match, and for 'k2p', the number at which both are
+    purines or both pyrimidines, leaving NaN or inf where there are none.
+    """
+    import numpy as np
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = (n_valid - n_match) / n_valid
+        if model == 'p':
+            return p
+        if model == 'jc':
+            return -0.75 * np.log(1. - p / 0.75)
+        transition = (n_same - n_match) / n_valid
+        transversion = (n_valid - n_same) / n_valid
+        return (-0.5 * np.log(1. - 2. * transition - transversion)
+                - 0.25 * np.log(1. - 2. * transversion))
+
+def write_distances(iter_matrix, names, fname, lower=False):
+    """
+    Write one or more square distance matrices between the sequences
+    `names` to the PHYLIP distance matrix file `fname`, one after the
+    other, as neighbor reads multiple datasets.
+
+    With `lower`, write only the lower triangle of each, without the
+    diagonal, for PHYLIP's 'L' option.
+    """
+    lst_name = [str(name)[:10].ljust(10) for name in names]
+    n_seq = len(lst_name)
+    with open(fname, 'w') as f:
+        for arr_dist in iter_matrix:
+            f.write('{:5d}\n'.format(n_seq))
+            for (iI, (name, row)) in enumerate(zip(lst_name, arr_dist)):
+                if lower:
+                    row = row[:iI]
+                f.write(name + (' %.6f' * len(row)) % tuple(row) + '\n')
+    return fname
+
+@_traced_call('run_consense')
+def run_consense(fname, **kwarg):
+    """
+    Run consense on a given set of bootstrapped trees to form a consensus tree.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the trees from which to build the consensus tree.
+    type : str, optional
+        The consensus type, one of 'mre' (extended majority rule),
+        'strict', 'mr' (majority rule) or 'ml' (M sub l)
+        (default: 'mre').
+    fraction : float, optional
+        For 'ml', the fraction of trees in which a split must appear
+        to be included, between 0.5 and 1 (default: 0.5).
+    native_consense : bool, optional
+        Build the consensus tree in this process instead of running
+        consense (default: False).
+    """
+    native_consense = kwarg.pop('native_consense', False)
+    kwarg_stage = _stage_kwarg(kwarg)
+    kwarg_stage.pop('fallback', None)
+    basename = fname.rpartition('.')[0]
+    outname = basename + '.cons.out'
+    treename = basename + '.cons.tree'
+    _trace_note(native=native_consense)
+    if native_consense:
+        _consense_native(fname, outname, treename, **kwarg)
+        return treename
+    consense_opts = _get_consense_opts(os.path.basename(fname), **kwarg)
+    _run_stage(cons_exec, consense_opts, [fname],
+            [('outfile', outname), ('outtree', treename)],
+            **kwarg_stage)
+    return treename
+
+def _consense_native(fname, outname, treename, **kwarg):
+    """
+    Build a consensus tree from the trees in `fname` without consense,
+    and write it to `treename`, with a table of the splits used to
+    `outname`.
+
+    Like consense, the tree is rooted on the first species, and each
+    branch length is the (weighted) number of trees in which that branch
+    was found.
+    """
+    cons_type = kwarg.pop('type', 'mre')
+    fraction = kwarg.pop('fraction', 0.5)
+    (tree, lst_taxa, lst_split, w_total) = consensus_tree(
+            iter_newick(fname), cons_type=cons_type, fraction=fraction)
+    with open(treename, 'w') as f:
+        f.write(newick_str(tree) + '\n')
+    n_taxa = len(lst_taxa)
+    with open(outname, 'w') as f:
+        f.write('Consensus tree ({cons}) from {n:g} trees\n\n'.format(
+            cons=cons_type, n=w_total))
+        f.write('Species in order:\n\n')
+        for (iI, name) in enumerate(lst_taxa):
+            f.write('{i:5d}. {name}\n'.format(i=iI + 1, name=name))
+        f.write('\nSets included in the consensus tree\n\n')
+        f.write('Set (species in order)     How many times out of '
+                '{n:.2f}\n\n'.format(n=w_total))
+        for (split, count) in lst_split:
+            pattern = ''.join(
+                    '*' if split >> iI & 1 else '.' for iI in range(n_taxa))
+            f.write('{pattern}  {count:.2f}\n'.format(
+                pattern=pattern, count=count))
+    return treename
+
+def consensus_tree(iter_tree, cons_type='mre', fraction=0.5):
+    """
+    Build a consensus tree from an iterable of trees.
+
+    The trees are consumed one at a time.
+    Each split (bipartition) of the taxa is encoded as an integer
+    bitset, with bit i set for the i-th taxon of the first tree, and
+    always on the side away from the first taxon, so that the same
+    split on different trees gets the same key in a table of counts.
+
+    Parameters
+    ----------
+    iter_tree : iterable of TreeNode
+        The trees, e.g. from `iter_newick`.
+        A tree weight in a comment on the root, as written by PHYLIP
+        when there are tied trees, is honored.
+    cons_type : str, optional
+        'strict' keeps splits found in every tree, 'mr' those in more
+        than half of the trees, 'ml' those in more than `fraction` of
+        the trees, and 'mre' (default) adds to the majority rule splits
+        any other splits compatible with those already chosen, in order
+        of decreasing frequency.
+    fraction : float, optional
+        The threshold for 'ml', between 0.5 and 1 (default: 0.5).
+
+    Returns
+    -------
+    tree : TreeNode
+        The consensus tree.
+    lst_taxa : list of str
+        The taxa, in the order of their bits.
+    lst_split : list of 2-tuple
+        The splits in the consensus tree as bitsets, each with its count.
+    w_total : float
+        The total weight (number) of trees.
+    """
+    if cons_type not in ('mre', 'strict', 'mr', 'ml'):
+        raise ValueError(
+                'Invalid consensus type {cons}'.format(cons=cons_type))
+    if cons_type == 'ml' and not 0.5 <= fraction <= 1:
+        raise ValueError('fraction must be between 0.5 and 1.')
+    lst_taxa = None
+    dict_count = dict()
+    w_total = 0.
+    for tree in iter_tree:
+        if lst_taxa is None:
+            lst_taxa = [leaf.name for leaf in tree.leaves()]
+            dict_taxa = dict(
+                    (name, iI) for (iI, name) in enumerate(lst_taxa))
+        weight = _tree_weight(tree)
+        w_total += weight
+        for split in _tree_splits(tree, dict_taxa):
+            dict_count[split] = dict_count.get(split, 0.) + weight
+    if lst_taxa is None:
+        raise ValueError('No trees found.')
+    # most frequent first, ties broken by the bitset, to be reproducible
+    lst_cand = sorted(dict_count.items(), key=lambda kv: (-kv[1], kv[0]))
+    # allow for rounding in the weights of tied trees
+    tol = 1e-6 * w_total
+    if cons_type == 'strict':
+        lst_split = [kv for kv in lst_cand if kv[1] >= w_total - tol]
+    elif cons_type == 'mr':
+        lst_split = [kv for kv in lst_cand if kv[1] > 0.5 * w_total + tol]
+    elif cons_type == 'ml':
+        lst_split = [kv for kv in lst_cand
+                if kv[1] > fraction * w_total + tol]
+    else:
+        lst_split = list()
+        for (split, count) in lst_cand:
+            if all(_compatible(split, other) for (other, n) in lst_split):
+                lst_split.append((split, count))
+    tree = _splits2tree(lst_taxa, lst_split, w_total)
+    return (tree, lst_taxa, lst_split, w_total)
+
+def _tree_weight(tree):
+    """
+    Get the weight of a tree from the comment on its root, e.g. the
+    '[0.5000]' PHYLIP writes after each of two tied trees.
+    """
+    try:
+        return float(tree.comment)
+    except (TypeError, ValueError):
+        return 1.
+
+def _tree_splits(tree, dict_taxa):
+    """
+    Get the set of non-trivial splits in `tree` as integer bitsets on the
+    side away from taxon 0.
+    """
+    n_taxa = len(dict_taxa)
+    mask = (1 << n_taxa) - 1
+    set_split = set()
+    dict_bits = dict()
+    n_leaves = 0
+    for node in tree.postorder():
+        if node.is_leaf():
+            try:
+                bits = 1 << dict_taxa[node.name]
+            except KeyError:
+                raise ValueError(
+                        'Taxon {name} is not in the first tree.'.format(
+                            name=node.name))
+            n_leaves += 1
+        else:
+            bits = 0
+            for child in node.children:
+                bits |= dict_bits.pop(id(child))
+            if bits & 1:
+                split = bits ^ mask
+            else:
+                split = bits
+            if 1 < _popcount(split) < n_taxa - 1:
+                set_split.add(split)
+        dict_bits[id(node)] = bits
+    if n_leaves != n_taxa or dict_bits[id(tree)] != mask:
+        raise ValueError('Not all trees have the same taxa.')
+    return set_split
+
+def _popcount(bits):
+    """
+    Count the set bits of an integer.
+    """
+    return bin(bits).count('1')
+
+def _compatible(split_a, split_b):
+    """
+    Whether two splits, both on the side away from taxon 0, can be on
+    the same tree, i.e. are either disjoint or nested.
+    """
+    both = split_a & split_b
+    return both == 0 or both == split_a or both == split_b
+
+def _splits2tree(lst_taxa, lst_split, w_total):
+    """
+    Build a tree from a set of compatible splits, rooted on taxon 0.
+
+    The splits are added largest first, so the parent of each new split
+    is the innermost split already containing any one of its taxa.
+    """
+    n_taxa = len(lst_taxa)
+    root = TreeNode()
+    lst_owner = [root] * n_taxa
+    dict_min = {id(root): 0}
+    for (split, count) in sorted(lst_split,
+            key=lambda kv: (-_popcount(kv[0]), kv[0])):
+        lowest = (split & -split).bit_length() - 1
+        node = TreeNode(length=count)
+        lst_owner[lowest].children.append(node)
+        dict_min[id(node)] = lowest
+        bits = split
+        while bits:
+            low = bits & -bits
+            lst_owner[low.bit_length() - 1] = node
+            bits ^= low
+    for (iI, name) in enumerate(lst_taxa):
+        leaf = TreeNode(name=name, length=w_total)
+        lst_owner[iI].children.append(leaf)
+        dict_min[id(leaf)] = iI
+    # order children by their first taxon, so the output is stable
+    for node in root.postorder():
+        node.children.sort(key=lambda child: dict_min[id(child)])
+    return root
+
+@_traced_call('cleanup_consense')
+def cleanup_consense(fname_consensus, phy_orig, **kwarg):
+    """
+    Use a consensus tree, and an original (non-bootstrapped) *.phy input
+    file to generate a cleaned up consensus tree that estimates the true
+    tree.
+
+    Parameters
+    ----------
+    fname_consensus : str
+        The consensus tree file.
+    phy_orig : str
+        The *.phy file the bootstrap replicates were drawn from.
+    native_cleanup : bool, optional
+        Compute the branch lengths in this process with Fitch parsimony,
+        instead of running the phylogeny program on the consensus tree,
+        and keep the support of each branch as the label of the node
+        below it (default: False).
+        No `basename`.out is written in this case.
+    """
+    # if phy_exec is provided, or None, use default
+    phy_exec = kwarg.pop('phy_exec', None)
+    if phy_exec == None:
+        phy_exec = phy_exec_default
+    native_cleanup = kwarg.pop('native_cleanup', False)
+    kwarg_stage = _stage_kwarg(kwarg)
+    basename = phy_orig.rpartition('.')[0]
     outname = basename + '.out'
     treename = basename + '.tree'
-    print('Inferred tree[s] on {:s}'.format(treename))
+    rawname = basename + '.raw.tree'
+    _trace_note(native=native_cleanup)
+    if native_cleanup:
+        for tree in iter_newick(fname_consensus):
+            # consense writes a single tree
+            break
+        else:
+            raise ValueError(
+                    'No tree found in {:s}.'.format(fname_consensus))
+        _support_labels(tree)
+        fitch_branch_lengths(tree, Alignment.from_phy(phy_orig))
+        write_newick([tree], treename)
+        print('Edge length corrected consensus tree is: {:s}'.format(
+            treename))
+        return treename
+    # setup options for consensus cleanup
+    lst_phy_opts = _get_phy_opts(os.path.basename(phy_orig),
+            fname_tree=os.path.basename(fname_consensus),
+            search=False,
+            interleaved=_phy_interleaved(phy_orig),
+            )
+    # the raw tree is removed below, so the journal records the files
+    # kept instead of those the program wrote
+    journal = kwarg_stage.pop('journal', None)
+    lst_dest = [outname, treename]
+    if journal:
+        key = _cache_key(phy_exec, lst_phy_opts, [phy_orig, fname_consensus])
+        if journal_done(journal, key, lst_dest):
+            print('Resuming: cleanup already done for {:s}'.format(
+                ', '.join(lst_dest)))
+            return treename
+    _run_stage(phy_exec, lst_phy_opts, [phy_orig, fname_consensus],
+            [('outfile', outname), ('outtree', rawname)],
+            trailing_nl=False, **kwarg_stage)
+    # At this point, the output tree still has a leading and meaningless
+    # first line, which will cause problems down the line.
+    # So, we have to strip out that first line.
+    _strip_first_lines(rawname, fname_out=treename)
+    _clear_files(rawname)
+    if journal:
+        journal_record(journal, 'cleanup', key, lst_dest)
+    print('Edge length corrected consensus tree is: {:s}'.format(
+        treename))
+    return treename
+
+def _support_labels(tree):
+    """
+    Move the branch lengths of a consensus tree, which hold the support
+    of each branch, to the labels of the internal nodes, where they are
+    kept once the tree is given real branch lengths.
+    """
+    for node in tree.postorder():
+        if not node.is_leaf() and node is not tree \
+                and node.length is not None:
+            node.name = '{:g}'.format(node.length)
+    return tree
+
+def _state_masks():
+    """
+    Get a table from the ASCII code of each nucleotide character to the
+    set of states it stands for, as a bitmask over A, C, G, T and the gap,
+    which PHYLIP's parsimony programs treat as a fifth state.
+    Unknown characters stand for every state.
+    """
+    import numpy as np
+    arr_mask = np.full(256, 31, dtype=np.uint8)
+    dict_code = dict(A=1, C=2, G=4, T=8, U=8, R=5, Y=10, M=3, K=12, S=6,
+            W=9, H=11, B=14, V=7, D=13, N=15, X=15, O=16)
+    dict_code['-'] = 16
+    dict_code['?'] = 31
+    for (char, mask) in dict_code.items():
+        arr_mask[ord(char)] = mask
+        arr_mask[ord(char.lower())] = mask
+    return arr_mask
+
+def fitch_branch_lengths(tree, alignment):
+    """
+    Set the branch lengths of `tree` to the expected number of changes
+    per site along each branch under Fitch parsimony, like those the
+    phylogeny programs give a user tree, working on all sites at once.
+
+    The leaves are matched to the sequences of `alignment` by name.
+    Multifurcations, as in consensus trees, are allowed: the state set
+    of a node is the states found in the most of its children.
+    Then each node, from the root down, takes the states of its set that
+    it shares with its parent, if any, and a branch costs the chance that
+    a state drawn from the parent's set is not in the child's.
+
+    Parameters
+    ----------
+    tree : TreeNode
+        The tree, which is changed in place.
+    alignment : Alignment
+        The sequences at the leaves.
+
+    Returns
+    -------
+    score : float
+        The parsimony score (number of changes) of the tree.
+    """
+    import numpy as np
+    arr_state = _state_masks()[alignment.seqs]
+    n_site = arr_state.shape[1]
+    arr_shift = np.arange(5, dtype=np.uint8)[:, np.newaxis]
+    arr_popcount = np.array([bin(iI).count('1') for iI in range(32)],
+            dtype=np.float64)
+    dict_row = _leaf_rows(alignment.names)
+    dict_down = dict()
+    dict_parent = dict()
+    score = 0
+    lst_node = list(tree.postorder())
+    for node in lst_node:
+        if node.is_leaf():
+            try:
+                dict_down[id(node)] = arr_state[dict_row[node.name]]
+            except KeyError:
+                raise ValueError(
+                        'Taxon {name} is not in the alignment.'.format(
+                            name=node.name))
+            continue
+        arr_count = np.zeros((5, n_site), dtype=np.int32)
+        for child in node.children:
+            dict_parent[id(child)] = node
+            arr_count += (dict_down[id(child)] >> arr_shift) & 1
+        arr_max = arr_count.max(axis=0)
+        score += int((len(node.children) - arr_max).sum())
+        is_kept = (arr_count == arr_max) & (arr_max > 0)
+        dict_down[id(node)] = (is_kept.astype(np.uint8)
+                << arr_shift).sum(axis=0).astype(np.uint8)
+    # from the root down, parents before their children
+    dict_final = {id(tree): dict_down[id(tree)]}
+    for node in reversed(lst_node):
+        if node is tree:
+            continue
+        final_parent = dict_final[id(dict_parent[id(node)])]
+        down = dict_down[id(node)]
+        shared = down & final_parent
+        dict_final[id(node)] = np.where(shared != 0, shared, down)
+        # a state drawn from the parent's set stays the same along the
+        # branch if the child's set has it
+        arr_change = 1. - (arr_popcount[shared]
+                / arr_popcount[final_parent])
+        node.length = float(arr_change.sum()) / n_site
+    return score
+
+@_traced_call('update_tree')
+def update_tree(fname_tree, phy_orig, phy_new, **kwarg):
+    """
+    Add new sequences to an existing tree, without searching for a tree
+    from scratch: each is inserted on the branch where it adds the fewest
+    changes under Fitch parsimony.
+
+    The cost of inserting a sequence on each branch comes from the state
+    sets on either side of that branch, from one pass down the tree and
+    one back up, so every branch is scored at once with a few array
+    operations, on the unique site patterns weighted by their counts.
+    The sets are made again after each insertion.
+
+    Parameters
+    ----------
+    fname_tree : str
+        The tree file, of which the first tree is used, e.g. the
+        `basename`.tree from `run_phylip`.
+        Multifurcations, as in consensus trees, are allowed.
+    phy_orig : str
+        The *.phy file of the sequences at the leaves of the tree.
+    phy_new : str
+        A *.phy file of the sequences to add, of the same length.
+    phy_out : str, optional
+        Filename of the *.phy file of all of the sequences
+        (default: `basename`.updated.phy, from `phy_orig`).
+    rearrange : int, optional
+        The number of rounds in which to take each new sequence out of
+        the tree again and put it back where it now adds the fewest
+        changes, as the sequences added after it may have changed that
+        (default: 0).
+    refine : bool, optional
+        Run the phylogeny program on the updated tree as a user tree,
+        as `cleanup_consense` does, to get the branch lengths and score
+        it gives, rather than computing the branch lengths with
+        `fitch_branch_lengths` (default: False).
+    phy_exec : list, optional
+        With `refine`, the phylogeny program (default: dnapars).
+
+    Returns
+    -------
+    treename : str
+        The filename of the updated tree, which is `basename`.tree from
+        `phy_out`.
+    """
+    import numpy as np
+    phy_out = kwarg.pop('phy_out', None)
+    n_round = kwarg.pop('rearrange', 0)
+    refine = kwarg.pop('refine', False)
+    phy_exec = kwarg.pop('phy_exec', None) or phy_exec_default
+    kwarg_stage = _stage_kwarg(kwarg)
+    if phy_out is None:
+        phy_out = phy_orig.rpartition('.')[0] + '.updated.phy'
+    basename = phy_out.rpartition('.')[0]
+    treename = basename + '.tree'
+    for tree in iter_newick(fname_tree):
+        break
+    else:
+        raise ValueError('No tree found in {:s}.'.format(fname_tree))
+    alignment_orig = Alignment.from_phy(phy_orig)
+    alignment_new = Alignment.from_phy(phy_new)
+    if alignment_new.shape[1] != alignment_orig.shape[1]:
+        raise ValueError(
+                'The new sequences are not as long as those of {:s}.'.format(
+                    phy_orig))
+    set_name = set(str(name) for name in alignment_orig.names)
+    for name in alignment_new.names:
+        if str(name) in set_name:
+            raise ValueError(
+                    'Sequence {name} is already in {fname}.'.format(
+                        name=name, fname=phy_orig))
+    alignment = Alignment(
+            np.concatenate([alignment_orig.names, alignment_new.names]),
+            np.concatenate([alignment_orig.seqs, alignment_new.seqs]))
+    (patterns, counts) = alignment.site_patterns()
+    arr_state = _state_masks()[patterns.seqs]
+    dict_row = _leaf_rows(alignment.names)
+    lst_leaf = list()
+    for name in alignment_new.names:
+        # named as if read back from a tree file written by PHYLIP, like
+        # the leaves already there
+        leaf = TreeNode(name=str(name).replace('_', ' '))
+        arr_x = arr_state[dict_row[leaf.name]]
+        cost = _place_leaf(tree, leaf, arr_x, arr_state, dict_row, counts)
+        lst_leaf.append((leaf, arr_x))
+        print('Placed {name} on the tree, adding {cost:d} changes.'.format(
+            name=str(name), cost=cost))
+    for i_round in range(n_round):
+        n_moved = 0
+        for (leaf, arr_x) in lst_leaf:
+            sister = _sister_of(tree, leaf)
+            _prune_leaf(tree, leaf)
+            _place_leaf(tree, leaf, arr_x, arr_state, dict_row, counts)
+            n_moved += _sister_of(tree, leaf) is not sister
+        print('Rearrangement round {i:d}: moved {n:d} of {n_new:d} new '
+                'sequences.'.format(i=i_round + 1, n=n_moved,
+                    n_new=len(lst_leaf)))
+        if n_moved == 0:
+            break
+    alignment.write_phy(phy_out)
+    if not refine:
+        score = fitch_branch_lengths(tree, alignment)
+        write_newick([tree], treename)
+        print('Updated tree, of {score:d} changes, is: {name}'.format(
+            score=score, name=treename))
+        return treename
+    # have the phylogeny program evaluate the tree, as for a consensus
+    rawname = basename + '.raw.tree'
+    usertree = basename + '.user.tree'
+    write_newick([tree], usertree)
+    lst_phy_opts = _get_phy_opts(os.path.basename(phy_out),
+            fname_tree=os.path.basename(usertree),
+            search=False,
+            )
     try:
-        os.rename('outfile', outname)
-        os.rename('outtree', treename)
-    except:
-        print('The expected output was not generated. Phylip may have failed')
+        _run_stage(phy_exec, lst_phy_opts, [phy_out, usertree],
+                [('outfile', basename + '.out'), ('outtree', rawname)],
+                trailing_nl=False, **kwarg_stage)
+        _strip_first_lines(rawname, fname_out=treename)
+    finally:
+        _clear_files(rawname, usertree)
+    print('Updated tree is: {:s}'.format(treename))
+    return treename
+
+def _leaf_rows(names):
+    """
+    Map the names of the sequences of an alignment to their rows, also
+    with underscores read as blanks, as in unquoted tree labels.
+    """
+    dict_row = dict()
+    for (iI, name) in enumerate(names):
+        name = str(name)
+        dict_row[name] = iI
+        dict_row.setdefault(name.replace('_', ' '), iI)
+    return dict_row
+
+def _fitch_edge_sets(tree, arr_state, dict_row):
+    """
+    Get the Fitch state set of each branch of `tree`, i.e. those of the
+    two sides it joins, combined as a Fitch node would.
+
+    The set of the side below each node is made on a pass down the tree
+    (leaves first), and that of the side above it on a pass back up, from
+    those of its parent's other neighbours, so each branch sees the
+    whole of the tree, wherever the root is.
+    As in `fitch_branch_lengths`, a node keeps the states found in the
+    most of its neighbours.
+
+    Returns
+    -------
+    (lst_node, arr_edge) : tuple
+        The nodes other than the root, each of which stands for the
+        branch above it, and a uint8 array of shape (len(lst_node),
+        n_site) of the state set of each of those branches.
+    """
+    import numpy as np
+    arr_shift = np.arange(5, dtype=np.uint8)[:, np.newaxis]
+
+    def bits(arr_set):
+        return ((arr_set >> arr_shift) & 1).astype(np.int32)
+
+    def most(arr_count):
+        arr_max = arr_count.max(axis=0)
+        is_kept = (arr_count == arr_max) & (arr_max > 0)
+        return (is_kept.astype(np.uint8) << arr_shift).sum(
+                axis=0).astype(np.uint8)
+
+    lst_post = list(tree.postorder())
+    dict_down = dict()
+    dict_count = dict()
+    for node in lst_post:
+        if node.is_leaf():
+            try:
+                dict_down[id(node)] = arr_state[dict_row[node.name]]
+            except KeyError:
+                raise ValueError(
+                        'Taxon {name} is not in the alignment.'.format(
+                            name=node.name))
+            continue
+        arr_count = sum(bits(dict_down[id(child)])
+                for child in node.children)
+        dict_count[id(node)] = arr_count
+        dict_down[id(node)] = most(arr_count)
+    dict_up = dict()
+    lst_node = list()
+    lst_edge = list()
+    for node in reversed(lst_post):
+        if node.is_leaf():
+            continue
+        # the counts over all of the neighbours of the node
+        arr_total = dict_count[id(node)]
+        if id(node) in dict_up:
+            arr_total = arr_total + bits(dict_up[id(node)])
+        for child in node.children:
+            down = dict_down[id(child)]
+            up = most(arr_total - bits(down))
+            dict_up[id(child)] = up
+            shared = down & up
+            lst_node.append(child)
+            lst_edge.append(np.where(shared != 0, shared, down | up))
+    return (lst_node, np.array(lst_edge, dtype=np.uint8))
+
+def _place_leaf(tree, leaf, arr_x, arr_state, dict_row, counts):
+    """
+    Insert `leaf`, with the state sets `arr_x`, on the branch of `tree`
+    where it adds the fewest changes, weighting each site by `counts`,
+    and return that number of changes.
+    """
+    import numpy as np
+    (lst_node, arr_edge) = _fitch_edge_sets(tree, arr_state, dict_row)
+    if not lst_node:
+        tree.children.append(leaf)
+        return 0
+    arr_cost = ((arr_edge & arr_x) == 0).dot(counts)
+    i_best = int(np.argmin(arr_cost))
+    node = lst_node[i_best]
+    parent = _parent_of(tree, node)
+    joint = TreeNode(children=[node, leaf], length=node.length)
+    parent.children[parent.children.index(node)] = joint
+    return int(arr_cost[i_best])
+
+def _parent_of(tree, node):
+    """
+    Find the parent of `node` in `tree`, or None for the root.
+    """
+    for parent in tree.postorder():
+        for child in parent.children:
+            if child is node:
+                return parent
+    return None
+
+def _sister_of(tree, leaf):
+    """
+    Get the first other child of the parent of `leaf`.
+    """
+    parent = _parent_of(tree, leaf)
+    return [child for child in parent.children if child is not leaf][0]
+
+def _prune_leaf(tree, leaf):
+    """
+    Take `leaf` out of `tree`, and with it its parent, if only one child
+    is left there, joining that child's branch onto its parent's.
+    """
+    parent = _parent_of(tree, leaf)
+    parent.children.remove(leaf)
+    if len(parent.children) != 1 or parent is tree:
+        return None
+    child = parent.children[0]
+    grandparent = _parent_of(tree, parent)
+    if child.length is not None or parent.length is not None:
+        child.length = (child.length or 0.) + (parent.length or 0.)
+    grandparent.children[grandparent.children.index(parent)] = child
+    return None
+
+def write_cmdfile(opts, trailing_nl=False, cmdfname='.cmdfile'):
+    """
+    Writes a command file for use with PHYLIP programs based on the supplied
+    list of options.
+
+    Parameters
+    ----------
+    opts : list
+        A list of strings to write to the commandfile separated by newlines.
+    trailing_nl : bool
+        Whether or not to add a trailing newline character at the end of the
+        file (default: False).
+    cmdfname : str, optional
+        The name of the command file to write (default: '.cmdfile').
+
+    Notes
+    -----
+    The last option in `opts` will be written without a trailing newline
+    unless otherwise specified.
+    This is appropriate behavior for _most_ PHYLIP programs.
+    """
+    with open(cmdfname, 'w') as f:
+        for arg in opts[:-1]:
+            f.write(arg + '\n')
+        f.write(opts[-1])
+    return cmdfname
+
+def _run_stage(lst_exec, opts, lst_input, lst_output, **kwarg):
+    """
+    Run a PHYLIP program in its own scratch directory, and move its
+    output files into place, or copy them from the cache if the same
+    program has already been run with the same options on the same
+    inputs.
+
+    Parameters
+    ----------
+    lst_exec : list
+        The command line args needed to call the PHYLIP program.
+    opts : list
+        The options for the command file, as from `_get_phy_opts`, which
+        should refer to each input file by its basename.
+    lst_input : list
+        The input files, which are made available in the scratch
+        directory under their basenames, or pairs of the name of an
+        input file and the name under which to make it available, e.g.
+        (fname, 'weights').
+    lst_output : list of 2-tuple of str
+        Pairs of the name of a file written by PHYLIP, and the name to
+        which to move it.
+    trailing_nl : bool, optional
+        As for `write_cmdfile` (default: False).
+    cache : str, optional
+        The directory of the result cache, if any (default: None).
+    cache_size : int, optional
+        The size, in bytes, to which to trim the cache after adding to it.
+    fallback : list of list, optional
+        The command line args of programs to try in turn, with the same
+        options, if the program fails, or is killed for running over a
+        limit (default: None, give up straight away).
+    timeout, max_memory, progress : optional
+        As for `_call_phylip`.
+    trace_info : dict, optional
+        Extra info, such as the bootstrap count, for the trace event of
+        the run.
+    journal : str, optional
+        A journal file in which to record the run once it has finished,
+        and in which to look for such a record, in which case the run is
+        skipped, so that a pipeline stopped partway through can be
+        resumed (default: None).
+    """
+    run = _stage_prepare(lst_exec, opts, lst_input, lst_output, kwarg)
+    while _stage_begin(run):
+        try:
+            _call_phylip(run['exec'], opts, run['scratch'],
+                    trailing_nl=run['trailing_nl'], stats=run['info'],
+                    **kwarg)
+            _stage_end(run)
+        except PhylipError as err:
+            if not _stage_fail(run, err):
+                raise
+        except BaseException as err:
+            _stage_fail(run, err)
+            raise
+    return run['dest']
+
+def _stage_prepare(lst_exec, opts, lst_input, lst_output, kwarg,
+        nested=True):
+    """
+    Take the options of `_run_stage` out of `kwarg`, leaving those of
+    `_call_phylip`, and set up a run of a PHYLIP program for
+    `_stage_begin`, `_stage_end` and `_stage_fail`, which is done
+    already if the journal has a record of it.
+
+    The run is a dict, which may be handed from one thread to another
+    between the steps if not `nested`, as for `_trace_begin`.
+    """
+    journal = kwarg.pop('journal', None)
+    fallback = kwarg.pop('fallback', None) or list()
+    lst_stage = [fname if isinstance(fname, tuple)
+            else (fname, os.path.basename(fname)) for fname in lst_input]
+    lst_input = [fname for (fname, staged) in lst_stage]
+    lst_dest = [dest for (fname, dest) in lst_output]
+    run = dict(
+            opts=opts,
+            staged=lst_stage,
+            input=lst_input,
+            output=lst_output,
+            dest=lst_dest,
+            stage=os.path.basename(lst_exec[-1]),
+            attempts=[lst_exec] + list(fallback),
+            i_attempt=-1,
+            trailing_nl=kwarg.pop('trailing_nl', False),
+            trace_info=kwarg.pop('trace_info', None) or dict(),
+            cache=kwarg.pop('cache', None),
+            cache_size=kwarg.pop('cache_size', cache_size_default),
+            journal=journal,
+            nested=nested,
+            scratch=None,
+            frame=None,
+            done=False,
+            )
+    if journal:
+        run['key_journal'] = _cache_key(lst_exec, opts, lst_input)
+        if journal_done(journal, run['key_journal'], lst_dest):
+            print('Resuming: {:s} already done for {:s}'.format(
+                run['stage'], ', '.join(lst_dest)))
+            run['done'] = True
+    return run
+
+def _stage_begin(run):
+    """
+    Start the next attempt at the run `run` from `_stage_prepare`, in a
+    new scratch directory holding its inputs, unless the run is done, or
+    its outputs are in the cache.
+
+    Returns
+    -------
+    started : bool
+        Whether there is a PHYLIP program to call, `run['exec']`, in the
+        directory `run['scratch']`, with `run['info']` for its stats.
+    """
+    if run['done']:
+        return False
+    run['i_attempt'] += 1
+    lst_exec = run['exec'] = run['attempts'][run['i_attempt']]
+    if run['cache']:
+        run['key'] = _cache_key(lst_exec, run['opts'], run['input'])
+        if cache_fetch(run['cache'], run['key'], run['dest']):
+            print('Using cached output for {:s}'.format(
+                ', '.join(run['dest'])))
+            run['done'] = True
+            return False
+    info = dict(run['trace_info'], command=' '.join(lst_exec))
+    if run['input'][0].endswith('.phy'):
+        info.update(_phy_shape(run['input'][0]))
+    run['frame'] = _trace_begin(os.path.basename(lst_exec[-1]), info,
+            nested=run['nested'])
+    run['info'] = run['frame']['info']
+    try:
+        # run in a private directory, so that 'infile', 'outfile' and
+        # 'outtree' cannot collide with those of a concurrent job, made
+        # alongside the outputs, so that they can be moved into place
+        # with `os.rename`
+        dirname = os.path.dirname(os.path.abspath(run['dest'][0]))
+        run['scratch'] = tempfile.mkdtemp(prefix='.auto_phylip.',
+                dir=dirname)
+        for (fname, staged) in run['staged']:
+            _stage_file(fname, run['scratch'], staged)
+    except BaseException as err:
+        _stage_fail(run, err)
         raise
+    return True
+
+def _stage_end(run):
+    """
+    Finish the attempt at the run `run` started by `_stage_begin`, once
+    its PHYLIP program has exited cleanly, moving its outputs into place,
+    and storing them in the cache and the journal.
+    """
+    info = run['info']
+    _check_outputs(run['exec'], run['scratch'], run['output'])
+    _collect_outputs(run['scratch'], *run['output'])
+    shutil.rmtree(run['scratch'], ignore_errors=True)
+    run['scratch'] = None
+    # the program, rather than this process, did the I/O
+    info['bytes_read'] = sum(
+            os.path.getsize(fname) for fname in run['input'])
+    info['bytes_written'] = sum(
+            os.path.getsize(fname) for fname in run['dest'])
+    _trace_end(run['frame'])
+    run['frame'] = None
+    run['done'] = True
+    if run['cache']:
+        cache_store(run['cache'], run['key'], run['dest'], run['cache_size'])
+    if run['journal']:
+        journal_record(run['journal'], run['stage'], run['key_journal'],
+                run['dest'])
+
+def _stage_fail(run, err):
+    """
+    Clean up after the attempt at the run `run` started by
+    `_stage_begin`, which failed with `err`.
+
+    Returns
+    -------
+    retry : bool
+        Whether to go on to the next attempt, as `err` is a failure of
+        the PHYLIP program with another left to try, which is reported
+        here; otherwise `err` is for the caller to raise.
+    """
+    if run['scratch'] is not None:
+        shutil.rmtree(run['scratch'], ignore_errors=True)
+        run['scratch'] = None
+    if run['frame'] is not None:
+        _trace_end(run['frame'], err)
+        run['frame'] = None
+    if (not isinstance(err, PhylipError)
+            or run['i_attempt'] + 1 == len(run['attempts'])):
+        return False
+    print('{err} Retrying with {args}'.format(err=err,
+        args=' '.join(run['attempts'][run['i_attempt'] + 1])))
+    return True
+
+def _stage_kwarg(kwarg, pop=True):
+    """
+    Take the keyword arguments that control how PHYLIP programs are run,
+    rather than what they are asked to do, out of `kwarg`.
+
+    These are passed through each stage of a pipeline to `_run_stage`.
+    """
+    lst_key = ['cache', 'cache_size', 'fallback',
+            'timeout', 'max_memory', 'progress', 'journal']
+    if pop:
+        return dict((key, kwarg.pop(key)) for key in lst_key if key in kwarg)
+    return dict((key, kwarg[key]) for key in lst_key if key in kwarg)
+
+def _stage_file(fname, scratch, staged=None):
+    """
+    Make `fname` available inside the directory `scratch`, as `staged` or
+    under its basename, and return the name by which a PHYLIP program
+    running there should refer to it.
+    """
+    if staged is None:
+        staged = os.path.basename(fname)
+    try:
+        os.symlink(os.path.abspath(fname), os.path.join(scratch, staged))
+    except (AttributeError, OSError):
+        # no symlinks available, so fall back on a copy
+        shutil.copyfile(fname, os.path.join(scratch, staged))
+    return staged
+
+def _call_phylip(lst_exec, opts, scratch, trailing_nl=False, timeout=None,
+        max_memory=None, progress=None, stats=None):
+    """
+    Run a PHYLIP program inside the directory `scratch`, feeding it the
+    options `opts` as it would receive them from a command file.
+
+    The program is watched while it runs, and killed, along with anything
+    it has started, if it goes over its time or memory limit.
+
+    Parameters
+    ----------
+    timeout : float, optional
+        The wall clock time in seconds after which to kill the program
+        (default: None, no limit).
+    max_memory : int, optional
+        The resident memory in bytes beyond which to kill the program
+        (default: None, no limit).
+        This is only checked where /proc is available.
+    progress : callable, optional
+        Called as `progress(lst_exec, n)` each time the program reports
+        that it has finished its `n`th dataset or replicate.
+    stats : dict, optional
+        If given, the peak resident memory of the program seen while it
+        ran is stored under 'peak_rss'.
+
+    Returns
+    -------
+    (out, err) : tuple of str
+        The standard output and standard error of the PHYLIP program.
+
+    Raises
+    ------
+    PhylipLimitError
+        If the program was killed for going over a limit.
+    PhylipError
+        If the program exited with a non-zero status.
+    """
+    cmd = _cmd_input(opts, scratch, trailing_nl=trailing_nl)
+    kwarg_popen = dict()
+    if os.name == 'posix':
+        # give the program its own process group, so that it can be
+        # killed along with any children, e.g. under the 'phylip' wrapper
+        if sys.version_info[0] >= 3:
+            kwarg_popen['start_new_session'] = True
+        else:
+            kwarg_popen['preexec_fn'] = os.setsid
+    # open phylip process
+    p = sub.Popen(lst_exec, stdin=sub.PIPE, stdout=sub.PIPE,
+            stderr=sub.PIPE, cwd=scratch, **kwarg_popen)
+    # The output is read by threads as it comes, so that the program can
+    # never block on a full pipe while it is being watched.
+    lst_out = list()
+    lst_err = list()
+    lst_thread = [
+            threading.Thread(target=_read_output,
+                args=(p.stdout, lst_out, lst_exec, progress)),
+            threading.Thread(target=_read_output,
+                args=(p.stderr, lst_err)),
+            ]
+    for thread in lst_thread:
+        thread.daemon = True
+        thread.start()
+    # send command file contents as input
+    try:
+        p.stdin.write(cmd.encode('ascii'))
+        p.stdin.close()
+    except (IOError, OSError):
+        # the program exited without reading all of its input
+        pass
+    exceeded = None
+    time_start = time.time()
+    while p.poll() is None:
+        exceeded = _check_limits(p.pid, time_start, timeout, max_memory,
+                stats)
+        if exceeded is not None:
+            _kill_tree(p)
+            break
+        # the reader of stdout finishes as soon as the program exits, so
+        # waiting on it, rather than sleeping, adds no delay to short runs
+        lst_thread[0].join(poll_interval)
+    p.wait()
+    for thread in lst_thread:
+        thread.join()
+    if exceeded is not None:
+        raise PhylipLimitError(lst_exec, *exceeded)
+    if p.returncode != 0:
+        # whatever it left behind is not to be trusted
+        raise PhylipError(lst_exec, p.returncode, ''.join(lst_err))
+    return (''.join(lst_out), ''.join(lst_err))
+
+def _cmd_input(opts, scratch, trailing_nl=False):
+    """
+    Get the text to feed a PHYLIP program running in the directory
+    `scratch` for the options `opts`, as it would read it from a command
+    file.
+    """
+    cmdfname = write_cmdfile(opts, trailing_nl=trailing_nl,
+            cmdfname=os.path.join(scratch, '.cmdfile'))
+    with open(cmdfname, 'r') as f:
+        cmd = f.read()
+    _clear_files(cmdfname)
+    return cmd
+
+def _check_limits(pid, time_start, timeout, max_memory, stats=None):
+    """
+    Check a PHYLIP program, running as the process `pid` since
+    `time_start`, against its limits, as for `_call_phylip`, and note its
+    peak resident memory in `stats`, if given.
+
+    Returns
+    -------
+    exceeded : tuple or None
+        The limit gone over, 'time' or 'memory', and its value, if any.
+    """
+    if stats is not None:
+        stats['peak_rss'] = max(stats.get('peak_rss', 0),
+                _tree_rss(pid, 'VmHWM'))
+    if timeout is not None and time.time() - time_start > timeout:
+        return ('time', timeout)
+    if max_memory is not None and _tree_rss(pid) > max_memory:
+        return ('memory', max_memory)
+    return None
+
+def _read_output(f, lst_text, lst_exec=None, progress=None):
+    """
+    Read the pipe `f` to its end, appending the text to `lst_text`, and
+    pass any progress reported along the way on to `progress`.
+    """
+    n_done = 0
+    tail = ''
+    while True:
+        chunk = os.read(f.fileno(), 1 << 16)
+        if not chunk:
+            break
+        if not isinstance(chunk, str):
+            chunk = chunk.decode('latin-1')
+        lst_text.append(chunk)
+        if progress is None:
+            continue
+        (tail, n_done) = _scan_progress(tail + chunk, n_done, lst_exec,
+                progress)
+    f.close()
+
+def _scan_progress(text, n_done, lst_exec, progress):
+    """
+    Pass on to `progress` the datasets or replicates reported finished in
+    `text`, the latest output of a PHYLIP program, past the `n_done`
+    passed on already.
+
+    Returns
+    -------
+    (tail, n_done) : tuple
+        The last partial line of `text`, which may hold half of a report,
+        to go in front of the next output, and the number passed on.
+    """
+    lines = text.replace('\r', '\n')
+    (lines, sep, tail) = lines.rpartition('\n')
+    for match in _reg_progress.finditer(lines):
+        n = int(match.group(1))
+        if n > n_done:
+            n_done = n
+            progress(lst_exec, n)
+    return (tail, n_done)
+
+def _kill_tree(p):
+    """
+    Kill the process `p`, and its process group if it leads one.
+    """
     try:
-        os.remove(cmdfname)
-    except:
-        raise
-    if bootstrap:
-        # run consense only if bootstrapping was performed
-        constreename = run_consense(basename + '.tree', **kwarg)
-        print('Consensus tree is: {name}'.format(name=constreename))
-        print('Using original phy file: {name}'.format(name=phy_in_orig))
-        cleanconstreename = cleanup_consense(constreename, phy_in_orig)
-        print('Cleaned consense tree is: {:s}'.format(cleanconstreename))
-        return cleanconstreename
-    else:
-        return treename
+        if os.name == 'posix':
+            os.killpg(p.pid, signal.SIGKILL)
+        else:
+            p.kill()
+    except OSError:
+        # it has already exited
+        pass
 
-def run_seqboot(fname, n_bootstrap, **kwarg):
+def _tree_rss(pid, field='VmRSS'):
     """
-    Run seqboot on a given file for a given number of bootstraps.
+    Get the total resident memory, in bytes, of the process `pid` and of
+    all of its descendants, from /proc.
+    With `field` 'VmHWM', get the total of their peaks instead.
+
+    Processes which have gone, or no /proc at all, count as 0.
+    """
+    rss = 0
+    lst_pid = [pid]
+    while lst_pid:
+        pid = lst_pid.pop()
+        procdir = '/proc/{:d}'.format(pid)
+        try:
+            with open(os.path.join(procdir, 'status'), 'r') as f:
+                for line in f:
+                    if line.startswith(field + ':'):
+                        rss += int(line.split()[1]) * 1024
+            for tid in os.listdir(os.path.join(procdir, 'task')):
+                with open(os.path.join(procdir, 'task', tid, 'children'),
+                        'r') as f:
+                    lst_pid.extend(int(child) for child in f.read().split())
+        except (IOError, OSError, ValueError):
+            pass
+    return rss
+
+def _check_outputs(lst_exec, scratch, lst_output):
+    """
+    Check the output files of a PHYLIP program which exited cleanly in
+    `scratch`, so that output which cannot be right is neither used nor
+    cached.
+
+    Raises
+    ------
+    PhylipError
+        If the program left an empty 'outtree'.
+    """
+    for (fname, dest) in lst_output:
+        fname_out = os.path.join(scratch, fname)
+        if (fname == 'outtree' and os.path.exists(fname_out)
+                and os.path.getsize(fname_out) == 0):
+            raise PhylipError(lst_exec, 0,
+                    reason='wrote an empty tree file.')
+
+def _collect_outputs(scratch, *lst_rename):
+    """
+    Move PHYLIP output files out of `scratch` to their final names.
+
+    Parameters
+    ----------
+    scratch : str
+        The directory in which the PHYLIP program was run.
+    lst_rename : 2-tuple of str
+        Each is a pair of the name of the file written by PHYLIP (e.g.
+        'outfile' or 'outtree') and the name to which to move it.
     """
-    boot_exec = kwarg.pop('boot_exec', boot_exec_default)
-    seqboot_opts = _get_seqboot_opts(fname, n_bootstrap, **kwarg)
-    # remove old files
-    _clear_files('outfile')
-    # write a command file with the specified options
-    cmdfname = write_cmdfile(seqboot_opts)
-    # open phylip process
-    # p = sub.Popen(boot_exec, stdin=sub.PIPE)
-    p = sub.Popen(boot_exec, stdin=sub.PIPE, stdout=sub.PIPE,
-            stderr=sub.PIPE)
-    # send command file contents as input, wait for output
-    # p.communicate(open(cmdfname, 'r').read())
-    (out, err) = p.communicate(open(cmdfname, 'r').read())
-    basename = fname.rpartition('.')[0]
-    bootname = basename + '.boot.phy'
     try:
-        os.rename('outfile', bootname)
+        for (fname, dest) in lst_rename:
+            os.rename(os.path.join(scratch, fname), dest)
     except:
         print('The expected output was not generated. Phylip may have failed')
         raise
+
+def _cache_key(lst_exec, opts, lst_input):
+    """
+    Compute the cache key of a PHYLIP run, from the program, its options,
+    and the contents of its input files.
+
+    Input filenames in `opts` are replaced by their position in
+    `lst_input`, so the same data under another name gets the same key.
+    """
+    import hashlib
+    import json
+    dict_input = dict((os.path.basename(fname), iI)
+            for (iI, fname) in enumerate(lst_input))
+    lst_opt = [('<input {:d}>'.format(dict_input[opt])
+            if opt in dict_input else opt) for opt in opts]
+    h = hashlib.sha256()
+    h.update(json.dumps([cache_version, list(lst_exec), lst_opt]).encode(
+        'utf-8'))
+    for fname in lst_input:
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        # mark the end of each input, so contents cannot run together
+        h.update(b'\0')
+    return h.hexdigest()
+
+def _cache_entry(cache, key):
+    """
+    Get the directory in which the outputs for `key` are kept.
+    """
+    return os.path.join(cache, key[:2], key)
+
+def cache_fetch(cache, key, lst_dest):
+    """
+    Copy the cached outputs for `key`, if any, to the files `lst_dest`.
+
+    Returns
+    -------
+    bool
+        Whether the outputs were found in the cache.
+    """
+    entry = _cache_entry(cache, key)
+    if not os.path.isdir(entry):
+        return False
     try:
-        os.remove(cmdfname)
-    except:
-        raise
-    return bootname
+        for (iI, dest) in enumerate(lst_dest):
+            shutil.copyfile(os.path.join(entry, str(iI)), dest)
+        # mark the entry as recently used
+        os.utime(entry, None)
+    except (IOError, OSError):
+        # evicted from under us, or incomplete
+        return False
+    return True
 
-def run_consense(fname, **kwarg):
+def cache_store(cache, key, lst_src, cache_size=None):
     """
-    Run consense on a given set of bootstrapped trees to form a consensus tree.
+    Add copies of the files `lst_src` to the cache as the outputs for
+    `key`, then trim the cache to `cache_size` bytes by evicting the
+    least recently used entries.
+
+    The whole cache is only scanned for its size when the running total
+    of `_cache_grown` calls for it, not on every store.
     """
-    consense_opts = _get_consense_opts(fname, **kwarg)
-    # remove old files
-    _clear_files('intree', 'outfile', 'outtree')
-    # write a command file with the specified options
-    cmdfname = write_cmdfile(consense_opts)
-    # open phylip process
-    # p = sub.Popen(cons_exec, stdin=sub.PIPE)
-    p = sub.Popen(cons_exec, stdin=sub.PIPE, stdout=sub.PIPE,
-            stderr=sub.PIPE)
-    # send command file contents as input, wait for output
-    # p.communicate(open(cmdfname, 'r').read())
-    (out, err) = p.communicate(open(cmdfname, 'r').read())
-    basename = fname.rpartition('.')[0]
-    outname = basename + '.cons.out'
-    treename = basename + '.cons.tree'
+    if cache_size is None:
+        cache_size = cache_size_default
+    entry = _cache_entry(cache, key)
+    if not os.path.isdir(os.path.dirname(entry)):
+        try:
+            os.makedirs(os.path.dirname(entry))
+        except OSError:
+            # made by a concurrent job
+            pass
+    # fill a temporary directory first, so the entry appears whole
+    tmp = tempfile.mkdtemp(prefix='.tmp.', dir=os.path.dirname(entry))
+    size = 0
     try:
-        os.rename('outfile', outname)
-        os.rename('outtree', treename)
-    except:
-        print('The expected output was not generated. Phylip may have failed')
-        raise
-    _clear_files(cmdfname)
-    # try:
-    #     os.remove(cmdfname)
-    # except:
-    #     raise
-    return treename
+        for (iI, src) in enumerate(lst_src):
+            shutil.copyfile(src, os.path.join(tmp, str(iI)))
+            size += os.path.getsize(src)
+        os.rename(tmp, entry)
+    except OSError:
+        # already stored by a concurrent job
+        size = 0
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    if _cache_grown(cache, size, cache_size):
+        _cache_evict(cache, cache_size)
+    return entry
 
-def cleanup_consense(fname_consensus, phy_orig, **kwarg):
+def _cache_grown(cache, size, cache_size):
     """
-    Use a consensus tree, and an original (non-bootstrapped) *.phy input
-    file to generate a cleaned up consensus tree that estimates the true
-    tree.
+    Add `size` bytes, just stored to the cache, to its running total,
+    and tell whether the cache needs a scan by `_cache_evict`: it may have
+    grown past `cache_size` bytes, it has not been scanned yet, or it is
+    due a scan every `cache_scan_interval` stores.
     """
-    # if phy_exec is provided, or None, use default
-    phy_exec = kwarg.pop('phy_exec', None)
-    if phy_exec == None:
-        phy_exec = phy_exec_default
-    basename = phy_orig.rpartition('.')[0]
-    # remove old files
-    _clear_files('infile', 'intree', 'outfile', 'outtree')
-    # setup options for consensus cleanup
-    lst_phy_opts = _get_phy_opts(phy_orig,
-            fname_tree=fname_consensus,
-            search=False,
-            )
-    cmdfname = write_cmdfile(lst_phy_opts, trailing_nl=False)
-    # open phylip process
-    # p = sub.Popen(phy_exec, stdin=sub.PIPE)
-    p = sub.Popen(phy_exec, stdin=sub.PIPE, stdout=sub.PIPE,
-            stderr=sub.PIPE)
-    # send command file contents as input, wait for output
-    # p.communicate(open(cmdfname, 'r').read())
-    (out, err) = p.communicate(open(cmdfname, 'r').read())
-    # rename output files
-    outname = basename + '.out'
-    treename = basename + '.tree'
+    key = os.path.abspath(cache)
+    with _cache_lock:
+        usage = _cache_usage.get(key)
+        if usage is None:
+            return True
+        usage[0] += size
+        usage[1] += 1
+        return usage[0] > cache_size or usage[1] >= cache_scan_interval
+
+def _cache_evict(cache, cache_size):
+    """
+    Remove the least recently used entries of the cache until it takes
+    up no more than `cache_size` bytes.
+    """
+    lst_entry = list()
+    total = 0
+    for prefix in os.listdir(cache):
+        dirname = os.path.join(cache, prefix)
+        if not os.path.isdir(dirname):
+            continue
+        for key in os.listdir(dirname):
+            if key.startswith('.'):
+                continue
+            entry = os.path.join(dirname, key)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, fname))
+                        for fname in os.listdir(entry))
+                lst_entry.append((os.path.getmtime(entry), size, entry))
+            except OSError:
+                continue
+            total += size
+    lst_entry.sort()
+    for (mtime, size, entry) in lst_entry:
+        if total <= cache_size:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+    with _cache_lock:
+        _cache_usage[os.path.abspath(cache)] = [total, 0]
+    return total
+
+def purge_cache(cache):
+    """
+    Remove every entry of the cache.
+    """
+    if os.path.isdir(cache):
+        shutil.rmtree(cache)
+    with _cache_lock:
+        _cache_usage.pop(os.path.abspath(cache), None)
+    return None
+
+def journal_done(journal, key, lst_dest):
+    """
+    Check the journal file `journal` for a record that the stage keyed
+    by `key` has finished, writing the files `lst_dest`, and that those
+    are still in place, unchanged since.
+
+    Returns
+    -------
+    bool
+        Whether the stage can be skipped.
+    """
+    dict_hash = _journal_hashes(journal, key, lst_dest)
+    if dict_hash is None:
+        return False
+    for (dest, digest) in dict_hash.items():
+        if not os.path.exists(dest) or _file_hash(dest) != digest:
+            return False
+    return True
+
+def journal_record(journal, stage, key, lst_dest):
+    """
+    Record in the journal file `journal` that the stage `stage`, keyed
+    by `key`, has finished, with the hashes of the files `lst_dest` it
+    wrote, unless the last record of it holds the same hashes.
+    """
+    import json
+    dict_hash = dict((dest, _file_hash(dest)) for dest in lst_dest)
+    if _journal_hashes(journal, key, lst_dest) == dict_hash:
+        return None
+    record = dict(stage=stage, key=key, time=round(time.time(), 3),
+            outputs=dict_hash)
+    _append_line(journal, json.dumps(record, sort_keys=True) + '\n')
+
+def _journal_hashes(journal, key, lst_dest):
+    """
+    Get the hashes of the files `lst_dest` from the last record in the
+    journal file `journal` of the stage keyed by `key`, or None if there
+    is none.
+    """
+    import json
+    if not journal or not os.path.exists(journal):
+        return None
+    dict_hash = None
+    with open(journal, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a line cut short when the run was stopped
+                continue
+            if (record.get('key') == key
+                    and sorted(record['outputs']) == sorted(lst_dest)):
+                dict_hash = record['outputs']
+    return dict_hash
+
+def _journal_opts(kwarg):
+    """
+    Get the options in `kwarg` which change what a stage made of several
+    PHYLIP runs does, rather than how they are run, as strings to key it
+    by in a journal.
+    """
+    set_stage = set(_stage_kwarg(kwarg, pop=False))
+    return ['{:s}={!r}'.format(key, kwarg[key]) for key in sorted(kwarg)
+            if key not in set_stage]
+
+def _file_hash(fname):
+    """
+    Get the SHA-256 hex digest of the contents of `fname`.
+    """
+    import hashlib
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _archive_connect(archive):
+    """
+    Open the output archive `archive`, creating its table if need be.
+    """
+    import sqlite3
+    db = sqlite3.connect(archive, timeout=60, isolation_level=None)
+    db.execute("""CREATE TABLE IF NOT EXISTS output (
+            clone TEXT, name TEXT, kind TEXT, size INTEGER, time REAL,
+            data BLOB, PRIMARY KEY (clone, name))""")
+    db.execute('CREATE INDEX IF NOT EXISTS output_kind ON output (kind)')
+    return db
+
+def archive_store(archive, clone, lst_fname, replace=False):
+    """
+    Store the files `lst_fname` in the output archive `archive`, a SQLite
+    database created if need be, each compressed with zlib, under the
+    clone ID `clone`.
+
+    Each file is stored by its base name, and by its kind: the rest of
+    the name after `clone` and a dot, e.g. 'tree', 'boot.phy' or
+    'cons.out', or else the whole name.
+    The files of a clone are stored all at once, so that an archive is
+    never left with only part of a run, and any number of processes may
+    store to the same archive.
+
+    Parameters
+    ----------
+    replace : bool, optional
+        Replace the files of `clone` stored before, if any, rather than
+        raising a ValueError, since two runs on files of the same name
+        in different directories get the same clone ID
+        (default: False).
+
+    Returns
+    -------
+    n_byte : int
+        The size of the files stored, before compression.
+    """
+    import sqlite3
+    import zlib
+    lst_row = list()
+    for fname in lst_fname:
+        name = os.path.basename(fname)
+        if name.startswith(clone + '.'):
+            kind = name[len(clone) + 1:]
+        else:
+            kind = name
+        # compressed a chunk at a time, so only the compressed file is
+        # held in memory whole
+        compressor = zlib.compressobj(6)
+        lst_chunk = list()
+        size = 0
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                size += len(chunk)
+                lst_chunk.append(compressor.compress(chunk))
+        lst_chunk.append(compressor.flush())
+        lst_row.append((clone, name, kind, size, os.path.getmtime(fname),
+            sqlite3.Binary(b''.join(lst_chunk))))
+    db = _archive_connect(archive)
     try:
-        os.rename('outfile', outname)
-        # At this point, the output tree still has a leading and meaningless
-        # first line, which will cause problems down the line.
-        # So, we have to strip out that first line.
-        _strip_first_lines('outtree', fname_out=treename)
-        # os.rename('outtree', treename)
-    except:
-        print('The expected output was not generated. Phylip may have failed')
-        raise
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if db.execute('SELECT 1 FROM output WHERE clone = ? LIMIT 1',
+                    (clone,)).fetchone() is not None:
+                if not replace:
+                    raise ValueError('{archive:s} already holds clone '
+                            '{clone:s}.'.format(archive=archive, clone=clone))
+                db.execute('DELETE FROM output WHERE clone = ?', (clone,))
+            db.executemany('INSERT INTO output VALUES (?, ?, ?, ?, ?, ?)',
+                    lst_row)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+    finally:
+        db.close()
+    return sum(row[3] for row in lst_row)
+
+def _archive_clones(archive, lst_clone=None):
+    """
+    Get the set of clone IDs held in the output archive `archive`, of
+    those in `lst_clone` if given, or an empty set if there is no such
+    archive yet.
+    """
+    if not os.path.exists(archive):
+        return set()
+    db = _archive_connect(archive)
     try:
-        os.remove(cmdfname)
-    except:
-        raise
-    print('Edge length corrected consensus tree is: {:s}'.format(
-        treename))
-    return treename
+        if lst_clone is None:
+            cursor = db.execute('SELECT DISTINCT clone FROM output')
+        else:
+            cursor = db.execute('SELECT DISTINCT clone FROM output WHERE '
+                    'clone IN ({:s})'.format(', '.join('?' * len(lst_clone))),
+                    list(lst_clone))
+        return set(row[0] for row in cursor)
+    finally:
+        db.close()
 
-def write_cmdfile(opts, trailing_nl=False):
+def archive_list(archive, lst_clone=None, kind=None):
     """
-    Writes a command file for use with PHYLIP programs based on the supplied
-    list of options.
+    List the files in the output archive `archive`, of the clones
+    `lst_clone` and the kind `kind` if given, e.g. 'tree'.
+
+    Returns
+    -------
+    lst_entry : list of 3-tuple
+        The clone ID, file name and uncompressed size of each file,
+        ordered by clone and name.
+    """
+    return [(clone, name, size) for (clone, name, size, data)
+            in _archive_select(archive, lst_clone, kind, data=False)]
+
+def iter_archive(archive, lst_clone=None, kind='tree'):
+    """
+    Iterate over the files in the output archive `archive`, of the clones
+    `lst_clone` and the kind `kind` if given, reading one at a time.
 
     Parameters
     ----------
-    opts : list
-        A list of strings to write to the commandfile separated by newlines.
-    trailing_nl : bool
-        Whether or not to add a trailing newline character at the end of the
-        file (default: False).
+    archive : str
+        Filename of the archive.
+    lst_clone : list of str, optional
+        The clone IDs to read the files of (default: None, all).
+    kind : str, optional
+        The kind of file to read, e.g. 'tree', 'cons.tree' or 'out', or
+        None for all (default: 'tree', the final tree of each clone).
 
-    Notes
-    -----
-    The last option in `opts` will be written without a trailing newline
-    unless otherwise specified.
-    This is appropriate behavior for _most_ PHYLIP programs.
+    Yields
+    ------
+    (clone, name, data) : tuple
+        The clone ID, the file name, and the contents of the file, as
+        bytes.
     """
-    cmdfname = '.cmdfile'
-    with open(cmdfname, 'w') as f:
-        for arg in opts[:-1]:
-            f.write(arg + '\n')
-        f.write(opts[-1])
-    return cmdfname
+    import zlib
+    for (clone, name, size, data) in _archive_select(archive, lst_clone,
+            kind):
+        yield (clone, name, zlib.decompress(data))
+
+def archive_read(archive, clone, kind='tree'):
+    """
+    Read the file of kind `kind` of the clone `clone` from the output
+    archive `archive`, as bytes.
+    """
+    for (clone, name, data) in iter_archive(archive, [clone], kind):
+        return data
+    raise ValueError('{archive:s} holds no {kind:s} of {clone:s}.'.format(
+        archive=archive, kind=kind, clone=clone))
+
+def archive_extract(archive, dirname='.', lst_clone=None, kind=None):
+    """
+    Write the files in the output archive `archive`, of the clones
+    `lst_clone` and the kind `kind` if given, into the directory
+    `dirname`, under the names they had when run.
+
+    Returns
+    -------
+    lst_fname : list of str
+        The files written.
+    """
+    lst_fname = list()
+    for (clone, name, data) in iter_archive(archive, lst_clone, kind):
+        fname = os.path.join(dirname, name)
+        with open(fname, 'wb') as f:
+            f.write(data)
+        lst_fname.append(fname)
+    return lst_fname
+
+def _archive_select(archive, lst_clone=None, kind=None, data=True):
+    """
+    Iterate over the rows of clone, name, size and compressed data, or
+    None if not `data`, of the files in an output archive, as for
+    `archive_list`.
+    """
+    if not os.path.exists(archive):
+        raise ValueError('No archive {:s}'.format(archive))
+    lst_cond = list()
+    params = list()
+    if kind is not None:
+        lst_cond.append('kind = ?')
+        params.append(kind)
+    query = 'SELECT clone, name, size, {:s} FROM output'.format(
+            'data' if data else 'NULL')
+    db = _archive_connect(archive)
+    try:
+        if lst_clone is None:
+            lst_query = [(lst_cond, params)]
+        else:
+            # in the order asked for, each looked up by the primary key
+            lst_query = [(lst_cond + ['clone = ?'], params + [clone])
+                    for clone in lst_clone]
+        for (lst_cond_query, params_query) in lst_query:
+            str_query = query
+            if lst_cond_query:
+                str_query += ' WHERE ' + ' AND '.join(lst_cond_query)
+            for row in db.execute(str_query + ' ORDER BY clone, name',
+                    params_query):
+                yield row
+    finally:
+        db.close()
 
 def _get_phy_opts(fname, **kwarg):
     """
@@ -429,8 +4361,17 @@ def _get_phy_opts(fname, **kwarg):
     bootstrap = kwarg.pop('bootstrap', False)
     # if bootstrap:
     #     seed = True
+    # randomize the input order even for a single jumble, e.g. for one of
+    # several runs each with its own seed
+    randomize = kwarg.pop('randomize', False)
+    # the input is read as interleaved unless told otherwise
+    interleaved = kwarg.pop('interleaved', False)
     search = kwarg.pop('search', True)
     fname_tree = kwarg.pop('fname_tree', None)
+    # read the character weights from the file 'weights'; with
+    # bootstrap, there is one set of weights for each replicate, on a
+    # single dataset
+    weights = kwarg.pop('weights', False)
     opts = list()
     # first the filename
     opts.append(fname)
@@ -444,14 +4385,25 @@ def _get_phy_opts(fname, **kwarg):
     #-----------------
     # bootstrapped datasets will always be interleaved (AFAIK)
     if not bootstrap:
-        # specify sequential rather than interleaved data
-        opts.append('I')
+        if weights:
+            opts.append('W')
+        if not interleaved:
+            # specify sequential rather than interleaved data
+            opts.append('I')
+        if search and (jumble > 1 or randomize):
+            # jumble the input order, which prompts for the seed and the
+            # number of jumbles
+            opts.append('J')
+            opts.append(str(seed))
+            opts.append(str(jumble))
     if bootstrap:
         # specify multiple datasets
         opts.append('M')
-        # specify that the data is multiple, not the weights (right now I
-        # don't even use weights)
-        opts.append('D')
+        # specify whether the data or the weights are multiple
+        if weights:
+            opts.append('W')
+        else:
+            opts.append('D')
         # specify the number of datasets, the same as the number of
         # bootstraps
         opts.append(str(bootstrap))
@@ -483,14 +4435,39 @@ def _get_seqboot_opts(fname, n_bootstrap, weights=False, seed=9, **kwarg):
     lst_seqboot_opts.append(fname)
     lst_seqboot_opts.append('R')
     lst_seqboot_opts.append(str(n_bootstrap))
-    # the following to be properly implemented later
     if weights:
+        # read the character weights from the file 'weights'
         lst_seqboot_opts.append('W')
     # finish putting in options, and confirm
     lst_seqboot_opts.append('Y')
     lst_seqboot_opts.append(str(seed))
     return lst_seqboot_opts
 
+def _get_neighbor_opts(fname, bootstrap=None, seed=9, upgma=False,
+        lower=False):
+    """
+    Based on the filename, and optional arguments, get a list of options
+    which can be written on lines of a command file to be fed into
+    PHYLIP neighbor.
+    """
+    opts = list()
+    opts.append(fname)
+    if lower:
+        # read lower triangular matrices
+        opts.append('L')
+    if upgma:
+        # the 'N' option switches from neighbor joining to UPGMA
+        opts.append('N')
+    if bootstrap:
+        # specify multiple datasets, which prompts for their number and
+        # for the seed with which to randomize the input order
+        opts.append('M')
+        opts.append(str(bootstrap))
+        opts.append(str(seed))
+    # confirm options
+    opts.append('Y')
+    return opts
+
 def _get_consense_opts(fname, **kwarg):
     """
     Based on the filename, and optional arguments,
@@ -498,20 +4475,21 @@ def _get_consense_opts(fname, **kwarg):
     file to be fed into PHYLIP consense.
     """
     cons_type = kwarg.pop('type', 'mre')
+    fraction = kwarg.pop('fraction', 0.5)
     opts = list()
     opts.append(fname)
     # select consensus type
+    # the 'C' option cycles through MRe -> strict -> MR -> Ml
     if cons_type == 'mre':
         pass
     elif cons_type == 'strict':
-        # not implemented
-        pass
+        opts.append('C')
     elif cons_type == 'mr':
-        # not implemented
-        pass
+        opts.extend(['C', 'C'])
     elif cons_type == 'ml':
-        # not implemented
-        pass
+        opts.extend(['C', 'C', 'C'])
+        # consense prompts for the fraction as soon as Ml is selected
+        opts.append(str(fraction))
     else:
         print(cons_type)
         raise ValueError(
@@ -589,21 +4567,280 @@ def _run_phylip_main():
             trees coming out.
             """
             )
-    parser.add_argument('files', nargs='+')
+    parser.add_argument('--parallel-jumble',
+            dest='parallel_jumble',
+            const=0,
+            nargs='?',
+            default=None,
+            type=int,
+            help="""
+            Without bootstrapping, run each of the --jumble jumbles as its
+            own PHYLIP run with its own seed, this many at a time, and
+            keep the best scoring tree[s] found.
+            Without an argument, run as many at a time as there are
+            CPUs.
+            """
+            )
+    parser.add_argument('--native-seqboot',
+            dest='native_seqboot',
+            action='store_true',
+            help="""
+            Resample the sequence columns with NumPy in this process,
+            rather than running phylip seqboot.
+            """
+            )
+    parser.add_argument('--native-consense',
+            dest='native_consense',
+            action='store_true',
+            help="""
+            When bootstrapping, build the consensus tree in this process,
+            rather than running phylip consense.
+            """
+            )
+    parser.add_argument('--native-cleanup',
+            dest='native_cleanup',
+            action='store_true',
+            help="""
+            When bootstrapping, compute the branch lengths of the
+            consensus tree with NumPy in this process, rather than
+            running the phylogeny program on it again, and keep the
+            support of each branch as a node label.
+            """
+            )
+    parser.add_argument('--shards',
+            dest='shards',
+            default=1,
+            type=int,
+            help="""
+            When bootstrapping, split the bootstrap replicates into this
+            many blocks, and infer the trees for each block in parallel,
+            each with its own seed.
+            Use 0 to use as many blocks as there are CPUs.
+            (default is 1, a single PHYLIP run over all replicates)
+            """
+            )
+    parser.add_argument('--jobs',
+            dest='jobs',
+            default=1,
+            type=int,
+            help="""
+            The number of input files to process at the same time, each
+            in its own worker process.
+            Use 0 to run as many as there are CPUs.
+            (default is 1, one file after another)
+            """
+            )
+    parser.add_argument('-u', '--collapse',
+            dest='collapse',
+            action='store_true',
+            help="""
+            Infer trees from the distinct sequences only, written to
+            X.uniq.phy for X.phy, and graft the duplicate sequences back
+            onto the final tree as zero length branches.
+            """
+            )
+    parser.add_argument('--compress-sites',
+            dest='compress',
+            action='store_true',
+            help="""
+            Infer trees from the unique site patterns only, written to
+            X.sites.phy for X.phy, each weighted by the number of columns
+            it stands for, in X.sites.weights.
+            When bootstrapping, resample the site patterns as sets of
+            weights, in this process, rather than running phylip seqboot.
+            """
+            )
+    parser.add_argument('--informative-only',
+            dest='informative',
+            action='store_true',
+            help="""
+            As --compress-sites, but also drop the parsimony
+            uninformative columns.
+            The tree topologies are the same, but without bootstrapping,
+            the branch lengths are those of the informative columns only.
+            """
+            )
+    parser.add_argument('-d', '--distance',
+            dest='distance',
+            const='k2p',
+            nargs='?',
+            default=None,
+            choices=lst_dist_model,
+            help="""
+            Build neighbor joining trees with phylip neighbor, from the
+            pairwise distances between the sequences, computed with
+            NumPy in this process, instead of running --command.
+            The distance is one of p (the fraction of sites that
+            differ), jc (Jukes-Cantor) or k2p (Kimura 2-parameter).
+            This takes seconds where parsimony on thousands of sequences
+            takes hours.
+            (default model is k2p)
+            """
+            )
+    parser.add_argument('--upgma',
+            dest='upgma',
+            action='store_true',
+            help="""
+            With --distance, build UPGMA rather than neighbor joining
+            trees.
+            """
+            )
+    parser.add_argument('--resume',
+            dest='resume',
+            action='store_true',
+            help="""
+            Keep a journal of the finished stages of each file X.phy in
+            X.journal, and skip those already finished, with their
+            outputs unchanged, so that a run which was stopped carries
+            on where it left off when run again the same way.
+            With --shards, finished blocks of bootstrap replicates are
+            kept and skipped too.
+            """
+            )
+    parser.add_argument('--archive',
+            dest='archive',
+            default=None,
+            help="""
+            Run each file X.phy in a temporary directory, and store the
+            files of the run, compressed, in this SQLite archive under
+            the clone ID X, rather than leaving them next to X.phy.
+            A clone ID already in the archive is an error.
+            Read them back with phylip_archive.
+            """
+            )
+    parser.add_argument('--keep-intermediate',
+            dest='keep_intermediate',
+            action='store_true',
+            help="""
+            With --archive, also store the bootstrap replicate
+            alignments, X.boot.phy, which are left out by default.
+            """
+            )
+    parser.add_argument('--time-budget',
+            dest='time_budget',
+            default=None,
+            type=float,
+            help="""
+            The runtime in seconds over which a file is predicted to take
+            too long, in which case it is run with a cheaper program
+            searching by the same criterion, e.g. dnapars rather than
+            dnapenny, if there is one, or else warned about.
+            Files are always run longest first, as predicted from the
+            number of taxa and sites in their headers, and the options.
+            """
+            )
+    parser.add_argument('--cost-model',
+            dest='cost_model',
+            default=None,
+            help="""
+            A JSON file of the model of the runtime of each program, as
+            written by --refit-cost-model, to predict runtimes with.
+            """
+            )
+    parser.add_argument('--cost-log',
+            dest='cost_log',
+            default=None,
+            help="""
+            A file to which to append the predicted and actual runtime
+            of each file, as a line of JSON.
+            """
+            )
+    parser.add_argument('--refit-cost-model',
+            dest='refit_cost_model',
+            action='store_true',
+            help="""
+            After running, refit the model of the runtimes to all those
+            in --cost-log, and save it to --cost-model.
+            """
+            )
+    _add_cache_args(parser)
+    _add_limit_args(parser, fallback=True)
+    parser.add_argument('--purge-cache',
+            dest='purge_cache',
+            action='store_true',
+            help="""
+            Empty the --cache directory before running anything.
+            If no files are given, just empty it.
+            """
+            )
+    parser.add_argument('files', nargs='*')
+    _add_queue_args(parser)
+    _add_trace_args(parser)
     argspace = parser.parse_args()
+    _trace_from_args(argspace)
+    if argspace.refit_cost_model and (argspace.cost_model == None
+            or argspace.cost_log == None):
+        parser.error('--refit-cost-model requires --cost-model and '
+                '--cost-log')
+    if argspace.refit_cost_model and argspace.submit != None:
+        parser.error('--refit-cost-model cannot be used with --submit')
+    if argspace.archive != None and argspace.resume:
+        parser.error('--archive cannot be used with --resume')
+    if argspace.keep_intermediate and argspace.archive == None:
+        parser.error('--keep-intermediate requires --archive')
+    if argspace.archive != None:
+        lst_clone = [os.path.basename(fname).rpartition('.')[0]
+                for fname in argspace.files]
+        set_dup = set(clone for clone in lst_clone
+                if lst_clone.count(clone) > 1)
+        if set_dup:
+            parser.error('--archive needs a distinct clone ID for each '
+                    'file, but got {:s} more than once'.format(
+                        ', '.join(sorted(set_dup))))
+    if argspace.purge_cache:
+        if argspace.cache == None:
+            parser.error('--purge-cache requires --cache')
+        purge_cache(argspace.cache)
+        print('''Purged cache {:s}'''.format(argspace.cache))
+        if not argspace.files:
+            return None
+    elif not argspace.files:
+        parser.error('no input files given')
     if argspace.command == None:
         lst_cmd_arg = None
         print('''Using default command to run PHYLIP''')
     else:
         lst_cmd_arg = argspace.command.split(' ')
-        print('''Using {args} to run PHYLIP'''.format(args=lst_cmd_arg))
-    for fname in argspace.files:
-        run_phylip(fname,
-                phy_exec=lst_cmd_arg,
-                bootstrap=argspace.bootstrap,
-                seed=argspace.seed,
-                jumble=argspace.jumble,
-                )
+        print('''Using {args} to run PHYLIP'''.format(args=lst_cmd_arg))
+    cost_model = None
+    if argspace.cost_model != None and os.path.exists(argspace.cost_model):
+        import json
+        with open(argspace.cost_model, 'r') as f:
+            cost_model = json.load(f)
+    lst_job = plan_jobs(run_phylip, argspace.files,
+            time_budget=argspace.time_budget,
+            cost_model=cost_model,
+            cost_log=argspace.cost_log,
+            phy_exec=lst_cmd_arg,
+            bootstrap=argspace.bootstrap,
+            seed=argspace.seed,
+            jumble=argspace.jumble,
+            parallel_jumble=argspace.parallel_jumble,
+            shards=argspace.shards,
+            native_seqboot=argspace.native_seqboot,
+            native_consense=argspace.native_consense,
+            native_cleanup=argspace.native_cleanup,
+            collapse=argspace.collapse,
+            compress=argspace.compress,
+            informative=argspace.informative,
+            distance=argspace.distance,
+            upgma=argspace.upgma,
+            resume=argspace.resume,
+            archive=argspace.archive,
+            keep_intermediate=argspace.keep_intermediate,
+            **dict(_cache_kwarg(argspace), **_limit_kwarg(argspace))
+            )
+    if argspace.submit != None:
+        submit_jobs(argspace.submit, lst_job, argspace.max_attempts)
+        return None
+    _run_jobs(lst_job, argspace.jobs)
+    if argspace.refit_cost_model:
+        import json
+        cost_model = fit_cost_model(argspace.cost_log, cost_model)
+        with open(argspace.cost_model, 'w') as f:
+            json.dump(cost_model, f, indent=2, sort_keys=True)
+        print('Saved the refit cost model to {:s}'.format(
+            argspace.cost_model))
 
 def _run_seqboot_main():
     """
@@ -643,6 +4880,39 @@ def _run_seqboot_main():
             Random seed to use for seqboot.
             """,
             )
+    parser.add_argument('--native-seqboot',
+            dest='native_seqboot',
+            action='store_true',
+            help="""
+            Resample the sequence columns with NumPy in this process,
+            rather than running phylip seqboot.
+            """
+            )
+    parser.add_argument('-w', '--weights',
+            dest='weights',
+            default=None,
+            help="""
+            A PHYLIP weights file for seqboot to read, e.g. of 0s and 1s
+            to leave characters out of the resampling.
+            """
+            )
+    parser.add_argument('--compress-sites',
+            dest='compress',
+            action='store_true',
+            help="""
+            Resample the unique site patterns of each file X.phy as sets
+            of weights, written to X.boot.weights, on the patterns
+            written to X.boot.phy, in this process.
+            """
+            )
+    parser.add_argument('--informative-only',
+            dest='informative',
+            action='store_true',
+            help="""
+            As --compress-sites, but also drop the parsimony
+            uninformative columns.
+            """
+            )
     parser.add_argument('files', nargs='+',
             help="""
             These are the PHY files from which to bootstrap expanded
@@ -650,11 +4920,25 @@ def _run_seqboot_main():
             They are treated independently.
             """,
             )
+    _add_cache_args(parser)
+    _add_limit_args(parser)
+    _add_queue_args(parser)
+    _add_trace_args(parser)
     argspace = parser.parse_args()
-    for fname in argspace.files:
-        run_seqboot(fname, argspace.bootstrap,
+    _trace_from_args(argspace)
+    lst_job = [(run_seqboot, fname, dict(
+                n_bootstrap=argspace.bootstrap,
                 seed=argspace.seed,
-                )
+                native_seqboot=argspace.native_seqboot,
+                weights=argspace.weights,
+                compress=argspace.compress or argspace.informative,
+                informative=argspace.informative,
+                **dict(_cache_kwarg(argspace), **_limit_kwarg(argspace))
+                )) for fname in argspace.files]
+    if argspace.submit != None:
+        submit_jobs(argspace.submit, lst_job, argspace.max_attempts)
+        return None
+    _run_jobs(lst_job)
     return None
 
 def _run_consense_main():
@@ -674,44 +4958,884 @@ def _run_consense_main():
             The provided files are treated independently.
             """,
             )
+    parser.add_argument('-t', '--type',
+            dest='type',
+            default='mre',
+            choices=['mre', 'strict', 'mr', 'ml'],
+            help="""
+            The consensus type: extended majority rule (mre), strict,
+            majority rule (mr), or M sub l (ml), which keeps the branches
+            found in more than a given fraction of the trees.
+            (default is mre)
+            """,
+            )
+    parser.add_argument('-f', '--fraction',
+            dest='fraction',
+            default=0.5,
+            type=float,
+            help="""
+            For the ml consensus type, the fraction of trees, between 0.5
+            and 1, in which a branch must be found to be kept.
+            (default is 0.5)
+            """,
+            )
+    parser.add_argument('--native-consense',
+            dest='native_consense',
+            action='store_true',
+            help="""
+            Build the consensus tree in this process, rather than running
+            phylip consense.
+            """
+            )
+    _add_cache_args(parser)
+    _add_limit_args(parser)
+    _add_queue_args(parser)
+    _add_trace_args(parser)
     argspace = parser.parse_args()
-    for fname in argspace.files:
-        run_consense(
-                fname,
-                )
+    _trace_from_args(argspace)
+    lst_job = [(run_consense, fname, dict(
+                type=argspace.type,
+                fraction=argspace.fraction,
+                native_consense=argspace.native_consense,
+                **dict(_cache_kwarg(argspace), **_limit_kwarg(argspace))
+                )) for fname in argspace.files]
+    if argspace.submit != None:
+        submit_jobs(argspace.submit, lst_job, argspace.max_attempts)
+        return None
+    _run_jobs(lst_job)
+    return None
+
+def _cleanup_consense_main():
+    """
+    The main runner script for the command `cleanup_consense`, including the
+    argparse parser.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+            description='''Correct the branch lengths on a consensus tree''',
+            )
+    parser.add_argument('-p', '--phyfile',
+            dest='phyfile',
+            help="""
+            This PHY file will be used to determine the length of the
+            sequences in the tree, and that way correct the branch
+            lengths.
+            """,
+            )
+    parser.add_argument('consensus', nargs='+',
+            help="""
+            This is the consensus tree to clean up.
+            Clean up is done in place, so if you want to preserve the
+            original state of the tree prior to cleanup, you should copy
+            it.
+            You can do this to multiple trees at once, as long as they
+            use the same PHY file, i.e. have the same sequence length.
+            """,
+            )
+    parser.add_argument('--native-cleanup',
+            dest='native_cleanup',
+            action='store_true',
+            help="""
+            Compute the branch lengths of the consensus tree with NumPy
+            in this process, rather than running the phylogeny program
+            on it again, and keep the support of each branch as a node
+            label.
+            """
+            )
+    _add_cache_args(parser)
+    _add_limit_args(parser, fallback=True)
+    _add_trace_args(parser)
+    argspace = parser.parse_args()
+    _trace_from_args(argspace)
+    for fname in argspace.consensus:
+        cleanup_consense(fname, argspace.phyfile,
+                native_cleanup=argspace.native_cleanup,
+                **dict(_cache_kwarg(argspace), **_limit_kwarg(argspace)))
     return None
 
-def _cleanup_consense_main():
+def _add_cache_args(parser):
+    """
+    Add the arguments for the result cache to an argparse parser.
+    """
+    parser.add_argument('--cache',
+            dest='cache',
+            default=None,
+            help="""
+            A directory in which to cache the output of each PHYLIP run.
+            Runs repeated with the same program, options and input files
+            reuse the cached output instead of running PHYLIP again.
+            """,
+            )
+    parser.add_argument('--cache-size',
+            dest='cache_size',
+            default=cache_size_default // 2**20,
+            type=int,
+            help="""
+            The size of the cache in MiB, beyond which the least recently
+            used outputs are evicted.
+            (default is {default})
+            """.format(default=cache_size_default // 2**20),
+            )
+    return parser
+
+def _cache_kwarg(argspace):
+    """
+    Get the keyword arguments for the result cache from parsed args.
+    """
+    return dict(cache=argspace.cache, cache_size=argspace.cache_size * 2**20)
+
+def _add_trace_args(parser):
+    """
+    Add the arguments for tracing the time and resources used by each
+    stage to an argparse parser.
+    """
+    parser.add_argument('--trace', '--profile',
+            dest='trace',
+            default=None,
+            metavar='FILE',
+            help="""
+            Record the wall time, CPU time, I/O and peak memory of each
+            stage, with the number of taxa, alignment length and
+            bootstrap count where known, to this file.
+            """,
+            )
+    parser.add_argument('--trace-format',
+            dest='trace_format',
+            default='jsonl',
+            choices=['jsonl', 'chrome'],
+            help="""
+            Write the trace as one JSON object per line (jsonl), or as
+            trace events for chrome://tracing or Perfetto (chrome).
+            (default is jsonl)
+            """,
+            )
+    return parser
+
+def _trace_from_args(argspace):
+    """
+    Start tracing, if asked to by parsed args.
+    """
+    if argspace.trace is not None:
+        start_trace(argspace.trace, argspace.trace_format)
+    return argspace.trace
+
+def _add_limit_args(parser, fallback=False):
+    """
+    Add the arguments for supervising PHYLIP programs to an argparse
+    parser, with --fallback only if `fallback` is set.
+    """
+    parser.add_argument('--timeout',
+            dest='timeout',
+            default=None,
+            type=float,
+            help="""
+            The wall clock time in seconds after which to kill a PHYLIP
+            program.
+            (default is no limit)
+            """,
+            )
+    parser.add_argument('--max-memory',
+            dest='max_memory',
+            default=None,
+            type=int,
+            help="""
+            The resident memory in MiB beyond which to kill a PHYLIP
+            program.
+            (default is no limit)
+            """,
+            )
+    if fallback:
+        parser.add_argument('--fallback',
+                dest='fallback',
+                action='append',
+                default=None,
+                help="""
+                A cheaper command to run PHYLIP with, e.g. 'phylip
+                dnapars', if the phylogeny program fails, or is killed
+                for going over --timeout or --max-memory.
+                May be given more than once, to be tried in order.
+                """,
+                )
+    parser.add_argument('--progress',
+            dest='progress',
+            action='store_true',
+            help="""
+            Print a line as each PHYLIP program finishes a dataset or
+            replicate.
+            """,
+            )
+    return parser
+
+def _add_queue_args(parser):
+    """
+    Add the arguments for submitting jobs to a job queue, rather than
+    running them, to an argparse parser.
+    """
+    parser.add_argument('--submit',
+            dest='submit',
+            default=None,
+            metavar='QUEUE',
+            help="""
+            Add a job for each file to the job queue QUEUE, a SQLite
+            database, for phylip_worker processes to run, rather than
+            running them here.
+            """,
+            )
+    parser.add_argument('--max-attempts',
+            dest='max_attempts',
+            default=3,
+            type=int,
+            help="""
+            With --submit, the number of times to try a job that fails
+            before giving up on it.
+            (default is 3)
+            """,
+            )
+    return parser
+
+def _limit_kwarg(argspace):
+    """
+    Get the keyword arguments for supervising PHYLIP programs from parsed
+    args.
+    """
+    kwarg = dict(timeout=argspace.timeout)
+    if argspace.max_memory is not None:
+        kwarg['max_memory'] = argspace.max_memory * 2**20
+    if getattr(argspace, 'fallback', None):
+        kwarg['fallback'] = [cmd.split(' ') for cmd in argspace.fallback]
+    if argspace.progress:
+        kwarg['progress'] = _print_progress
+    return kwarg
+
+def _print_progress(lst_exec, n):
+    """
+    Report the progress of a PHYLIP program, for --progress.
+    """
+    print('{args}: finished {n:d}'.format(args=' '.join(lst_exec), n=n))
+
+def _map_jobs(func, lst_fname, n_jobs=1, **kwarg):
+    """
+    Call `func` on each file in `lst_fname` with the keyword arguments
+    `kwarg`, spreading the calls over a pool of `n_jobs` worker
+    processes.
+
+    Parameters
+    ----------
+    func : callable
+        A module level function taking a filename as its first argument,
+        e.g. `run_phylip`.
+    lst_fname : list of str
+        The files to process.
+    n_jobs : int, optional
+        The number of worker processes to use.
+        If less than 1, use one per CPU.
+        (default: 1, run in this process, one file after another)
+
+    Returns
+    -------
+    list
+        The return values of `func`, in the same order as `lst_fname`.
+    """
+    lst_job = [(func, fname, kwarg) for fname in lst_fname]
+    return _run_jobs(lst_job, n_jobs)
+
+def _cost_features(phy_in, **kwarg):
+    """
+    Get what the runtime of `run_phylip` on `phy_in` with `kwarg` depends
+    on: the program, the number of taxa and the alignment length from
+    the header of `phy_in`, and the number of replicates and jumbles.
+    """
+    if kwarg.get('distance') is not None:
+        program = os.path.basename(nbr_exec_default[-1])
+    else:
+        program = os.path.basename((kwarg.get('phy_exec')
+            or phy_exec_default)[-1])
+    info = dict(_phy_shape(phy_in), program=program,
+            bootstrap=kwarg.get('bootstrap') or 1,
+            jumble=max(1, kwarg.get('jumble') or 1))
+    info.setdefault('taxa', 0)
+    info.setdefault('length', 0)
+    return info
+
+def estimate_cost(phy_in, cost_model=None, **kwarg):
+    """
+    Predict the runtime, in seconds, of `run_phylip` on `phy_in` with the
+    keyword arguments `kwarg`.
+
+    Parameters
+    ----------
+    phy_in : str
+        Filename of the *.phy file, of which only the header is read.
+    cost_model : dict, optional
+        The model for each program, as `dict_cost_model`, which is used
+        for any program not in `cost_model`, and that of dnapars for any
+        program in neither.
+    """
+    info = _cost_features(phy_in, **kwarg)
+    return _predict_cost(info, cost_model)
+
+def _predict_cost(info, cost_model=None):
+    """
+    Predict the runtime from the features `info` from `_cost_features`.
+    """
+    return _cost_model_for(info['program'], cost_model)['coef'] * _cost_units(
+            info, cost_model)
+
+def _cost_model_for(program, cost_model=None):
+    """
+    Get the model of the runtime of `program`.
+    """
+    dict_model = dict(dict_cost_model, **(cost_model or dict()))
+    return dict_model.get(program, dict_model['dnapars'])
+
+def _cost_units(info, cost_model=None):
+    """
+    Get the runtime predicted for the features `info`, as a multiple of
+    the coefficient of the model of its program.
+    """
+    model = _cost_model_for(info['program'], cost_model)
+    return (float(info['taxa']) ** model['taxa_exponent']
+            * float(model['taxa_base']) ** info['taxa']
+            * float(info['length']) ** model['length_exponent']
+            * info['bootstrap'] * info['jumble'])
+
+def plan_jobs(func, lst_fname, time_budget=None, cost_model=None,
+        cost_log=None, **kwarg):
+    """
+    Make the jobs for `_run_jobs` running `func`, e.g. `run_phylip`, on
+    each file in `lst_fname` with `kwarg`, ordered longest first by
+    their predicted runtimes.
+
+    A pool of workers taking jobs in this order packs them greedily,
+    longest first, so one huge job at the end of the list no longer
+    sets the total wall time.
+    dnapenny jobs of more than `penny_max_taxa` taxa are warned about,
+    and any job predicted to take longer than `time_budget` seconds is
+    rerouted to a cheaper program searching by the same criterion, as
+    in `dict_reroute`, if there is one, or else warned about.
+
+    Parameters
+    ----------
+    time_budget : float, optional
+        The runtime in seconds over which to reroute or warn about a job
+        (default: None, no budget).
+    cost_model : dict, optional
+        As for `estimate_cost`.
+    cost_log : str, optional
+        A file to which to append a JSON line with the predicted and the
+        actual runtime of each job, to refit the model with
+        `fit_cost_model` (default: None).
+
+    Returns
+    -------
+    lst_job : list of 3-tuple
+        The jobs, longest first.
+    """
+    lst_plan = list()
+    for fname in lst_fname:
+        kwarg_job = dict(kwarg)
+        info = _cost_features(fname, **kwarg_job)
+        cost = _predict_cost(info, cost_model)
+        program = info['program']
+        if program == 'dnapenny' and info['taxa'] > penny_max_taxa:
+            print('Warning: {fname} has {n:d} taxa, more than dnapenny '
+                    'is practical for.'.format(fname=fname, n=info['taxa']))
+        if time_budget is not None and cost > time_budget:
+            if program in dict_reroute and kwarg_job.get('distance') is None:
+                lst_exec = list(kwarg_job.get('phy_exec')
+                        or phy_exec_default)
+                lst_exec[-1] = lst_exec[-1][:-len(program)] + dict_reroute[
+                        program]
+                kwarg_job['phy_exec'] = lst_exec
+                info = _cost_features(fname, **kwarg_job)
+                cost_new = _predict_cost(info, cost_model)
+                print('Rerouting {fname} from {old} to {new}, as it is '
+                        'predicted to take {cost:.0f} s, over the budget '
+                        'of {budget:.0f} s.'.format(fname=fname, old=program,
+                            new=info['program'], cost=cost,
+                            budget=time_budget))
+                cost = cost_new
+            else:
+                print('Warning: {fname} is predicted to take {cost:.0f} s '
+                        'with {prog}, over the budget of {budget:.0f} '
+                        's.'.format(fname=fname, cost=cost, prog=program,
+                            budget=time_budget))
+        if cost_log is not None:
+            kwarg_job = dict(kwarg_job, func=func, cost_log=cost_log,
+                    cost_info=dict(info, predicted=round(cost, 6)))
+            lst_plan.append((cost, (_run_costed, fname, kwarg_job)))
+        else:
+            lst_plan.append((cost, (func, fname, kwarg_job)))
+    # sort is stable, so equal jobs stay in the order given
+    lst_plan.sort(key=lambda plan: -plan[0])
+    return [job for (cost, job) in lst_plan]
+
+def _run_costed(fname, **kwarg):
+    """
+    Run `func` on `fname` for `plan_jobs`, and log its predicted and
+    actual runtime to `cost_log`.
+    """
+    import json
+    func = kwarg.pop('func')
+    cost_log = kwarg.pop('cost_log')
+    info = dict(kwarg.pop('cost_info'), file=fname)
+    time_start = time.time()
+    try:
+        return func(fname, **kwarg)
+    except Exception as err:
+        info['error'] = '{:s}: {:s}'.format(type(err).__name__, str(err))
+        raise
+    finally:
+        info['actual'] = round(time.time() - time_start, 6)
+        _append_line(cost_log, json.dumps(info, sort_keys=True) + '\n')
+
+def fit_cost_model(cost_log, cost_model=None):
+    """
+    Refit the coefficient of the model of each program to the runtimes
+    logged to `cost_log` by `plan_jobs`, as the median ratio of actual
+    runtime to that predicted with a coefficient of 1, so a few
+    outliers do not throw it off.
+    Jobs which failed are left out.
+
+    Returns
+    -------
+    cost_model : dict
+        The models of all programs, as `dict_cost_model`, with those of
+        the programs in the log refit.
+    """
+    import json
+    import numpy as np
+    dict_model = dict((program, dict(model)) for (program, model)
+            in dict(dict_cost_model, **(cost_model or dict())).items())
+    dict_ratio = dict()
+    with open(cost_log, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            info = json.loads(line)
+            if 'error' in info:
+                continue
+            units = _cost_units(info, dict_model)
+            if units > 0:
+                dict_ratio.setdefault(info['program'], list()).append(
+                        info['actual'] / units)
+    for (program, lst_ratio) in dict_ratio.items():
+        model = dict(_cost_model_for(program, dict_model))
+        model['coef'] = float(np.median(lst_ratio))
+        dict_model[program] = model
+    return dict_model
+
+def _run_jobs(lst_job, n_jobs=1, threads=False):
+    """
+    Run a list of jobs over a pool of `n_jobs` workers.
+
+    Parameters
+    ----------
+    lst_job : list of 3-tuple
+        Each job is a tuple of a module level function, a filename to
+        pass it as its first argument, and a dict of keyword arguments.
+    n_jobs : int, optional
+        The number of workers to use.
+        If less than 1, use one per CPU.
+        (default: 1, run in this process, one job after another)
+    threads : bool, optional
+        Use a pool of threads rather than processes (default: False).
+
+    Returns
+    -------
+    list
+        The return values of the jobs, in the same order as `lst_job`.
+    """
+    import multiprocessing
+    if n_jobs < 1:
+        n_jobs = multiprocessing.cpu_count()
+    n_jobs = min(n_jobs, len(lst_job))
+    if n_jobs <= 1:
+        return [_run_job(job) for job in lst_job]
+    if threads:
+        import multiprocessing.pool
+        pool = multiprocessing.pool.ThreadPool(n_jobs)
+    else:
+        # workers add their events to the same trace
+        pool = multiprocessing.Pool(n_jobs, initializer=start_trace,
+                initargs=(trace_file, trace_format, True))
+    try:
+        # chunksize of 1, since the runtime of each job can vary wildly
+        return pool.map(_run_job, lst_job, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+def _run_job(job):
+    """
+    Unpack and run a single job for `_run_jobs`.
+    """
+    (func, fname, kwarg) = job
+    return func(fname, **kwarg)
+
+def _queue_connect(queue):
+    """
+    Open the job queue `queue`, creating its table if need be.
+
+    Transactions are begun explicitly, so that a worker can take a job
+    with BEGIN IMMEDIATE, holding the write lock from reading the queue
+    until it has marked the job as its own.
+    The default rollback journal is kept, rather than WAL, which needs
+    shared memory and so does not work across hosts.
+    """
+    import sqlite3
+    db = sqlite3.connect(queue, timeout=60, isolation_level=None)
+    db.execute("""CREATE TABLE IF NOT EXISTS job (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            func TEXT, fname TEXT, kwarg TEXT, cwd TEXT,
+            state TEXT, attempts INTEGER, max_attempts INTEGER,
+            worker TEXT, lease_until REAL,
+            submitted REAL, started REAL, finished REAL, wall REAL,
+            output TEXT, error TEXT)""")
+    db.execute('CREATE INDEX IF NOT EXISTS job_state ON job (state, id)')
+    return db
+
+def _queue_encode(value):
+    """
+    Encode the arguments of a job as JSON, with the functions among them
+    by name.
+    """
+    import json
+
+    def default(obj):
+        name = getattr(obj, '__name__', None)
+        if not callable(obj) or name not in lst_queue_func:
+            raise ValueError('{!r} cannot be put in a job queue.'.format(obj))
+        return {'__func__': name}
+
+    return json.dumps(value, default=default, sort_keys=True)
+
+def _queue_decode(text):
+    """
+    Decode the arguments of a job encoded by `_queue_encode`.
+    """
+    import json
+
+    def object_hook(obj):
+        if list(obj) == ['__func__']:
+            if obj['__func__'] not in lst_queue_func:
+                raise ValueError('{:s} may not be run from a job '
+                        'queue.'.format(obj['__func__']))
+            return globals()[obj['__func__']]
+        return obj
+
+    return json.loads(text, object_hook=object_hook)
+
+def submit_jobs(queue, lst_job, max_attempts=3):
+    """
+    Add jobs to the job queue `queue`, for any number of workers running
+    `run_worker`, on this host or others sharing the filesystem, to take
+    and run.
+
+    The queue is a SQLite database, created if need be.
+    Jobs are taken in the order they were submitted, so the longest
+    first order of `plan_jobs` is kept.
+    Each job is run in the directory it was submitted from, so relative
+    filenames in its arguments still hold.
+
+    Parameters
+    ----------
+    queue : str
+        Filename of the queue, on a filesystem with working file locks.
+    lst_job : list of 3-tuple
+        The jobs as for `_run_jobs`, e.g. from `plan_jobs`, each of a
+        function in `lst_queue_func`, a filename, and a dict of keyword
+        arguments, which must be of types JSON can hold, or functions in
+        `lst_queue_func`.
+    max_attempts : int, optional
+        The number of times to run a job which fails, or whose worker
+        stops renewing its lease, before it is marked as failed
+        (default: 3).
+
+    Returns
+    -------
+    lst_id : list of int
+        The IDs of the jobs in the queue.
+    """
+    lst_row = list()
+    for (func, fname, kwarg) in lst_job:
+        if func.__name__ not in lst_queue_func:
+            raise ValueError('{:s} may not be run from a job queue.'.format(
+                func.__name__))
+        lst_row.append((func.__name__, fname, _queue_encode(kwarg)))
+    cwd = os.getcwd()
+    db = _queue_connect(queue)
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        lst_id = list()
+        for (func, fname, kwarg) in lst_row:
+            cur = db.execute("""INSERT INTO job (func, fname, kwarg, cwd,
+                    state, attempts, max_attempts, submitted)
+                    VALUES (?, ?, ?, ?, 'queued', 0, ?, ?)""",
+                    (func, fname, kwarg, cwd, max_attempts, time.time()))
+            lst_id.append(cur.lastrowid)
+        db.execute('COMMIT')
+    finally:
+        db.close()
+    print('Submitted {n:d} jobs to {queue:s}'.format(n=len(lst_id),
+        queue=queue))
+    return lst_id
+
+def claim_job(queue, worker, lease=lease_default):
+    """
+    Take the next job from the job queue `queue` for the worker named
+    `worker`, leasing it for `lease` seconds.
+
+    Jobs whose workers have let their leases run out are first put back
+    in the queue, or marked as failed if they have been tried
+    `max_attempts` times already.
+
+    Returns
+    -------
+    job : dict or None
+        The row of the job, or None if no job is waiting.
+    """
+    db = _queue_connect(queue)
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        now = time.time()
+        db.execute("""UPDATE job SET
+                state = CASE WHEN attempts < max_attempts
+                    THEN 'queued' ELSE 'failed' END,
+                error = 'The lease of ' || worker || ' ran out.',
+                worker = NULL, lease_until = NULL
+                WHERE state = 'running' AND lease_until < ?""", (now,))
+        cur = db.execute("""SELECT * FROM job WHERE state = 'queued'
+                ORDER BY id LIMIT 1""")
+        row = cur.fetchone()
+        if row is None:
+            db.execute('COMMIT')
+            return None
+        job = dict(zip([col[0] for col in cur.description], row))
+        db.execute("""UPDATE job SET state = 'running', worker = ?,
+                lease_until = ?, attempts = attempts + 1, started = ?
+                WHERE id = ?""", (worker, now + lease, now, job['id']))
+        db.execute('COMMIT')
+    finally:
+        db.close()
+    job.update(state='running', worker=worker, lease_until=now + lease,
+            attempts=job['attempts'] + 1, started=now)
+    return job
+
+def renew_lease(queue, job_id, worker, lease=lease_default):
+    """
+    Extend the lease of `worker` on the job `job_id` to `lease` seconds
+    from now.
+
+    Returns
+    -------
+    bool
+        Whether the worker still held the job.
+    """
+    db = _queue_connect(queue)
+    try:
+        cur = db.execute("""UPDATE job SET lease_until = ?
+                WHERE id = ? AND worker = ? AND state = 'running'""",
+                (time.time() + lease, job_id, worker))
+        return cur.rowcount == 1
+    finally:
+        db.close()
+
+def finish_job(queue, job, worker, output=None, error=None):
+    """
+    Record that `worker` has run `job`, from `claim_job`, with its return
+    value `output`, or its `error`, in which case it is put back in the
+    queue unless it has been tried `max_attempts` times.
+
+    Returns
+    -------
+    bool
+        Whether the worker still held the job, to record it.
+    """
+    now = time.time()
+    if error is None:
+        state = 'done'
+    elif job['attempts'] < job['max_attempts']:
+        state = 'queued'
+    else:
+        state = 'failed'
+    db = _queue_connect(queue)
+    try:
+        cur = db.execute("""UPDATE job SET state = ?,
+                lease_until = NULL, finished = ?, wall = ?, output = ?,
+                error = ?
+                WHERE id = ? AND worker = ? AND state = 'running'""",
+                (state, now, round(now - job['started'], 6),
+                    _queue_encode(output), error, job['id'], worker))
+        return cur.rowcount == 1
+    finally:
+        db.close()
+
+def run_worker(queue, worker=None, lease=lease_default, max_jobs=None,
+        wait=False):
+    """
+    Take jobs from the job queue `queue`, one after another, and run
+    them, until there are none left.
+
+    While a job runs, its lease is renewed every third of `lease`
+    seconds, so a job is only given to another worker once this one has
+    died, or lost touch with the queue.
+    A job whose worker is interrupted is put straight back in the queue.
+
+    Parameters
+    ----------
+    queue : str
+        Filename of the queue, see `submit_jobs`.
+    worker : str, optional
+        The name to record for this worker (default: host:pid).
+    lease : float, optional
+        The length of the lease on each job, in seconds
+        (default: `lease_default`).
+    max_jobs : int, optional
+        Stop after running this many jobs (default: None, no limit).
+    wait : bool, optional
+        Once no job is waiting, keep checking the queue while other
+        workers still hold jobs, which may fail and be put back, rather
+        than stopping at once (default: False).
+
+    Returns
+    -------
+    n_run : int
+        The number of jobs run.
+    """
+    import socket
+    # the jobs change directory
+    queue = os.path.abspath(queue)
+    if worker is None:
+        worker = '{host:s}:{pid:d}'.format(host=socket.gethostname(),
+                pid=os.getpid())
+    n_run = 0
+    while max_jobs is None or n_run < max_jobs:
+        job = claim_job(queue, worker, lease)
+        if job is None:
+            if wait and queue_counts(queue).get('running'):
+                time.sleep(min(lease / 3., 5))
+                continue
+            break
+        print('{worker:s}: running job {id:d}, {func:s} on {fname:s}'.format(
+            worker=worker, id=job['id'], func=job['func'],
+            fname=job['fname']))
+        stop = threading.Event()
+
+        def heartbeat(job_id=job['id']):
+            while not stop.wait(lease / 3.):
+                if not renew_lease(queue, job_id, worker, lease):
+                    print('{worker:s}: lost the lease on job {id:d}'.format(
+                        worker=worker, id=job_id))
+                    return
+
+        thread = threading.Thread(target=heartbeat)
+        thread.daemon = True
+        thread.start()
+        cwd = os.getcwd()
+        output = None
+        error = None
+        try:
+            os.chdir(job['cwd'])
+            output = globals()[job['func']](job['fname'],
+                    **_queue_decode(job['kwarg']))
+            if output is not None and os.path.exists(output):
+                # each function returns the name of the file it made, if
+                # not in an archive
+                output = os.path.abspath(output)
+        except Exception as err:
+            error = '{:s}: {:s}'.format(type(err).__name__, str(err))
+            print('{worker:s}: job {id:d} failed, {error:s}'.format(
+                worker=worker, id=job['id'], error=error))
+        except BaseException:
+            # let another worker have the job
+            _release_job(queue, job, worker)
+            raise
+        finally:
+            stop.set()
+            thread.join()
+            os.chdir(cwd)
+        finish_job(queue, job, worker, output, error)
+        n_run += 1
+    return n_run
+
+def _release_job(queue, job, worker):
+    """
+    Put a job held by `worker` back in the queue, not counting the
+    attempt.
+    """
+    db = _queue_connect(queue)
+    try:
+        db.execute("""UPDATE job SET state = 'queued', worker = NULL,
+                lease_until = NULL, attempts = attempts - 1
+                WHERE id = ? AND worker = ? AND state = 'running'""",
+                (job['id'], worker))
+    finally:
+        db.close()
+
+def queue_counts(queue):
+    """
+    Count the jobs in the job queue `queue` in each state: queued,
+    running, done and failed.
+
+    Returns
+    -------
+    dict
+    """
+    db = _queue_connect(queue)
+    try:
+        return dict(db.execute(
+            'SELECT state, COUNT(*) FROM job GROUP BY state'))
+    finally:
+        db.close()
+
+def queue_jobs(queue, state=None):
     """
-    The main runner script for the command `cleanup_consense`, including the
-    argparse parser.
+    Get the jobs in the job queue `queue`, or only those in the state
+    `state`, with their status, timings and outputs.
+
+    Returns
+    -------
+    lst_job : list of dict
+        The rows of the jobs, in the order submitted, with `kwarg` and
+        `output` decoded.
     """
-    import argparse
-    parser = argparse.ArgumentParser(
-            description='''Correct the branch lengths on a consensus tree''',
-            )
-    parser.add_argument('-p', '--phyfile',
-            dest='phyfile',
-            help="""
-            This PHY file will be used to determine the length of the
-            sequences in the tree, and that way correct the branch
-            lengths.
-            """,
-            )
-    parser.add_argument('consensus', nargs='+',
-            help="""
-            This is the consensus tree to clean up.
-            Clean up is done in place, so if you want to preserve the
-            original state of the tree prior to cleanup, you should copy
-            it.
-            You can do this to multiple trees at once, as long as they
-            use the same PHY file, i.e. have the same sequence length.
-            """,
-            )
-    argspace = parser.parse_args()
-    for fname in argspace.consensus:
-        cleanup_consense(fname, argspace.phyfile,)
-    return None
+    import json
+    db = _queue_connect(queue)
+    try:
+        if state is None:
+            cur = db.execute('SELECT * FROM job ORDER BY id')
+        else:
+            cur = db.execute('SELECT * FROM job WHERE state = ? ORDER BY id',
+                    (state,))
+        lst_col = [col[0] for col in cur.description]
+        lst_job = [dict(zip(lst_col, row)) for row in cur]
+    finally:
+        db.close()
+    for job in lst_job:
+        # as stored, since the functions need not be looked up to show
+        job['kwarg'] = json.loads(job['kwarg'])
+        if job['output'] is not None:
+            job['output'] = json.loads(job['output'])
+    return lst_job
+
+def requeue_failed(queue):
+    """
+    Put the failed jobs in the job queue `queue` back in it, to be tried
+    `max_attempts` times again.
+
+    Returns
+    -------
+    n_job : int
+        The number of jobs put back.
+    """
+    db = _queue_connect(queue)
+    try:
+        cur = db.execute("""UPDATE job SET state = 'queued', attempts = 0
+                WHERE state = 'failed'""")
+        return cur.rowcount
+    finally:
+        db.close()
 
 def _clear_files(*lstfname):
     """
@@ -746,13 +5870,374 @@ def _strip_first_lines(fname_in, **kwarg):
     # By default, remove only the first line.
     n_lines = kwarg.pop('n_lines', 1)
     if fname_in != fname_out:
-        with open(fname_out, 'wb') as f_out, open(fname_in, 'rU') as f_in:
+        with open(fname_out, 'w') as f_out, open(fname_in, 'r') as f_in:
             # Get rid of those useless first lines
             for iI in range(n_lines):
                f_in.readline()
             f_out.writelines(f_in)
     return fname_out
 
+class TreeNode(object):
+    """
+    A node of a phylogenetic tree, as read from or written to a Newick
+    tree file.
+
+    Attributes
+    ----------
+    name : str or None
+        The label of the node; the taxon name for leaves.
+    length : float or None
+        The length of the branch leading to the node.
+    children : list of TreeNode
+        The child nodes, empty for leaves.
+    comment : str or None
+        The contents of a [comment] attached to the node, e.g. the tree
+        weight PHYLIP attaches to the root of tied trees.
+    """
+    __slots__ = ('name', 'length', 'children', 'comment')
+
+    def __init__(self, name=None, length=None, children=None,
+            comment=None):
+        self.name = name
+        self.length = length
+        self.children = list() if children is None else children
+        self.comment = comment
+
+    def is_leaf(self):
+        return len(self.children) == 0
+
+    def postorder(self):
+        """
+        Iterate over the nodes of the tree below and including this one,
+        children before parents.
+        """
+        stack = [(self, False)]
+        while stack:
+            (node, visited) = stack.pop()
+            if visited or not node.children:
+                yield node
+            else:
+                stack.append((node, True))
+                for child in reversed(node.children):
+                    stack.append((child, False))
+
+    def leaves(self):
+        """
+        Iterate over the leaves below this node, from left to right.
+        """
+        return (node for node in self.postorder() if node.is_leaf())
+
+_reg_newick_token = re.compile(r"""
+        \s+                     # blanks, kept so text can be copied as is
+        |[(),:;]
+        |\[[^\]]*(?:\]|$)       # comment, possibly cut off at the end
+        |'(?:[^']|'')*(?:'|$)   # quoted label, possibly cut off
+        |[^\s(),:;\[\]']+       # unquoted label or branch length
+        """, re.VERBOSE)
+
+def _iter_newick_tokens(f, chunk_size=1 << 16):
+    """
+    Split the Newick text read from the file object `f` into tokens,
+    including runs of blanks, reading `chunk_size` characters at a time.
+
+    The last token of each chunk may continue into the next one, so it
+    is held back until the next chunk has been read.
+    """
+    buf = ''
+    while True:
+        chunk = f.read(chunk_size)
+        buf += chunk
+        lst_tok = list()
+        pos = 0
+        for match in _reg_newick_token.finditer(buf):
+            if match.start() != pos:
+                raise ValueError(
+                        'Unexpected {char!r} in tree.'.format(
+                            char=buf[pos]))
+            lst_tok.append(match.group())
+            pos = match.end()
+        if pos != len(buf):
+            raise ValueError(
+                    'Unexpected {char!r} in tree.'.format(char=buf[pos]))
+        if not chunk:
+            for tok in lst_tok:
+                if ((tok.startswith('[') and not tok.endswith(']')) or
+                        (tok.startswith("'") and
+                            (len(tok) == 1 or not tok.endswith("'")))):
+                    raise ValueError('Unterminated comment or label.')
+                yield tok
+            return
+        # hold back what may be an incomplete token
+        n_keep = 1
+        if len(lst_tok) > 1 and lst_tok[-2].startswith("'"):
+            # a doubled quote may straddle the two
+            n_keep = 2
+        for tok in lst_tok[:-n_keep]:
+            yield tok
+        buf = ''.join(lst_tok[-n_keep:])
+
+def _parse_newick_tokens(iter_tok, terminated=True):
+    """
+    Build trees of `TreeNode` from Newick tokens, yielding each as soon as
+    its terminating semicolon has been read.
+
+    If `terminated` is False, trailing tokens without a semicolon form a
+    final tree, otherwise they are an error.
+    """
+    root = None
+    is_length = False
+    for tok in iter_tok:
+        if tok.isspace():
+            continue
+        if root is None:
+            root = TreeNode()
+            node = root
+            stack = list()
+        if tok == '(':
+            child = TreeNode()
+            node.children.append(child)
+            stack.append(node)
+            node = child
+        elif tok == ',':
+            if not stack:
+                raise ValueError('Unbalanced parentheses in tree.')
+            node = TreeNode()
+            stack[-1].children.append(node)
+        elif tok == ')':
+            if not stack:
+                raise ValueError('Unbalanced parentheses in tree.')
+            node = stack.pop()
+        elif tok == ':':
+            is_length = True
+            continue
+        elif tok == ';':
+            if stack:
+                raise ValueError('Unbalanced parentheses in tree.')
+            yield root
+            root = None
+        elif tok.startswith('['):
+            node.comment = tok[1:-1]
+        elif is_length:
+            node.length = float(tok)
+        else:
+            node.name = _newick_unquote(tok)
+        is_length = False
+    if root is not None:
+        if terminated:
+            raise ValueError('Unterminated tree at the end of the file.')
+        if stack:
+            raise ValueError('Unbalanced parentheses in tree.')
+        yield root
+
+def _newick_unquote(tok):
+    """
+    Get the name represented by a Newick label token.
+    """
+    if tok.startswith("'"):
+        return tok[1:-1].replace("''", "'")
+    # unquoted underscores stand for blanks
+    return tok.replace('_', ' ')
+
+def _newick_quote(name):
+    """
+    Format a name as a Newick label token, quoting it only if needed.
+    """
+    name = str(name)
+    if not re.search(r"[\s(),:;\[\]'_]", name):
+        return name
+    if re.match(r"^[^\s(),:;\[\]'_]+(?: [^\s(),:;\[\]'_]+)*$", name):
+        return name.replace(' ', '_')
+    return "'" + name.replace("'", "''") + "'"
+
+def iter_newick(fname, chunk_size=1 << 16):
+    """
+    Read the trees from a Newick tree file one at a time.
+
+    The file is read in chunks of `chunk_size` characters, and only the
+    tree being parsed is held in memory, so files of any number of trees
+    can be read.
+
+    Yields
+    ------
+    tree : TreeNode
+        The root of each tree, in order.
+    """
+    with open(fname, 'r') as f:
+        for tree in _parse_newick_tokens(
+                _iter_newick_tokens(f, chunk_size)):
+            yield tree
+
+def parse_newick(str_tree):
+    """
+    Parse the text of a single Newick tree into a tree of `TreeNode`.
+    The trailing semicolon is optional.
+    """
+    iter_tok = (match.group()
+            for match in _reg_newick_token.finditer(str_tree))
+    lst_tree = list(_parse_newick_tokens(iter_tok, terminated=False))
+    if len(lst_tree) != 1:
+        raise ValueError('Expected exactly one tree, found {n:d}.'.format(
+            n=len(lst_tree)))
+    return lst_tree[0]
+
+def write_newick(iter_tree, fname):
+    """
+    Write trees of `TreeNode` to a Newick tree file, one per line, as they
+    are produced by `iter_tree`.
+
+    Returns
+    -------
+    n_tree : int
+        The number of trees written.
+    """
+    n_tree = 0
+    with open(fname, 'w') as f:
+        for tree in iter_tree:
+            f.write(newick_str(tree) + '\n')
+            n_tree += 1
+    return n_tree
+
+@_traced_call('relabel_newick')
+def relabel_newick(fname_in, dict_name, fname_out=None, chunk_size=1 << 16):
+    """
+    Rename the leaves of every tree in a Newick tree file.
+
+    The file is rewritten token by token, so it never has to fit in
+    memory, and everything other than the leaf labels, including branch
+    lengths, support values and layout, is copied unchanged.
+
+    Parameters
+    ----------
+    fname_in : str
+        The tree file to relabel.
+    dict_name : dict
+        Map from current leaf names to new ones, e.g. from
+        `read_name_map`.
+        Leaves not in `dict_name` keep their names.
+    fname_out : str, optional
+        The file to write (default: overwrite `fname_in`).
+
+    Returns
+    -------
+    fname_out : str
+    """
+    if fname_out is None:
+        fname_out = fname_in
+    # write to a temporary file, in case of overwriting the input
+    (fd, fname_tmp) = tempfile.mkstemp(prefix='.auto_phylip.',
+            dir=os.path.dirname(os.path.abspath(fname_out)))
+    try:
+        with os.fdopen(fd, 'w') as f_out, open(fname_in, 'r') as f_in:
+            prev = ';'
+            for tok in _iter_newick_tokens(f_in, chunk_size):
+                if tok.isspace():
+                    f_out.write(tok)
+                    continue
+                # a label straight after '(' or ',' (or at the start of a
+                # tree) names a leaf
+                if prev in '(,;' and tok not in '(),:;' and tok[0] != '[':
+                    # PHYLIP writes blanks in names as underscores, so a
+                    # name with an underscore matches the token as is
+                    name = _newick_unquote(tok)
+                    if tok in dict_name and tok[0] != "'":
+                        tok = _newick_quote(dict_name[tok])
+                    elif name in dict_name:
+                        tok = _newick_quote(dict_name[name])
+                f_out.write(tok)
+                prev = tok if len(tok) == 1 else 'label'
+        shutil.copymode(fname_in, fname_tmp)
+        os.rename(fname_tmp, fname_out)
+    except:
+        _clear_files(fname_tmp)
+        raise
+    return fname_out
+
+def write_name_map(lst_namepair, fname):
+    """
+    Write a map from the names used in a *.phy file to the full sequence
+    IDs they were cut from, as two tab separated columns.
+    """
+    with open(fname, 'w') as f:
+        for (name, full_name) in lst_namepair:
+            f.write('{name}\t{full}\n'.format(name=name, full=full_name))
+    return fname
+
+def read_name_map(fname):
+    """
+    Read a map written by `write_name_map` into a dict from the names
+    used in the *.phy file to the full sequence IDs.
+
+    Names which were cut from more than one full ID are ambiguous, and
+    are left out with a warning.
+    """
+    dict_name = dict()
+    set_ambiguous = set()
+    with open(fname, 'r') as f:
+        for line in f:
+            (name, sep, full_name) = line.rstrip('\r\n').partition('\t')
+            if name in dict_name and dict_name[name] != full_name:
+                set_ambiguous.add(name)
+            dict_name[name] = full_name
+    for name in sorted(set_ambiguous):
+        print('Name {name} is ambiguous, and will not be replaced.'.format(
+            name=name))
+        del dict_name[name]
+    return dict_name
+
+def _find_name_map(fname):
+    """
+    Find the name map for a tree or *.phy file, by stripping extensions
+    from `fname` until `base`.names exists, e.g. X.names for
+    X.boot.cons.tree.
+
+    Returns None if there is none.
+    """
+    basename = fname
+    while '.' in os.path.basename(basename):
+        basename = basename.rpartition('.')[0]
+        if os.path.exists(basename + '.names'):
+            return basename + '.names'
+    return None
+
+def newick_str(tree):
+    """
+    Format a tree of `TreeNode` as Newick text, including the
+    terminating semicolon.
+    """
+    lst_out = list()
+    stack = [(tree, False)]
+    while stack:
+        (node, visited) = stack.pop()
+        if node is None:
+            lst_out.append(',')
+            continue
+        if node.children and not visited:
+            lst_out.append('(')
+            stack.append((node, True))
+            for (iI, child) in reversed(list(enumerate(node.children))):
+                stack.append((child, False))
+                if iI > 0:
+                    stack.append((None, False))
+            continue
+        if node.children:
+            lst_out.append(')')
+        lst_out.append(_newick_label(node))
+    lst_out.append(';')
+    return ''.join(lst_out)
+
+def _newick_label(node):
+    """
+    Format the name, branch length and comment of a node for Newick text.
+    """
+    label = ''
+    if node.name is not None:
+        label += _newick_quote(node.name)
+    if node.length is not None:
+        label += ':' + repr(float(node.length))
+    if node.comment is not None:
+        label += '[' + node.comment + ']'
+    return label
+
 def _tab2phy_main():
     """
     The main runner script for the command `tab2phy`, including the
@@ -806,13 +6291,414 @@ def _tab2phy_main():
         when generating the tab files in the first place.
         """,
         )
+    parser.add_argument('-x', '--index',
+        dest='index',
+        default=None,
+        nargs='*',
+        help="""
+        Before anything else, (re)build an index of the clone column,
+        and of any other columns given here, alongside each TAB file.
+        Whenever a --match asks for an exact value in an indexed column,
+        e.g. -m cloneID '^123$', only the rows holding that value are
+        read, rather than the whole TAB file.
+        An index is ignored once its TAB file changes.
+        """,
+        )
+    parser.add_argument('-s', '--split-by-clone',
+        dest='split_by_clone',
+        action='store_true',
+        help="""
+        Write a separate PHY file for each clone, in a single pass over
+        the TAB file[s].
+        Each is named after the TAB file (or the --combine filename) and
+        the clone, e.g. X_12.phy for clone 12 of X.tab.
+        """,
+        )
+    parser.add_argument('-g', '--germline',
+        dest='germline',
+        action='store_true',
+        help="""
+        With --split-by-clone, write the germline sequence of each clone
+        as the first sequence of its PHY file, named Germline.
+        """,
+        )
+    parser.add_argument('-u', '--collapse',
+        dest='collapse',
+        action='store_true',
+        help="""
+        Write only the first of each set of identical sequences to the
+        PHY file, and a DUPS file alongside it listing the sequences each
+        one stands for.
+        run_phylip grafts these back onto the final tree.
+        """,
+        )
+    parser.add_argument('-i', '--interleaved',
+        dest='interleaved',
+        action='store_true',
+        help="""
+        Write the PHY file[s] in PHYLIP interleaved format, in blocks of
+        60 columns, rather than one line per sequence.
+        Memory use then stays the same however long the sequences are.
+        """,
+        )
+    parser.add_argument('-n', '--names',
+        dest='names',
+        action='store_true',
+        help="""
+        Also write a NAMES file alongside the PHY file, mapping the
+        shortened sequence names in the PHY file to the full sequence
+        IDs, for use with relabel_tree.
+        """,
+        )
+    _add_trace_args(parser)
     argspace = parser.parse_args()
+    _trace_from_args(argspace)
     ## Choose which column names to use for PHY file based on header
     ## rev.
     set_header_rev(argspace.header)
+    if argspace.index is not None:
+        for tabfile in argspace.files:
+            index_tabfile(tabfile, [clone_col] + argspace.index)
+    if argspace.split_by_clone:
+        tab2phy_clones(
+            argspace.files,
+            germline=argspace.germline,
+            outfile=argspace.phyfname,
+            match=argspace.match,
+            names=argspace.names,
+            collapse=argspace.collapse,
+            interleaved=argspace.interleaved,
+            )
+        return None
     tab2phy(
         argspace.files,
         outfile=argspace.phyfname,
         match=argspace.match,
+        names=argspace.names,
+        collapse=argspace.collapse,
+        interleaved=argspace.interleaved,
         )
     return None
+
+def _relabel_tree_main():
+    """
+    The main runner script for the command `relabel_tree`, including the
+    argparse parser.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+            description='''Replace the shortened sequence names in tree
+            files with full sequence IDs''',
+            )
+    parser.add_argument('-n', '--names',
+            dest='names',
+            default=None,
+            help="""
+            The NAMES file written by tab2phy --names.
+            If not provided, it is looked for alongside each tree file,
+            e.g. X.names for X.boot.cons.tree.
+            """,
+            )
+    parser.add_argument('-s', '--suffix',
+            dest='suffix',
+            default=None,
+            help="""
+            Write each relabelled tree file next to the original, with
+            this suffix added before the extension, e.g. '.named' turns
+            X.tree into X.named.tree.
+            If not provided, the tree files are relabelled in place.
+            """,
+            )
+    parser.add_argument('files', nargs='+',
+            help="""
+            These are the tree file[s] to relabel.
+            Each may contain any number of trees.
+            """,
+            )
+    _add_trace_args(parser)
+    argspace = parser.parse_args()
+    _trace_from_args(argspace)
+    for fname in argspace.files:
+        namefile = argspace.names
+        if namefile is None:
+            namefile = _find_name_map(fname)
+        if namefile is None:
+            raise ValueError(
+                    'No NAMES file found for {fname}.'.format(fname=fname))
+        if argspace.suffix is None:
+            fname_out = fname
+        else:
+            (basename, dot, ext) = fname.rpartition('.')
+            fname_out = basename + argspace.suffix + dot + ext
+        relabel_newick(fname, read_name_map(namefile), fname_out)
+        print('Relabelled tree[s] are: {:s}'.format(fname_out))
+    return None
+
+def _update_tree_main():
+    """
+    The main runner script for the command `update_tree`, including the
+    argparse parser.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+            description="""Add new sequences to an existing tree, each on
+            the branch where it adds the fewest changes, rather than
+            building the tree again from scratch""",
+            )
+    parser.add_argument('-t', '--tree',
+            dest='tree',
+            required=True,
+            help="""
+            The existing tree file, e.g. X.tree from run_phylip.
+            """,
+            )
+    parser.add_argument('-p', '--phy',
+            dest='phy',
+            required=True,
+            help="""
+            The PHY file of the sequences in the existing tree, e.g.
+            X.phy.
+            """,
+            )
+    parser.add_argument('-o', '--output',
+            dest='output',
+            default=None,
+            help="""
+            The PHY file to write all of the sequences to; the updated
+            tree is written next to it, e.g. Y.tree for Y.phy.
+            (default is X.updated.phy for X.phy)
+            """,
+            )
+    parser.add_argument('-r', '--rearrange',
+            dest='rearrange',
+            const=2,
+            nargs='?',
+            default=0,
+            type=int,
+            help="""
+            The number of rounds in which to take each new sequence out
+            again and put it back where it now adds the fewest changes.
+            Without an argument, 2 rounds.
+            (default is 0, no rearrangement)
+            """,
+            )
+    parser.add_argument('--refine',
+            dest='refine',
+            action='store_true',
+            help="""
+            Have the phylogeny program evaluate the updated tree as a
+            user tree, for its branch lengths, rather than computing
+            them with NumPy in this process.
+            """,
+            )
+    parser.add_argument('-c', '--command',
+            dest='command',
+            default=None,
+            help="""
+            With --refine, the PHYLIP executable to evaluate the tree
+            with, e.g. 'phylip dnapars'.
+            """,
+            )
+    parser.add_argument('files', nargs='+',
+            help="""
+            The PHY file[s] of the new sequences, all added to the tree
+            in turn.
+            """,
+            )
+    _add_cache_args(parser)
+    _add_limit_args(parser)
+    _add_trace_args(parser)
+    argspace = parser.parse_args()
+    _trace_from_args(argspace)
+    if argspace.command == None:
+        lst_cmd_arg = None
+    else:
+        lst_cmd_arg = argspace.command.split(' ')
+    phy_new = argspace.files[0]
+    if len(argspace.files) > 1:
+        # gather the new sequences into one file
+        phy_new = argspace.phy.rpartition('.')[0] + '.new.phy'
+        Alignment.from_seqpairs(seqpair for fname in argspace.files
+                for seqpair in Alignment.from_phy(fname).seqpairs()
+                ).write_phy(phy_new)
+    treename = update_tree(argspace.tree, argspace.phy, phy_new,
+            phy_out=argspace.output,
+            rearrange=argspace.rearrange,
+            refine=argspace.refine,
+            phy_exec=lst_cmd_arg,
+            **dict(_cache_kwarg(argspace), **_limit_kwarg(argspace))
+            )
+    return None
+
+def _phylip_worker_main():
+    """
+    The main runner script for the command `phylip_worker`, including the
+    argparse parser.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+            description="""Run the jobs in a job queue filled by
+            run_phylip, run_seqboot or run_consense with --submit, or
+            show their status""",
+            )
+    parser.add_argument('queue',
+            help="""
+            The job queue, a SQLite database on a filesystem shared by
+            all of the workers.
+            """,
+            )
+    parser.add_argument('-j', '--jobs',
+            dest='jobs',
+            default=1,
+            type=int,
+            help="""
+            The number of worker processes to start on this host.
+            If less than 1, use one per CPU.
+            (default is 1)
+            """,
+            )
+    parser.add_argument('-l', '--lease',
+            dest='lease',
+            default=lease_default,
+            type=float,
+            help="""
+            The time in seconds after which a job is given to another
+            worker if this one stops renewing its lease on it, e.g.
+            because it died.
+            (default is {default})
+            """.format(default=lease_default),
+            )
+    parser.add_argument('-n', '--max-jobs',
+            dest='max_jobs',
+            default=None,
+            type=int,
+            help="""
+            The number of jobs after which each worker stops.
+            (default is no limit)
+            """,
+            )
+    parser.add_argument('-w', '--wait',
+            dest='wait',
+            action='store_true',
+            help="""
+            Once no job is waiting, keep watching the queue while other
+            workers still hold jobs, in case they fail and are put back.
+            """,
+            )
+    parser.add_argument('--status',
+            dest='status',
+            action='store_true',
+            help="""
+            Print the state, attempts, worker, wall time and output or
+            error of each job, rather than running any.
+            """,
+            )
+    parser.add_argument('--requeue-failed',
+            dest='requeue_failed',
+            action='store_true',
+            help="""
+            Put the failed jobs back in the queue before running any.
+            """,
+            )
+    _add_trace_args(parser)
+    argspace = parser.parse_args()
+    _trace_from_args(argspace)
+    if argspace.status:
+        for job in queue_jobs(argspace.queue):
+            if job['wall'] is None:
+                str_wall = '-'
+            else:
+                str_wall = '{:.1f}s'.format(job['wall'])
+            print('{id:6d} {state:<8s} {attempts:d}/{max_attempts:d} '
+                    '{worker:<20s} {wall:>8s} {func:s} {fname:s} '
+                    '{result}'.format(**dict(job, wall=str_wall,
+                        worker=job['worker'] or '-',
+                        result=job['error'] or job['output'] or '')))
+        print(', '.join('{:d} {:s}'.format(n, state) for (state, n)
+            in sorted(queue_counts(argspace.queue).items())))
+        return None
+    if argspace.requeue_failed:
+        print('Put {:d} failed jobs back in the queue'.format(
+            requeue_failed(argspace.queue)))
+    n_workers = argspace.jobs
+    if n_workers < 1:
+        import multiprocessing
+        n_workers = multiprocessing.cpu_count()
+    lst_job = [(run_worker, argspace.queue, dict(lease=argspace.lease,
+        max_jobs=argspace.max_jobs, wait=argspace.wait))
+        for iI in range(n_workers)]
+    n_run = sum(_run_jobs(lst_job, n_workers))
+    print('Ran {:d} jobs from {:s}'.format(n_run, argspace.queue))
+    return None
+
+def _phylip_archive_main():
+    """
+    The main runner script for the command `phylip_archive`, including
+    the argparse parser.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+            description="""List, extract, or write out the trees in an
+            archive of runs made by run_phylip with --archive""",
+            )
+    parser.add_argument('archive',
+            help="""
+            The archive.
+            """,
+            )
+    parser.add_argument('clones', nargs='*',
+            help="""
+            The clone IDs, e.g. X for a run on X.phy, to read the files
+            of.
+            (default is all of them)
+            """,
+            )
+    parser.add_argument('-k', '--kind',
+            dest='kind',
+            default=None,
+            help="""
+            The kind of file to read, the end of its name after the
+            clone ID, e.g. tree, cons.tree, boot.phy or out.
+            (default is tree when writing the trees out, and all kinds
+            with --list or --extract)
+            """,
+            )
+    parser.add_argument('-l', '--list',
+            dest='list',
+            action='store_true',
+            help="""
+            List the clone ID, name and size of each file, rather than
+            writing the trees out.
+            """,
+            )
+    parser.add_argument('-x', '--extract',
+            dest='extract',
+            default=None,
+            metavar='DIR',
+            help="""
+            Write each file into the directory DIR, under the name it had
+            when run, rather than writing the trees out.
+            """,
+            )
+    argspace = parser.parse_args()
+    lst_clone = argspace.clones or None
+    if argspace.list:
+        for (clone, name, size) in archive_list(argspace.archive, lst_clone,
+                argspace.kind):
+            print('{clone:s}\t{name:s}\t{size:d}'.format(clone=clone,
+                name=name, size=size))
+    elif argspace.extract != None:
+        if not os.path.isdir(argspace.extract):
+            os.makedirs(argspace.extract)
+        lst_fname = archive_extract(argspace.archive, argspace.extract,
+                lst_clone, argspace.kind)
+        print('Extracted {n:d} files to {dirname:s}'.format(
+            n=len(lst_fname), dirname=argspace.extract))
+    else:
+        # write the trees out one after another, as in a multi-tree file
+        f_out = getattr(sys.stdout, 'buffer', sys.stdout)
+        for (clone, name, data) in iter_archive(argspace.archive,
+                lst_clone, argspace.kind or 'tree'):
+            f_out.write(data)
+        f_out.flush()
+    return None
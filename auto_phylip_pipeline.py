@@ -0,0 +1,656 @@
+'''
+auto_phylip_pipeline runs the stages of auto_phylip over the clones in
+tabfiles as a pipeline, with asyncio, so that the stages of different
+clones overlap.
+
+Unlike auto_phylip, this needs Python 3.5 or later.
+'''
+import asyncio
+import functools
+import os
+import time
+
+import auto_phylip
+
+# the stages after tab parsing, and how many clones each works on at a
+# time by default, 0 for one per CPU
+lst_stage = ['seqboot', 'infer', 'consense', 'cleanup']
+dict_limit_default = {'seqboot': 2, 'infer': 0, 'consense': 2, 'cleanup': 2}
+# how many clones may wait between one stage and the next
+queue_size_default = 2
+
+# the keyword arguments of `run_pipeline` which are passed on to
+# `auto_phylip.iter_tab2phy_clones`
+lst_tab_kwarg = ['outfile', 'germline', 'match', 'flags', 'names',
+        'collapse', 'interleaved', 'n_buckets']
+# the keyword arguments of `auto_phylip.run_phylip` which the stages
+# follow; the rest, e.g. compress or shards, are refused
+lst_run_kwarg = ['phy_exec', 'bootstrap', 'seed', 'jumble',
+        'native_seqboot', 'native_consense', 'native_cleanup',
+        'cache', 'cache_size', 'fallback', 'timeout', 'max_memory',
+        'progress', 'journal']
+
+
+@auto_phylip._traced_call('run_pipeline')
+def run_pipeline(lst_tabfile, **kwarg):
+    """
+    Build a tree for each clone in the tabfiles `lst_tabfile`, running
+    the stages of `auto_phylip.run_phylip` for different clones at the
+    same time.
+
+    Tab parsing writes the *.phy file of one clone after another, which
+    go through seqboot, the phylogeny program, consense and the cleanup
+    of the consensus tree in turn, or only the phylogeny program if not
+    bootstrapping.
+    Each stage works on up to its limit of clones at a time, so that
+    e.g. seqboot on one clone runs alongside the phylogeny program on
+    another while the *.phy file of a third is written.
+    The PHYLIP programs are run with `asyncio.create_subprocess_exec`,
+    and the stages done in this process in a pool of threads.
+    Between stages, at most `queue_size` clones wait for the next, and a
+    stage with no room to pass on its clones takes no new ones, so the
+    stages before it are held back rather than filling the disk.
+
+    Parameters
+    ----------
+    lst_tabfile : list of str
+        The tabfiles to read the clones from.
+    limits : dict, optional
+        The number of clones each stage in `lst_stage` works on at a
+        time, 0 for one per CPU, for those stages in which to change
+        `dict_limit_default`.
+    queue_size : int, optional
+        The number of clones which may wait for each stage
+        (default: `queue_size_default`).
+    keep : bool, optional
+        Keep the intermediate files of each clone, e.g. X.boot.phy,
+        rather than removing each once the stages which read it are done
+        (default: False).
+    outfile, germline, match, flags, names, collapse, interleaved,
+    n_buckets : optional
+        As for `auto_phylip.tab2phy_clones`.
+    phy_exec, bootstrap, seed, jumble, native_seqboot, native_consense,
+    native_cleanup : optional
+        As for `auto_phylip.run_phylip`.
+    cache, cache_size, fallback, timeout, max_memory, progress,
+    journal : optional
+        As for `auto_phylip._run_stage`.
+
+    Returns
+    -------
+    lst_treename : list of str
+        The final tree file of each clone which finished, in the order
+        they finished.
+        The clones which failed are reported as they do, and left out.
+
+    Raises
+    ------
+    ValueError
+        If given an option of `auto_phylip.run_phylip` which the stages
+        do not follow, e.g. compress or shards.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(_pipeline(lst_tabfile, **kwarg))
+    finally:
+        loop.close()
+
+
+async def _pipeline(lst_tabfile, **kwarg):
+    """
+    Run the pipeline of `run_pipeline` on the running event loop.
+    """
+    dict_limit = dict(dict_limit_default, **kwarg.pop('limits', None) or {})
+    queue_size = kwarg.pop('queue_size', queue_size_default)
+    keep = kwarg.pop('keep', False)
+    kwarg_tab = dict((key, kwarg.pop(key)) for key in lst_tab_kwarg
+            if key in kwarg)
+    lst_unknown = sorted(key for key in kwarg if key not in lst_run_kwarg)
+    if lst_unknown:
+        # rather than quietly building trees without them
+        raise ValueError('The pipeline does not support: {:s}.'.format(
+            ', '.join(lst_unknown)))
+    if kwarg.get('bootstrap'):
+        lst_stage_run = lst_stage
+    else:
+        lst_stage_run = ['infer']
+    for stage in lst_stage_run:
+        if dict_limit[stage] < 1:
+            dict_limit[stage] = os.cpu_count() or 1
+    # a queue in front of each stage, and one for the finished clones
+    lst_queue = [asyncio.Queue(queue_size) for stage in lst_stage_run]
+    lst_queue.append(asyncio.Queue())
+    lst_task = [_produce_clones(lst_tabfile, lst_queue[0],
+        dict_limit[lst_stage_run[0]], kwarg_tab)]
+    for (i_stage, stage) in enumerate(lst_stage_run):
+        if i_stage + 1 < len(lst_stage_run):
+            n_next = dict_limit[lst_stage_run[i_stage + 1]]
+        else:
+            n_next = 1
+        func = functools.partial(globals()['_stage_' + stage], **kwarg)
+        lst_task.append(_run_stage_workers(stage, func, dict_limit[stage],
+            lst_queue[i_stage], lst_queue[i_stage + 1], n_next, keep))
+    lst_task.append(_finish_clones(lst_queue[-1], keep))
+    # let every stage wind down before raising an error from any
+    lst_result = await asyncio.gather(*lst_task, return_exceptions=True)
+    for result in lst_result:
+        if isinstance(result, Exception):
+            raise result
+    return lst_result[-1]
+
+
+async def _produce_clones(lst_tabfile, queue, n_next, kwarg_tab):
+    """
+    Write the *.phy file of one clone after another, in a thread, and
+    put each on `queue` as a dict of its files, then a None for each of
+    the `n_next` workers of the next stage.
+
+    The next file is only written once there is room on `queue`.
+    """
+    loop = asyncio.get_event_loop()
+    iter_phyfile = auto_phylip.iter_tab2phy_clones(lst_tabfile, **kwarg_tab)
+    n_clone = 0
+    try:
+        while True:
+            phyfile = await loop.run_in_executor(None, next, iter_phyfile,
+                    None)
+            if phyfile is None:
+                break
+            n_clone += 1
+            await queue.put(dict(phy=phyfile, current=phyfile, temp=[]))
+    finally:
+        # removes the spool of the tabfiles
+        iter_phyfile.close()
+        for iI in range(n_next):
+            await queue.put(None)
+    if n_clone == 0:
+        print('No matches found.')
+    else:
+        print('Wrote {:d} clone PHY files.'.format(n_clone))
+
+
+async def _run_stage_workers(stage, func, n_workers, queue_in, queue_out,
+        n_next, keep=False):
+    """
+    Run `n_workers` workers of the stage `stage`, each taking one clone
+    after another from `queue_in`, running the coroutine function
+    `func` on it, and putting it on `queue_out`, until it takes a None.
+    Then put a None on `queue_out` for each of the `n_next` workers of
+    the next stage.
+
+    Once a stage is done with a clone, the intermediate files of the
+    stages before are removed, unless `keep`.
+    A clone for which `func` fails is reported, and dropped.
+    """
+    async def worker():
+        while True:
+            clone = await queue_in.get()
+            if clone is None:
+                return
+            lst_temp = list(clone['temp'])
+            try:
+                await func(clone)
+            except Exception as err:
+                print('{stage:s} failed on {fname:s}, {type:s}: {err}'.format(
+                    stage=stage, fname=clone['phy'], type=type(err).__name__,
+                    err=err))
+                if not keep:
+                    _clear_temp(clone)
+                continue
+            if not keep:
+                auto_phylip._clear_files(*lst_temp)
+                clone['temp'] = [fname for fname in clone['temp']
+                        if fname not in lst_temp]
+            await queue_out.put(clone)
+
+    await asyncio.gather(*[worker() for iI in range(n_workers)])
+    for iI in range(n_next):
+        await queue_out.put(None)
+
+
+async def _finish_clones(queue, keep=False):
+    """
+    Take the finished clones from `queue`, removing the rest of their
+    intermediate files unless `keep`, until a None.
+
+    Returns
+    -------
+    lst_treename : list of str
+        The final tree files.
+    """
+    lst_treename = list()
+    while True:
+        clone = await queue.get()
+        if clone is None:
+            return lst_treename
+        if not keep:
+            _clear_temp(clone)
+        lst_treename.append(clone['current'])
+
+
+def _clear_temp(clone):
+    """
+    Remove the intermediate files of a clone.
+    """
+    auto_phylip._clear_files(*clone['temp'])
+    del clone['temp'][:]
+
+
+async def _in_thread(func, *args, **kwarg):
+    """
+    Call `func` in the default pool of threads, and return its result.
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None,
+            functools.partial(func, *args, **kwarg))
+
+
+async def _stage_seqboot(clone, **kwarg):
+    """
+    Bootstrap the *.phy file of a clone, with seqboot or in a thread.
+    """
+    n_bootstrap = kwarg['bootstrap']
+    seed = kwarg.get('seed', 9)
+    phyfile = clone['current']
+    if kwarg.get('native_seqboot'):
+        bootname = await _in_thread(auto_phylip.run_seqboot, phyfile,
+                n_bootstrap, seed=seed, native_seqboot=True)
+    else:
+        bootname = phyfile.rpartition('.')[0] + '.boot.phy'
+        opts = auto_phylip._get_seqboot_opts(os.path.basename(phyfile),
+                n_bootstrap, seed=seed)
+        kwarg_stage = auto_phylip._stage_kwarg(kwarg, pop=False)
+        # seqboot is the only program for this stage
+        kwarg_stage.pop('fallback', None)
+        await _run_stage_async(auto_phylip.boot_exec_default, opts,
+                [phyfile], [('outfile', bootname)], **kwarg_stage)
+    clone['current'] = bootname
+    clone['temp'].append(bootname)
+
+
+async def _stage_infer(clone, **kwarg):
+    """
+    Run the phylogeny program on the *.phy file, or the bootstrapped
+    datasets, of a clone.
+    """
+    phy_in = clone['current']
+    phy_exec = kwarg.get('phy_exec') or auto_phylip.phy_exec_default
+    bootstrap = kwarg.get('bootstrap')
+    basename = phy_in.rpartition('.')[0]
+    outname = basename + '.out'
+    treename = basename + '.tree'
+    opts = auto_phylip._get_phy_opts(os.path.basename(phy_in),
+            bootstrap=bootstrap,
+            seed=kwarg.get('seed', 9),
+            jumble=kwarg.get('jumble', 1),
+            interleaved=(not bootstrap and await _in_thread(
+                auto_phylip._phy_interleaved, phy_in)),
+            )
+    await _run_stage_async(phy_exec, opts, [phy_in],
+            [('outfile', outname), ('outtree', treename)],
+            **auto_phylip._stage_kwarg(kwarg, pop=False))
+    print('Inferred tree[s] on {:s}'.format(treename))
+    clone['current'] = treename
+    if bootstrap:
+        clone['temp'].extend([outname, treename])
+    else:
+        await _graft_duplicates(clone)
+
+
+async def _stage_consense(clone, **kwarg):
+    """
+    Build the consensus of the bootstrapped trees of a clone, with
+    consense or in a thread.
+    """
+    fname = clone['current']
+    if kwarg.get('native_consense'):
+        treename = await _in_thread(auto_phylip.run_consense, fname,
+                native_consense=True)
+        outname = treename.rpartition('.')[0] + '.out'
+    else:
+        basename = fname.rpartition('.')[0]
+        outname = basename + '.cons.out'
+        treename = basename + '.cons.tree'
+        kwarg_stage = auto_phylip._stage_kwarg(kwarg, pop=False)
+        kwarg_stage.pop('fallback', None)
+        await _run_stage_async(auto_phylip.cons_exec,
+                auto_phylip._get_consense_opts(os.path.basename(fname)),
+                [fname], [('outfile', outname), ('outtree', treename)],
+                **kwarg_stage)
+    print('Consensus tree is: {:s}'.format(treename))
+    clone['current'] = treename
+    clone['temp'].extend([outname, treename])
+
+
+async def _stage_cleanup(clone, **kwarg):
+    """
+    Put branch lengths on the consensus tree of a clone from its original
+    *.phy file, with the phylogeny program or in a thread.
+    """
+    fname_consensus = clone['current']
+    phy_orig = clone['phy']
+    if kwarg.get('native_cleanup'):
+        treename = await _in_thread(auto_phylip.cleanup_consense,
+                fname_consensus, phy_orig, native_cleanup=True)
+    else:
+        phy_exec = kwarg.get('phy_exec') or auto_phylip.phy_exec_default
+        basename = phy_orig.rpartition('.')[0]
+        outname = basename + '.out'
+        treename = basename + '.tree'
+        rawname = basename + '.raw.tree'
+        opts = auto_phylip._get_phy_opts(os.path.basename(phy_orig),
+                fname_tree=os.path.basename(fname_consensus),
+                search=False,
+                interleaved=await _in_thread(auto_phylip._phy_interleaved,
+                    phy_orig),
+                )
+        await _run_stage_async(phy_exec, opts, [phy_orig, fname_consensus],
+                [('outfile', outname), ('outtree', rawname)],
+                **auto_phylip._stage_kwarg(kwarg, pop=False))
+        # the first line of the tree is of no use, see cleanup_consense
+        await _in_thread(auto_phylip._strip_first_lines, rawname,
+                fname_out=treename)
+        auto_phylip._clear_files(rawname)
+        print('Edge length corrected consensus tree is: {:s}'.format(
+            treename))
+    clone['current'] = treename
+    await _graft_duplicates(clone)
+
+
+async def _graft_duplicates(clone):
+    """
+    Graft the duplicates of a clone collapsed by tab parsing back onto
+    its final tree, if there are any.
+    """
+    dupfile = await _in_thread(auto_phylip._find_dup_map, clone['phy'])
+    if dupfile is not None:
+        await _in_thread(auto_phylip.expand_duplicates, clone['current'],
+                dupfile)
+        print('Grafted duplicate sequences onto {:s}'.format(
+            clone['current']))
+
+
+async def _run_stage_async(lst_exec, opts, lst_input, lst_output, **kwarg):
+    """
+    Run a PHYLIP program as `auto_phylip._run_stage` does, but as a
+    subprocess of the event loop, with the steps of the run around it,
+    e.g. hashing the inputs for the cache and the journal, in the pool of
+    threads.
+
+    Parameters
+    ----------
+    lst_exec, opts, lst_input, lst_output, trailing_nl, cache,
+    cache_size, fallback, trace_info, journal : optional
+        As for `auto_phylip._run_stage`.
+    timeout, max_memory, progress : optional
+        As for `auto_phylip._call_phylip`.
+    """
+    run = await _in_thread(auto_phylip._stage_prepare, lst_exec, opts,
+            lst_input, lst_output, kwarg, nested=False)
+    while await _in_thread(auto_phylip._stage_begin, run):
+        try:
+            await _call_phylip_async(run['exec'], opts, run['scratch'],
+                    trailing_nl=run['trailing_nl'], stats=run['info'],
+                    **kwarg)
+            await _in_thread(auto_phylip._stage_end, run)
+        except auto_phylip.PhylipError as err:
+            if not await _in_thread(auto_phylip._stage_fail, run, err):
+                raise
+        except BaseException as err:
+            auto_phylip._stage_fail(run, err)
+            raise
+    return run['dest']
+
+
+async def _call_phylip_async(lst_exec, opts, scratch, trailing_nl=False,
+        timeout=None, max_memory=None, progress=None, stats=None):
+    """
+    Run a PHYLIP program inside the directory `scratch` as
+    `auto_phylip._call_phylip` does, watching it against its time and
+    memory limits, but without blocking the event loop.
+
+    Returns
+    -------
+    (out, err) : tuple of str
+        The standard output and standard error of the PHYLIP program.
+
+    Raises
+    ------
+    auto_phylip.PhylipLimitError
+        If the program was killed for going over a limit.
+    auto_phylip.PhylipError
+        If the program exited with a non-zero status.
+    """
+    cmd = auto_phylip._cmd_input(opts, scratch, trailing_nl=trailing_nl)
+    # in its own process group, to be killed along with any children
+    p = await asyncio.create_subprocess_exec(*lst_exec,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, cwd=scratch,
+            start_new_session=(os.name == 'posix'))
+    lst_out = list()
+    lst_err = list()
+    task_read = asyncio.ensure_future(asyncio.gather(
+        _read_output_async(p.stdout, lst_out, lst_exec, progress),
+        _read_output_async(p.stderr, lst_err)))
+    try:
+        p.stdin.write(cmd.encode('ascii'))
+        await p.stdin.drain()
+        p.stdin.close()
+    except (BrokenPipeError, ConnectionResetError):
+        # the program exited without reading all of its input
+        pass
+    exceeded = None
+    time_start = time.time()
+    task_wait = asyncio.ensure_future(p.wait())
+    while not task_wait.done():
+        await asyncio.wait([task_wait], timeout=auto_phylip.poll_interval)
+        if task_wait.done():
+            break
+        exceeded = auto_phylip._check_limits(p.pid, time_start, timeout,
+                max_memory, stats)
+        if exceeded is not None:
+            auto_phylip._kill_tree(p)
+            break
+    await task_wait
+    await task_read
+    if exceeded is not None:
+        raise auto_phylip.PhylipLimitError(lst_exec, *exceeded)
+    if p.returncode != 0:
+        raise auto_phylip.PhylipError(lst_exec, p.returncode,
+                ''.join(lst_err))
+    return (''.join(lst_out), ''.join(lst_err))
+
+
+async def _read_output_async(stream, lst_text, lst_exec=None, progress=None):
+    """
+    Read the stream `stream` to its end, as `auto_phylip._read_output`
+    does a pipe.
+    """
+    n_done = 0
+    tail = ''
+    while True:
+        chunk = await stream.read(1 << 16)
+        if not chunk:
+            break
+        chunk = chunk.decode('latin-1')
+        lst_text.append(chunk)
+        if progress is None:
+            continue
+        (tail, n_done) = auto_phylip._scan_progress(tail + chunk, n_done,
+                lst_exec, progress)
+
+
+def _run_pipeline_main():
+    """
+    The main runner script for the command `run_pipeline`, including the
+    argparse parser.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+            description="""Build a tree for each clone in tabfiles, with
+            the stages of different clones running at the same time""",
+            )
+    parser.add_argument('files', nargs='+',
+            help="""
+            The tabfiles to read the clones from.
+            """,
+            )
+    parser.add_argument('-o', '--outfile',
+            dest='outfile',
+            default=None,
+            help="""
+            The clone PHY files are named after this, e.g. X_12.phy for
+            clone 12 with X.phy.
+            (default is named after the tabfile when there is only one,
+            and file.phy otherwise)
+            """,
+            )
+    parser.add_argument('-r', '--header',
+            dest='header',
+            default=1,
+            type=int,
+            help="""
+            The version of headers to use, as for tab2phy: old-style
+            headers are 0, new-style headers are 1 (default).
+            """,
+            )
+    parser.add_argument('-m', '--match',
+            dest='match',
+            nargs=2,
+            action='append',
+            default=None,
+            metavar=('COLUMN', 'REGEX'),
+            help="""
+            Only use the rows whose COLUMN matches REGEX, as for
+            tab2phy.
+            May be given more than once.
+            """,
+            )
+    parser.add_argument('--collapse',
+            dest='collapse',
+            action='store_true',
+            help="""
+            Build the trees of the distinct sequences only, and graft the
+            duplicates back on.
+            """,
+            )
+    parser.add_argument('-c', '--command',
+            dest='command',
+            default=None,
+            help="""
+            The PHYLIP executable to build the trees with, as for
+            run_phylip, e.g. 'phylip dnapars'.
+            """,
+            )
+    parser.add_argument('-b', '--bootstrap',
+            dest='bootstrap',
+            const=auto_phylip.n_bootstrap_default,
+            nargs='?',
+            default=None,
+            type=int,
+            help="""
+            The number of bootstrap replicates, as for run_phylip.
+            (default is no bootstrapping)
+            """,
+            )
+    parser.add_argument('-s', '--seed',
+            dest='seed',
+            default=9,
+            type=int,
+            help="""
+            Random seed to use for seqboot and jumbling.
+            """,
+            )
+    parser.add_argument('-J', '--jumble',
+            dest='jumble',
+            default=1,
+            type=int,
+            help="""
+            The number of times to jumble the input order of the
+            sequences.
+            (default is 1)
+            """,
+            )
+    parser.add_argument('--native-seqboot',
+            dest='native_seqboot',
+            action='store_true',
+            help="""
+            Resample with NumPy in this process rather than with seqboot.
+            """,
+            )
+    parser.add_argument('--native-consense',
+            dest='native_consense',
+            action='store_true',
+            help="""
+            Build the consensus trees in this process rather than with
+            consense.
+            """,
+            )
+    parser.add_argument('--native-cleanup',
+            dest='native_cleanup',
+            action='store_true',
+            help="""
+            Put branch lengths on the consensus trees in this process
+            rather than with the phylogeny program.
+            """,
+            )
+    for stage in lst_stage:
+        parser.add_argument('--{:s}-limit'.format(stage),
+                dest='limit_' + stage,
+                default=dict_limit_default[stage],
+                type=int,
+                help="""
+                The number of clones to run the {stage} stage on at a
+                time, 0 for one per CPU.
+                (default is {default})
+                """.format(stage=stage, default=dict_limit_default[stage]),
+                )
+    parser.add_argument('-q', '--queue-size',
+            dest='queue_size',
+            default=queue_size_default,
+            type=int,
+            help="""
+            The number of clones which may wait for each stage, beyond
+            which the stages before it are held back.
+            (default is {default})
+            """.format(default=queue_size_default),
+            )
+    parser.add_argument('-k', '--keep',
+            dest='keep',
+            action='store_true',
+            help="""
+            Keep the intermediate files of each clone, e.g. X.boot.phy,
+            rather than removing each once the stages which read it are
+            done.
+            """,
+            )
+    auto_phylip._add_cache_args(parser)
+    auto_phylip._add_limit_args(parser, fallback=True)
+    auto_phylip._add_trace_args(parser)
+    argspace = parser.parse_args()
+    auto_phylip._trace_from_args(argspace)
+    auto_phylip.set_header_rev(argspace.header)
+    if argspace.command == None:
+        lst_cmd_arg = None
+    else:
+        lst_cmd_arg = argspace.command.split(' ')
+    lst_treename = run_pipeline(argspace.files,
+            outfile=argspace.outfile,
+            match=argspace.match or list(),
+            collapse=argspace.collapse,
+            phy_exec=lst_cmd_arg,
+            bootstrap=argspace.bootstrap,
+            seed=argspace.seed,
+            jumble=argspace.jumble,
+            native_seqboot=argspace.native_seqboot,
+            native_consense=argspace.native_consense,
+            native_cleanup=argspace.native_cleanup,
+            limits=dict((stage, getattr(argspace, 'limit_' + stage))
+                for stage in lst_stage),
+            queue_size=argspace.queue_size,
+            keep=argspace.keep,
+            **dict(auto_phylip._cache_kwarg(argspace),
+                **auto_phylip._limit_kwarg(argspace))
+            )
+    print('Built {:d} trees.'.format(len(lst_treename)))
+    return None
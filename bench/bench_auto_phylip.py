@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+'''
+Benchmarks for auto_phylip, run on synthetic data against the stand-in
+`phylip` program in this directory, so they need neither real data nor
+PHYLIP itself.
+
+Run e.g.
+
+    python bench/bench_auto_phylip.py -s small medium -o new.json \
+            --baseline old.json
+
+to time each case at each size, save the timings to new.json, and
+compare them against those saved earlier in old.json.
+The auto_phylip in the directory above this one is the one timed.
+'''
+from __future__ import print_function
+
+import json
+import os
+import platform
+import random
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+dirname_bench = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(dirname_bench))
+import auto_phylip
+
+# rows and clones are those of the tab file; taxa, length and bootstrap
+# those of the alignment given to the PHYLIP stages
+dict_size = {
+        'small': dict(rows=2000, clones=20, taxa=10, length=300,
+            bootstrap=20),
+        'medium': dict(rows=20000, clones=200, taxa=30, length=400,
+            bootstrap=100),
+        'large': dict(rows=200000, clones=2000, taxa=60, length=500,
+            bootstrap=200),
+        }
+lst_case = ['tab2phy', 'lst_entries2phy', 'run_seqboot', 'run_phylip',
+        'run_consense', 'run_neighbor', 'relabel_newick']
+
+alphabet = 'ACGT'
+
+
+def _mutate(seq, rate, rng):
+    """
+    Copy `seq`, with each site replaced by a random base at `rate`.
+    """
+    return ''.join(rng.choice(alphabet) if rng.random() < rate else base
+            for base in seq)
+
+
+def make_tab(fname, n_rows, n_clones, len_seq, seed=1):
+    """
+    Write a synthetic tab file of `n_rows` sequences of length `len_seq`,
+    spread evenly over `n_clones` clones, with the column names of
+    header rev 1.
+
+    Each clone has its own germline, and its sequences are mutants of it.
+
+    Returns
+    -------
+    lst_clone : list of str
+        The clone IDs, largest clone first.
+    """
+    rng = random.Random(seed)
+    lst_clone = ['clone_{:06d}'.format(iI) for iI in range(n_clones)]
+    lst_germline = [''.join(rng.choice(alphabet) for iJ in range(len_seq))
+            for iI in range(n_clones)]
+    with open(fname, 'w') as f:
+        f.write('seqID\tsequence\tcloneID\tgermline\n')
+        for iI in range(n_rows):
+            i_clone = iI % n_clones
+            germline = lst_germline[i_clone]
+            f.write('read_{:010d}\t{seq}\t{clone}\t{germ}\n'.format(iI,
+                seq=_mutate(germline, 0.02, rng),
+                clone=lst_clone[i_clone], germ=germline))
+    return lst_clone
+
+
+def make_phy(fname, n_taxa, len_seq, seed=1):
+    """
+    Write a synthetic sequential *.phy alignment of `n_taxa` mutants of
+    one random sequence of length `len_seq`.
+    """
+    rng = random.Random(seed)
+    root = ''.join(rng.choice(alphabet) for iJ in range(len_seq))
+    with open(fname, 'w') as f:
+        f.write('{:d} {:d}\n'.format(n_taxa, len_seq))
+        for iI in range(n_taxa):
+            f.write('seq_{:05d} '.format(iI) + _mutate(root, 0.05, rng)
+                    + '\n')
+    return fname
+
+
+def _stub_path():
+    """
+    Make a directory holding the stand-in as an executable `phylip`, to
+    be put at the front of PATH.
+    """
+    dirname = tempfile.mkdtemp(prefix='auto_phylip_bench_bin.')
+    fname = os.path.join(dirname, 'phylip')
+    with open(os.path.join(dirname_bench, 'phylip'), 'r') as f_in:
+        text = f_in.read()
+    with open(fname, 'w') as f_out:
+        # run it with the same python as the benchmark
+        f_out.write('#!' + sys.executable + '\n' + text)
+    os.chmod(fname, os.stat(fname).st_mode | stat.S_IXUSR)
+    return dirname
+
+
+def _time_call(func, n_repeat):
+    """
+    Call `func` `n_repeat` times, and return the shortest wall time.
+    """
+    lst_time = list()
+    for iI in range(n_repeat):
+        time_start = time.time()
+        func()
+        lst_time.append(time.time() - time_start)
+    return min(lst_time)
+
+
+def _cases(workdir, size):
+    """
+    Generate the inputs for one size in `workdir`, and return a dict of
+    the name of each case and a function running it once.
+    """
+    auto_phylip.set_header_rev(1)
+    tabfile = os.path.join(workdir, 'bench.tab')
+    phyfile = os.path.join(workdir, 'bench.phy')
+    lst_clone = make_tab(tabfile, size['rows'], size['clones'],
+            size['length'])
+    make_phy(phyfile, size['taxa'], size['length'])
+    lst_entries = list(auto_phylip._gather_entries_iter([tabfile]))
+    # trees to build a consensus from, made once up front
+    treefile = os.path.join(workdir, 'cons.tree')
+    bootname = auto_phylip.run_seqboot(phyfile, size['bootstrap'])
+    shutil.copyfile(auto_phylip._infer_trees(bootname,
+        phy_exec=auto_phylip.phy_exec_default,
+        bootstrap=size['bootstrap']), treefile)
+    # full IDs for the names of the alignment, which hold underscores
+    dict_name = dict(('seq_{:05d}'.format(iI), 'bench_seq_{:05d}'.format(iI))
+            for iI in range(size['taxa']))
+
+    def run_tab2phy():
+        auto_phylip.tab2phy([tabfile],
+                outfile=os.path.join(workdir, 'clone.phy'),
+                match=[[auto_phylip.clone_col,
+                    '^{:s}$'.format(lst_clone[0])]])
+
+    def run_lst_entries2phy():
+        auto_phylip.lst_entries2phy(lst_entries,
+                os.path.join(workdir, 'all.phy'))
+
+    def run_seqboot():
+        auto_phylip.run_seqboot(phyfile, size['bootstrap'])
+
+    def run_phylip():
+        auto_phylip.run_phylip(phyfile, bootstrap=size['bootstrap'])
+
+    def run_consense():
+        auto_phylip.run_consense(treefile)
+
+    def run_neighbor():
+        auto_phylip.run_neighbor(phyfile, bootstrap=size['bootstrap'])
+
+    def run_relabel_newick():
+        fname_out = os.path.join(workdir, 'relabel.tree')
+        auto_phylip.relabel_newick(treefile, dict_name, fname_out=fname_out)
+        # a case that renames nothing would be fast for the wrong reason
+        for tree in auto_phylip.iter_newick(fname_out):
+            for leaf in tree.leaves():
+                if leaf.name not in dict_name.values():
+                    raise ValueError('Leaf {:s} was not relabelled.'.format(
+                        leaf.name))
+
+    return dict(
+            tab2phy=run_tab2phy,
+            lst_entries2phy=run_lst_entries2phy,
+            run_seqboot=run_seqboot,
+            run_phylip=run_phylip,
+            run_consense=run_consense,
+            run_neighbor=run_neighbor,
+            relabel_newick=run_relabel_newick,
+            )
+
+
+def run_benchmarks(lst_size, lst_name=None, n_repeat=3):
+    """
+    Time each case in `lst_name` at each size in `lst_size`.
+
+    A case that fails is recorded with its error rather than a time.
+
+    Returns
+    -------
+    dict_result : dict
+        Maps each case name to a dict of its time in seconds, or its
+        error, at each size.
+    """
+    if lst_name is None:
+        lst_name = lst_case
+    path_orig = os.environ.get('PATH', '')
+    dirname_stub = _stub_path()
+    os.environ['PATH'] = dirname_stub + os.pathsep + path_orig
+    dict_result = dict((name, dict()) for name in lst_name)
+    try:
+        for size_name in lst_size:
+            workdir = tempfile.mkdtemp(prefix='auto_phylip_bench.')
+            try:
+                dict_func = _cases(workdir, dict_size[size_name])
+                for name in lst_name:
+                    try:
+                        dict_result[name][size_name] = _time_call(
+                                dict_func[name], n_repeat)
+                    except Exception as err:
+                        dict_result[name][size_name] = dict(
+                                error='{:s}: {:s}'.format(
+                                    type(err).__name__, str(err)))
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        os.environ['PATH'] = path_orig
+        shutil.rmtree(dirname_stub, ignore_errors=True)
+    return dict_result
+
+
+def compare(dict_result, dict_baseline, tolerance=0.1):
+    """
+    Print the ratio of each timing to its baseline, and return the list
+    of (case, size) pairs which got slower by more than `tolerance`.
+    """
+    lst_slower = list()
+    print('{:<18s}{:<8s}{:>10s}{:>10s}{:>8s}'.format(
+        'case', 'size', 'base', 'new', 'ratio'))
+    for name in sorted(dict_result):
+        for (size_name, value) in sorted(dict_result[name].items()):
+            base = dict_baseline.get(name, dict()).get(size_name)
+            if not isinstance(value, float) or not isinstance(base, float):
+                print('{:<18s}{:<8s}{:>10s}{:>10s}'.format(name, size_name,
+                    _fmt_time(base), _fmt_time(value)))
+                continue
+            ratio = value / base if base else float('inf')
+            flag = ''
+            if ratio > 1 + tolerance:
+                lst_slower.append((name, size_name))
+                flag = ' slower'
+            print('{:<18s}{:<8s}{:>10.4f}{:>10.4f}{:>8.2f}{:s}'.format(
+                name, size_name, base, value, ratio, flag))
+    return lst_slower
+
+
+def _fmt_time(value):
+    if isinstance(value, float):
+        return '{:.4f}'.format(value)
+    if value is None:
+        return '-'
+    return 'error'
+
+
+def _main():
+    import argparse
+    parser = argparse.ArgumentParser(
+            description='''Time auto_phylip on synthetic data, against a
+            stand-in for PHYLIP''',
+            )
+    parser.add_argument('-s', '--sizes',
+            dest='sizes',
+            nargs='+',
+            default=['small', 'medium'],
+            choices=sorted(dict_size),
+            help="""
+            The sizes of data to time each case at.
+            (default is small medium)
+            """,
+            )
+    parser.add_argument('-c', '--cases',
+            dest='cases',
+            nargs='+',
+            default=lst_case,
+            choices=lst_case,
+            help="""
+            The cases to time.
+            (default is all of them)
+            """,
+            )
+    parser.add_argument('-r', '--repeat',
+            dest='repeat',
+            default=3,
+            type=int,
+            help="""
+            Run each case this many times, and keep the shortest time.
+            (default is 3)
+            """,
+            )
+    parser.add_argument('-o', '--output',
+            dest='output',
+            default=None,
+            help="""
+            Save the timings, with the sizes used, to this JSON file.
+            """,
+            )
+    parser.add_argument('-b', '--baseline',
+            dest='baseline',
+            default=None,
+            help="""
+            A JSON file saved by an earlier run to compare the timings
+            against.
+            """,
+            )
+    parser.add_argument('-t', '--tolerance',
+            dest='tolerance',
+            default=0.1,
+            type=float,
+            help="""
+            With --baseline, the fraction by which a case may be slower
+            than its baseline before it is reported, and the exit status
+            set.
+            (default is 0.1)
+            """,
+            )
+    argspace = parser.parse_args()
+    dict_result = run_benchmarks(argspace.sizes, argspace.cases,
+            argspace.repeat)
+    dict_out = dict(
+            python=platform.python_version(),
+            platform=platform.platform(),
+            sizes=dict((name, dict_size[name]) for name in argspace.sizes),
+            repeat=argspace.repeat,
+            results=dict_result,
+            )
+    if argspace.output is not None:
+        with open(argspace.output, 'w') as f:
+            json.dump(dict_out, f, indent=2, sort_keys=True)
+        print('Saved timings to {:s}'.format(argspace.output))
+    if argspace.baseline is None:
+        dict_baseline = dict()
+    else:
+        with open(argspace.baseline, 'r') as f:
+            dict_baseline = json.load(f)['results']
+    lst_slower = compare(dict_result, dict_baseline, argspace.tolerance)
+    if lst_slower:
+        sys.exit(1)
+    return None
+
+
+if __name__ == '__main__':
+    _main()
@@ -5,13 +5,18 @@ setup(
         version='0.1.1',
         author='J. D. A. Gilliland',
         author_email='jdagilliland@gmail.com',
-        py_modules=['auto_phylip'],
+        py_modules=['auto_phylip', 'auto_phylip_pipeline'],
         scripts=[
             'bin/run_phylip',
             'bin/tab2phy',
             'bin/run_seqboot',
             'bin/run_consense',
             'bin/cleanup_consense',
+            'bin/relabel_tree',
+            'bin/update_tree',
+            'bin/phylip_worker',
+            'bin/phylip_archive',
+            'bin/run_pipeline',
             ],
         license='LICENSE.txt',
         description='Utilities to help with using PHYLIP',